@@ -3,6 +3,8 @@
 # %% auto 0
 __all__ = [
     "get_species_name",
+    "AnnotsPool",
+    "annots_pool",
     "get_annots",
     "is_protein_coding",
     "get_ts",
@@ -13,25 +15,33 @@ __all__ = [
     "map_back_feat_ids",
     "intersect_with_seqs",
     "intersect_with_feats",
+    "get_ts_store_path",
+    "build_ts_store",
+    "read_ts_store",
     "get_ts_data",
 ]
 
 # %% ../02_annots.ipynb 6
 ## helper functions
+import contextlib
 import logging
+import functools
+import os
 import roux.lib.df as rd  # noqa
+import numpy as np
 import pandas as pd
 
-
-from roux.stat.paired import get_diff_sorted
-
 from roux.lib.io import read_table, to_table
 from pathlib import Path
 
 try:
     from chrov.core import get_cache_dir_path
+    from chrov.cache import CacheIndex, cache_add, cache_exists, single_flight
+    from chrov.utils import to_table_atomic
 except:
     from dups.core import get_cache_dir_path
+    from dups.cache import CacheIndex, cache_add, cache_exists, single_flight
+    from dups.utils import to_table_atomic
 
 
 def get_species_name(species):
@@ -40,7 +50,7 @@ def get_species_name(species):
     return species
 
 
-def get_annots(
+def _open_annots(
     ensembl_release,
     species,
 ):
@@ -53,6 +63,127 @@ def get_annots(
     )
 
 
+def _share_connection(annots):
+    """Re-open the annotation database so that it can be read from any thread.
+
+    Falls back to the connection opened by pyensembl, if its internals differ.
+    """
+    import sqlite3
+
+    try:
+        db = annots.db
+        ## private to pyensembl
+        if not hasattr(db, "_connection"):
+            logging.warning("annotation database not shared across the threads: unknown pyensembl internals")
+            return annots
+        if db._connection is None and Path(db.local_db_path).exists():
+            ## checks the version of the database, then re-opened without the same-thread check
+            db.connection.close()
+            db._connection = sqlite3.connect(
+                db.local_db_path,
+                check_same_thread=False,
+            )
+    except Exception as e:
+        logging.warning(f"annotation database not opened: {e}")
+    return annots
+
+
+def _close_annots(annots):
+    db = getattr(annots, "_db", None)
+    if db is not None and getattr(db, "_connection", None) is not None:
+        db._connection.close()
+        db._connection = None
+    annots.clear_cache()
+
+
+class AnnotsPool:
+    """Process-wide pool of the pyensembl annotations keyed by (species, release).
+
+    The least recently used annotations are closed when the pool is full. Thread-safe for read-only use.
+
+    Examples:
+        with AnnotsPool(maxsize=2) as pool:
+            annots = pool.get(ensembl_release=112, species="homo sapiens")
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 4,
+        open_annots=_open_annots,
+    ):
+        from collections import OrderedDict
+        import threading
+
+        self.maxsize = maxsize
+        self.open_annots = open_annots
+        self._annots = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(
+        self,
+        ensembl_release,
+        species,
+    ):
+        key = (get_species_name(species).lower(), ensembl_release)
+        with self._lock:
+            if key in self._annots:
+                self._annots.move_to_end(key)
+                return self._annots[key]
+            annots = _share_connection(
+                self.open_annots(
+                    ensembl_release=ensembl_release,
+                    species=species,
+                )
+            )
+            self._annots[key] = annots
+            while len(self._annots) > self.maxsize:
+                _, annots_ = self._annots.popitem(last=False)
+                _close_annots(annots_)
+            return annots
+
+    def close(self):
+        """Close all the annotations in the pool."""
+        with self._lock:
+            while len(self._annots) != 0:
+                _, annots = self._annots.popitem(last=False)
+                _close_annots(annots)
+
+    def _after_fork(self):
+        ## the connections and the lock belong to the parent process
+        from collections import OrderedDict
+        import threading
+
+        self._annots = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._annots)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+annots_pool = AnnotsPool()
+## e.g. in the workers rendering the levels in parallel
+if hasattr(os, "register_at_fork"):
+    ## not available on Windows
+    os.register_at_fork(after_in_child=annots_pool._after_fork)
+
+
+def get_annots(
+    ensembl_release,
+    species,
+):
+    """Get the pyensembl annotations, shared across the calls from the `annots_pool`."""
+    return annots_pool.get(
+        ensembl_release=ensembl_release,
+        species=species,
+    )
+
+
 def is_protein_coding(
     t,
     strict=False,
@@ -85,33 +216,88 @@ def get_ts(
     return ts
 
 
+def _query_ts_feats(
+    ts: list,
+    feature: str,
+    cols: list,
+) -> dict:
+    """Query the features of the transcripts from the annotation database, in the order of the transcripts and then of the rows.
+
+    Args:
+        ts (list): transcripts e.g. of many genes, from the same annotations.
+        feature (str): table e.g. 'exon' or 'CDS'.
+        cols (list): columns.
+
+    Returns:
+        dict: arrays of the columns, and of the indices of the transcripts in `ts` (`t.index`).
+    """
+    ids = list(dict.fromkeys(t.id for t in ts))
+    rows = []
+    ## in chunks, within the limit of the parameters of SQLite
+    for i in range(0, len(ids), 900):
+        chunk = ids[i : i + 900]
+        rows += (
+            ts[0]
+            .db.connection.execute(
+                f"""SELECT transcript_id, rowid, {", ".join(f'"{c}"' for c in cols)} FROM "{feature}" WHERE transcript_id IN ({", ".join(["?"] * len(chunk))})""",
+                chunk,
+            )
+            .fetchall()
+        )
+    if len(rows) == 0:
+        return {"t.index": np.array([], dtype=np.int64), **{c: np.array([]) for c in cols}}
+    t_ids, rowids, *values = [np.array(x) for x in zip(*rows)]
+    ## a transcript can be repeated in `ts`
+    positions = {}
+    for i, t in enumerate(ts):
+        positions.setdefault(t.id, []).append(i)
+    if len(positions) == len(ts):
+        index = np.array([positions[k][0] for k in t_ids], dtype=np.int64)
+        take = np.arange(len(t_ids))
+    else:
+        counts = np.array([len(positions[k]) for k in t_ids])
+        index = np.concatenate([positions[k] for k in t_ids]).astype(np.int64)
+        take = np.repeat(np.arange(len(t_ids)), counts)
+    order = np.lexsort((rowids[take], index))
+    return {
+        "t.index": index[order],
+        **{c: v[take][order] for c, v in zip(cols, values)},
+    }
+
+
 def get_es(ts):
+    """Get the exons of the transcripts.
+
+    Args:
+        ts (list): transcripts e.g. of many genes, from the same annotations.
+
+    Returns:
+        pd.DataFrame: exons, sorted by the start positions.
+    """
+    feats = _query_ts_feats(ts, "exon", ["exon_number", "exon_id", "start", "end"])
+    ## in the order of the exon numbers, as in pyensembl's `Transcript.exons`
+    order = np.lexsort((feats["exon_number"].astype(np.int64), feats["t.index"]))
+    index = feats["t.index"][order]
     return (
         pd.DataFrame(
-            [
-                {
-                    "t.id": t.id,
-                    "t.length": t.length,
-                    "t.start": t.start,
-                    "t.end": t.end,
-                    "t.strand": t.strand,
-                    "e.start": e.start,
-                    "e.end": e.end,
-                    "e.id": e.id,
-                }
-                for t in ts
-                for e in t.exons
-            ]
+            {
+                "t.id": np.array([t.id for t in ts], dtype=object)[index],
+                "t.length": np.array([t.length for t in ts], dtype=np.int64)[index],
+                "t.start": np.array([t.start for t in ts], dtype=np.int64)[index],
+                "t.end": np.array([t.end for t in ts], dtype=np.int64)[index],
+                "t.strand": np.array([t.strand for t in ts], dtype=object)[index],
+                "e.start": feats["start"][order].astype(np.int64),
+                "e.end": feats["end"][order].astype(np.int64),
+                "e.id": feats["exon_id"][order].astype(object),
+            }
         )
-        ## longest first
-        .sort_values(["e.start"], ascending=[True])
         .assign(
             **{
-                "e.length": lambda df: df.apply(
-                    lambda x: get_diff_sorted(x["e.start"], x["e.end"]), axis=1
-                ),
+                "e.length": lambda df: np.abs(df["e.start"].to_numpy() - df["e.end"].to_numpy()),
             },
         )
+        ## longest first
+        .sort_values(["e.start"], ascending=[True])
     )
 
 
@@ -119,41 +305,41 @@ def get_cs(
     ts,
     strict=False,
 ):
-    return (
-        pd.DataFrame(
-            [
-                {
-                    "t.id": t.id,
-                    "t.cds": t.coding_sequence_position_ranges
-                    if is_protein_coding(t, strict=strict)
-                    else None,
-                }
-                for t in ts
-                for e in t.exons
-            ]
-        )
-        .explode("t.cds")
-        .set_index("t.id")["t.cds"]
-        .apply(pd.Series)
-        .reset_index()
-        .rename(
-            columns={
-                0: "c.start",
-                1: "c.end",
-            },
-            errors="raise",
-        )
-        .sort_values(["c.start"], ascending=[True])
-        .log.drop_duplicates()
-        .assign(
-            **{
-                "c.id": lambda df: df.apply(
-                    lambda x: f"{x['c.start']}-{x['c.end']}", axis=1
-                ),
-            }
-        )
-        .log.dropna()
-    )
+    """Get the CDSs of the transcripts.
+
+    Args:
+        ts (list): transcripts e.g. of many genes, from the same annotations.
+        strict (bool, optional): only the complete CDSs (see `is_protein_coding`). Defaults to False.
+
+    Returns:
+        pd.DataFrame: CDSs, sorted by the start positions.
+    """
+    coding = np.array([is_protein_coding(t, strict=strict) for t in ts], dtype=bool)
+    ts_coding = [t for t, c in zip(ts, coding) if c]
+    feats = _query_ts_feats(ts_coding, "CDS", ["start", "end"])
+    ## as in pyensembl's `Transcript.coding_sequence_position_ranges`
+    if len(np.unique(feats["t.index"])) != len(ts_coding):
+        t = ts_coding[sorted(set(range(len(ts_coding))) - set(feats["t.index"]))[0]]
+        raise ValueError(f"Transcript {t.id} does not contain feature CDS")
+    index, starts, ends = feats["t.index"], feats["start"].astype(np.int64), feats["end"].astype(np.int64)
+    ## the repeated ranges e.g. of the repeated transcripts, by the transcript ids rather than the positions in `ts`
+    t_codes = pd.factorize(np.array([t.id for t in ts_coding], dtype=object))[0][index]
+    order = np.lexsort((ends, starts, t_codes))
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (np.diff(t_codes[order]) != 0) | (np.diff(starts[order]) != 0) | (np.diff(ends[order]) != 0)
+    keep = np.sort(order[keep])
+    starts, ends = starts[keep], ends[keep]
+    if not coding.all():
+        ## the ranges as floats, as with the missing values of the non-coding transcripts
+        starts, ends = starts.astype(float), ends.astype(float)
+    return pd.DataFrame(
+        {
+            "t.id": np.array([t.id for t in ts_coding], dtype=object)[index[keep]],
+            "c.start": starts,
+            "c.end": ends,
+            "c.id": np.char.add(np.char.add(starts.astype(str), "-"), ends.astype(str)).astype(object),
+        }
+    ).sort_values(["c.start"], ascending=[True])
 
 
 def get_ranges(
@@ -162,6 +348,7 @@ def get_ranges(
     col_end="end",
     convert=True,  # convert to 0-based which is used by pyranges
     # convert=False, # convert to 0-based which is used by pyranges
+    col_chrom: str = None,  # e.g. sequence ids, to keep the ranges of the sequences apart
 ):
     import pyranges as pr
 
@@ -172,7 +359,7 @@ def get_ranges(
         )
         .astype({"Start": int, "End": int})
         .assign(
-            Chromosome="tmp",
+            Chromosome="tmp" if col_chrom is None else data[col_chrom].astype(str),
         )
     )
     if convert:
@@ -312,8 +499,14 @@ def intersect_with_seqs(
     feat2_start="c.start",
     feat2_end="c.end",
     feat2_prefix=None,
+    engine: str = "join",
     **kws_get_ranges,
 ):
+    """Intersect the features of the sequences e.g. exons with CDSs of the transcripts.
+
+    Args:
+        engine (str, optional): 'join': a single interval join with the sequence ids as the chromosomes, or 'groupby': intersect per sequence. Defaults to "join".
+    """
     if feat1_prefix is None:
         feat1_prefix = feat1_id.split(".")[0]
     if feat2_prefix is None:
@@ -324,28 +517,48 @@ def intersect_with_seqs(
     mapped_feat_end = f"{mapped_feat_prefix}.end"
     mapped_feat_length = f"{mapped_feat_prefix}.length"
 
-    df1_ = (
-        df1.groupby(
-            seq_id,
-            as_index=False,
+    kws_intersect = dict(
+        feat1_id=seq_id,
+        feat1_start=feat1_start,
+        feat1_end=feat1_end,
+        feat2_id=feat1_id,
+        feat2_start=feat2_start,
+        feat2_end=feat2_end,
+        **kws_get_ranges,
+    )
+    if engine == "join":
+        df2 = df2.loc[df2[seq_id].isin(df1[seq_id]), :]
+        df1_ = (
+            None
+            if len(df2) == 0
+            else intersect(
+                df1,
+                df2,
+                col_chrom=seq_id,
+                **kws_intersect,
+            )
         )
-        .apply(
-            lambda df: intersect(
-                df,
-                df2.query(expr=f"`{seq_id}` == '{df.name}'"),
-                feat1_id=seq_id,
-                feat1_start=feat1_start,
-                feat1_end=feat1_end,
-                feat2_id=feat1_id,
-                feat2_start=feat2_start,
-                feat2_end=feat2_end,
-                **kws_get_ranges,
+        if df1_ is not None:
+            df1_ = df1_.sort_values(seq_id, kind="stable").reset_index(drop=True)
+    elif engine == "groupby":
+        df1_ = (
+            df1.groupby(
+                seq_id,
+                as_index=False,
             )
+            .apply(
+                lambda df: intersect(
+                    df,
+                    df2.query(expr=f"`{seq_id}` == '{df.name}'"),
+                    **kws_intersect,
+                )
+            )
+            .reset_index(drop=True)
         )
-        .reset_index(drop=True)
-    )
+    else:
+        raise ValueError(engine)
     # print(df1_)
-    if len(df1_) == 0:
+    if df1_ is None or len(df1_) == 0:
         return
     else:
         return df1_.rename(
@@ -356,13 +569,14 @@ def intersect_with_seqs(
             errors="raise",
         ).assign(
             **{
-                mapped_feat_id: lambda df: df.apply(
-                    lambda x: f"{x[mapped_feat_start]}-{x[mapped_feat_end]}", axis=1
-                ),
-                mapped_feat_length: lambda df: df.apply(
-                    lambda x: get_diff_sorted(x[mapped_feat_start], x[mapped_feat_end]),
-                    axis=1,
+                mapped_feat_id: lambda df: (
+                    df[mapped_feat_start].astype(str)
+                    + "-"
+                    + df[mapped_feat_end].astype(str)
                 ),
+                mapped_feat_length: lambda df: (
+                    df[mapped_feat_start] - df[mapped_feat_end]
+                ).abs(),
             },
         )
 
@@ -440,6 +654,227 @@ def intersect_with_feats(
     return df4
 
 
+## store
+def _query_ts_tables(
+    annots,
+) -> dict:
+    """Query the exons and CDSs of all the transcripts from the annotation database.
+
+    Args:
+        annots: pyensembl annotations.
+
+    Returns:
+        dict: tables with the exons and CDSs.
+    """
+    con = annots.db.connection
+    col_biotype = (
+        "t.transcript_biotype"
+        if annots.db.column_exists("transcript", "transcript_biotype")
+        else "NULL"
+    )
+    df1 = pd.read_sql_query(
+        f"""
+        SELECT
+            t.seqname AS "chromosome",
+            t.gene_id AS "g.id",
+            t.transcript_id AS "t.id",
+            t.start AS "t.start",
+            t.end AS "t.end",
+            t.strand AS "t.strand",
+            {col_biotype} AS "t.biotype",
+            e.start AS "e.start",
+            e.end AS "e.end",
+            e.exon_id AS "e.id"
+        FROM exon e
+        INNER JOIN transcript t ON e.transcript_id = t.transcript_id
+        """,
+        con,
+    ).assign(
+        **{
+            ## span of the transcript, as in pyensembl's `Locus.length`
+            "t.length": lambda df: df["t.end"] - df["t.start"] + 1,
+        }
+    )
+    df2 = pd.read_sql_query(
+        """
+        SELECT
+            c.seqname AS "chromosome",
+            c.gene_id AS "g.id",
+            c.transcript_id AS "t.id",
+            c.start AS "c.start",
+            c.end AS "c.end"
+        FROM CDS c
+        """,
+        con,
+    )
+    return dict(
+        exons=df1,
+        cds=df2,
+    )
+
+
+def get_ts_store_path(
+    ensembl_release,
+    species,
+    **kws_get_cache,
+) -> str:
+    """Get the path of the genome-wide store of the exons and CDSs."""
+    cache_dir_path = get_cache_dir_path(
+        species=get_species_name(species),
+        ensembl_release=ensembl_release,
+        source="www.ensembl.org/pyensembl/",
+        **kws_get_cache,
+    )
+    return f"{cache_dir_path}/ts_store"
+
+
+def build_ts_store(
+    ensembl_release,
+    species,
+    annots=None,
+    rows_per_group: int = 10000,
+    force: bool = False,
+    **kws_get_cache,
+) -> str:
+    """Build the genome-wide store of the exons and CDSs of all the transcripts.
+
+    One-time step per species and release. The tables are saved in the parquet format, partitioned by chromosome and sorted by gene id, so that reading a gene's rows only touches its row groups.
+
+    Args:
+        ensembl_release (int): Ensembl release.
+        species (str): species name.
+        annots (optional): pyensembl annotations. Defaults to None.
+        rows_per_group (int, optional): rows per row group. Defaults to 10000.
+        force (bool, optional): over-write. Defaults to False.
+
+    Returns:
+        str: path of the store.
+    """
+    import shutil
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    outp = get_ts_store_path(
+        ensembl_release=ensembl_release,
+        species=species,
+        **kws_get_cache,
+    )
+    if Path(outp).exists() and not force:
+        logging.info(f"store exists: {outp}")
+        return outp
+
+    if annots is None:
+        annots = get_annots(
+            ensembl_release=ensembl_release,
+            species=species,
+        )
+    logging.info("querying the exons and CDSs ..")
+    dfs = _query_ts_tables(annots)
+    dfs["genes"] = dfs["exons"].loc[:, ["g.id", "chromosome"]].drop_duplicates()
+
+    ## written to a temporary directory and moved in place when complete
+    tmpp = f"{Path(outp).as_posix()}.tmp"
+    shutil.rmtree(tmpp, ignore_errors=True)
+    for k, df in dfs.items():
+        if k == "genes":
+            to_table(df, f"{tmpp}/{k}.pqt")
+            continue
+        ds.write_dataset(
+            pa.Table.from_pandas(
+                df.astype({"chromosome": str}).sort_values(
+                    ["chromosome", "g.id", "t.id"]
+                ),
+                preserve_index=False,
+            ),
+            f"{tmpp}/{k}",
+            format="parquet",
+            partitioning=["chromosome"],
+            partitioning_flavor="hive",
+            max_rows_per_group=rows_per_group,
+            min_rows_per_group=min(rows_per_group, 1000),
+        )
+    ## indexed and evicted from the cache as one entry
+    Path(f"{tmpp}/{CacheIndex.store_marker}").touch()
+    shutil.rmtree(outp, ignore_errors=True)
+    Path(tmpp).rename(outp)
+    cache_add(outp)
+    _read_ts_store_genes_cached.cache_clear()
+    logging.info(f"store saved: {outp}")
+    return outp
+
+
+@functools.lru_cache(maxsize=8)
+def _read_ts_store_genes_cached(
+    store_path: str,
+    signature: tuple,
+) -> dict:
+    return read_table(f"{store_path}/genes.pqt").set_index("g.id")["chromosome"].to_dict()
+
+
+def _read_ts_store_genes(
+    store_path: str,
+) -> dict:
+    """Map gene ids to the chromosomes in the store, read once per process until the store is re-built."""
+    stat = Path(f"{store_path}/genes.pqt").stat()
+    return _read_ts_store_genes_cached(store_path, (stat.st_ino, stat.st_size, stat.st_mtime_ns))
+
+
+def read_ts_store(
+    gene_id: str,
+    store_path: str,
+    protein_coding: bool = True,
+) -> tuple:
+    """Read the exons and CDSs of a gene from the store.
+
+    Args:
+        gene_id (str): gene id.
+        store_path (str): path of the store.
+        protein_coding (bool, optional): only protein-coding transcripts. Defaults to True.
+
+    Returns:
+        tuple: tables with exons and CDSs, formatted as the outputs of `get_es` and `get_cs`.
+    """
+    chrom = _read_ts_store_genes(store_path).get(gene_id)
+    assert chrom is not None, f"{gene_id} not found in {store_path}"
+    filters = [("chromosome", "==", chrom), ("g.id", "==", gene_id)]
+
+    df1 = pd.read_parquet(
+        f"{store_path}/exons",
+        filters=filters,
+    )
+    if protein_coding:
+        df1 = df1.loc[df1["t.biotype"] == "protein_coding", :]
+    ## the CDSs of the protein-coding transcripts only, as in `get_cs`
+    tids = df1.loc[df1["t.biotype"] == "protein_coding", "t.id"].unique()
+    df2 = pd.read_parquet(
+        f"{store_path}/cds",
+        filters=filters + [("t.id", "in", tids)],
+    )
+    df1 = (
+        df1.loc[
+            :,
+            ["t.id", "t.length", "t.start", "t.end", "t.strand", "e.start", "e.end", "e.id"],
+        ]
+        .sort_values(["e.start"], ascending=[True])
+        .assign(
+            **{
+                "e.length": lambda df: (df["e.start"] - df["e.end"]).abs(),
+            }
+        )
+    )
+    df2 = (
+        df2.loc[:, ["t.id", "c.start", "c.end"]]
+        .sort_values(["c.start"], ascending=[True])
+        .drop_duplicates()
+        .assign(
+            **{
+                "c.id": lambda df: df["c.start"].astype(str) + "-" + df["c.end"].astype(str),
+            }
+        )
+    )
+    return df1, df2
+
+
 ## cached
 def get_ts_data(
     gene_id,
@@ -450,6 +885,10 @@ def get_ts_data(
     force=False,
     **kws_get_cache,
 ):
+    """Get the exons and CDSs of the transcripts of a gene.
+
+    Read from the genome-wide store (see `build_ts_store`) if available and containing the gene, else from the per-gene cache or pyensembl.
+    """
     ## cache
     cache_dir_path = get_cache_dir_path(
         species=get_species_name(species),
@@ -458,20 +897,48 @@ def get_ts_data(
         **kws_get_cache,
     )
     cachep = f"{cache_dir_path}/{gene_id}/ts/protein_coding={protein_coding}.pqt"
+    store_path = get_ts_store_path(
+        ensembl_release=ensembl_release,
+        species=species,
+        **kws_get_cache,
+    )
+
+    ## the genes missing from the store e.g. built from the other annotations, fetched per gene
+    from_store = (
+        not force
+        and cache_exists(store_path)
+        and gene_id in _read_ts_store_genes(store_path)
+    )
+    ## computed once across the processes, unless read from the store
+    with (
+        contextlib.nullcontext(False)
+        if from_store
+        else single_flight(cachep, force=force)
+    ) as compute:
+        if from_store:
+            logging.info(f"read ts from store: {store_path}")
+            df1, df2 = read_ts_store(
+                gene_id=gene_id,
+                store_path=store_path,
+                protein_coding=protein_coding,
+            )
+        elif compute:
+            logging.info("fetching data")
+            ts = get_ts(
+                gene_id=gene_id,
+                ensembl_release=ensembl_release,
+                species=species,
+                protein_coding=protein_coding,
+            )
+            df1 = get_es(
+                ts=ts,
+            )
+            ## cds
+            df2 = get_cs(ts)
+        else:
+            logging.info(f"read ts from cache: {cachep}")
+            return read_table(cachep)
 
-    if (not Path(cachep).exists()) or force:
-        logging.info("fetching data")
-        ts = get_ts(
-            gene_id=gene_id,
-            ensembl_release=ensembl_release,
-            species=species,
-            protein_coding=protein_coding,
-        )
-        df1 = get_es(
-            ts=ts,
-        )
-        ## cds
-        df2 = get_cs(ts)
         ## mapping cds
         df3 = intersect_with_feats(
             df1,
@@ -486,13 +953,9 @@ def get_ts_data(
             feat2_end="c.end",
             feat2_prefix=cds_prefix,
         )
-        # if df3 is None:
-        #     return
-        to_table(
-            df3,
-            cachep,
-        )
-    else:
-        logging.info(f"read ts from cache: {cachep}")
-        df3 = read_table(cachep)
+        if not from_store:
+            to_table_atomic(
+                df3,
+                cachep,
+            )
     return df3
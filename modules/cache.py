@@ -0,0 +1,542 @@
+"""Index of the cached files, bounded in size by evicting the least recently used ones."""
+
+__all__ = [
+    "CacheIndex",
+    "get_cache_index",
+    "cache_exists",
+    "cache_add",
+    "lock_file",
+    "single_flight",
+    "stats",
+    "prune",
+    "verify",
+]
+
+import contextlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from chrov.utils import get_cache_dir, get_file_signature
+
+try:
+    import fcntl
+
+    ## the lock files can be removed, since an open file can be unlinked
+    _unlink_locks = True
+
+    def _lock(f):
+        ## POSIX locks, also across the hosts on NFS
+        fcntl.lockf(f, fcntl.LOCK_EX)
+
+    def _unlock(f):
+        fcntl.lockf(f, fcntl.LOCK_UN)
+
+except ImportError:  # Windows
+    import msvcrt
+
+    _unlink_locks = False
+
+    def _lock(f):
+        while True:
+            try:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+_units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def _to_bytes(
+    size,
+) -> int:
+    ## e.g. 10G
+    if size is None or isinstance(size, int):
+        return size
+    size = str(size).strip().upper().rstrip("B")
+    if size[-1:] in _units:
+        return int(float(size[:-1]) * _units[size[-1]])
+    return int(size)
+
+
+class CacheIndex:
+    """Index (SQLite) of the files in the cache directory, with their sizes and the last access times.
+
+    The lookups are answered from the index, without scanning the directory, and the hits are checked by a single `stat` of the file.
+    The files added or modified outside chrov are detected by `verify`.
+
+    Args:
+        cache_dir_path (str, optional): cache directory. Defaults to `get_cache_dir()`.
+        max_bytes (int|str, optional): size budget e.g. '10G', beyond which the least recently used files are evicted. Defaults to the `CHROV_CACHE_MAX_BYTES` environment variable, else unbounded.
+        wal (bool, optional): write-ahead log of SQLite, faster on the local disks but unsafe on the network file systems e.g. NFS. Defaults to the `CHROV_CACHE_WAL` environment variable, else False.
+    """
+
+    db_name = ".index.sqlite"
+    ## the directories with this file e.g. the genome-wide stores, indexed and evicted as one entry
+    store_marker = ".chrov-store"
+    ## an update rather than a replacement of the existing entries, which would bypass the triggers of the total size
+    _upsert = "INSERT INTO entries VALUES (?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, atime = excluded.atime"
+    ## seconds, within which the repeated accesses are not recorded, limiting the writes to the index
+    atime_resolution = 60
+
+    def __init__(
+        self,
+        cache_dir_path: str = None,
+        max_bytes=None,
+        wal: bool = None,
+    ):
+        ## without resolving the links, which would stat the parents
+        self.cache_dir_path = os.path.abspath(cache_dir_path or get_cache_dir())
+        self.max_bytes = _to_bytes(
+            max_bytes if max_bytes is not None else os.environ.get("CHROV_CACHE_MAX_BYTES")
+        )
+        if wal is None:
+            wal = os.environ.get("CHROV_CACHE_WAL", "").lower() in ["1", "true", "yes"]
+        self.wal = wal
+        self.db_path = os.path.join(self.cache_dir_path, self.db_name)
+        self._lock = threading.RLock()
+        self._connection, self._pid = None, None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        ## a connection per process, shared by the threads
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(self.cache_dir_path, exist_ok=True)
+            con = sqlite3.connect(
+                self.db_path,
+                timeout=60,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            if self.wal:
+                ## needs the shared memory, i.e. the same host
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+            else:
+                ## the rollback journal, locked by fcntl e.g. also on NFS
+                con.execute("PRAGMA journal_mode=DELETE")
+            con.execute("BEGIN IMMEDIATE")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, atime REAL NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)")
+            ## the total size, kept up to date by the triggers rather than summed on every write
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+            )
+            con.execute(
+                "INSERT OR IGNORE INTO totals VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM entries))"
+            )
+            for event, change in [
+                ("INSERT", "NEW.size"),
+                ("DELETE", "-OLD.size"),
+                ("UPDATE OF size", "NEW.size - OLD.size"),
+            ]:
+                con.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS entries_{event.split()[0].lower()} AFTER {event} ON entries BEGIN UPDATE totals SET size = size + {change} WHERE id = 0; END"
+                )
+            con.execute("COMMIT")
+            self._connection, self._pid = con, os.getpid()
+        return self._connection
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection, self._pid = None, None
+
+    def get_key(
+        self,
+        p: str,
+    ) -> str:
+        """Path relative to the cache directory, None if outside it."""
+        key = os.path.relpath(os.path.abspath(p), self.cache_dir_path)
+        if key == "." or key.startswith(".."):
+            return
+        return Path(key).as_posix()
+
+    def is_store(
+        self,
+        p: str,
+    ) -> bool:
+        """Whether a path is a directory store, indexed as one entry (see `store_marker`)."""
+        return os.path.isfile(os.path.join(p, self.store_marker))
+
+    def get_stat(
+        self,
+        p: str,
+    ) -> tuple:
+        """Size and modification time (ns) of a file, or of the files of a directory store."""
+        if not os.path.isdir(p):
+            stat = os.stat(p)
+            return stat.st_size, stat.st_mtime_ns
+        size, mtime_ns = 0, os.stat(p).st_mtime_ns
+        for root, _, names in os.walk(p):
+            for name in names:
+                stat = os.stat(os.path.join(root, name))
+                size, mtime_ns = size + stat.st_size, max(mtime_ns, stat.st_mtime_ns)
+        return size, mtime_ns
+
+    def exists(
+        self,
+        p: str,
+    ) -> bool:
+        """Whether a file is cached, answered from the index, and marked as accessed.
+
+        The files not in the index e.g. cached by an older version are added on the first lookup,
+        and the ones removed outside chrov e.g. to be re-fetched, are un-indexed.
+        """
+        key = self.get_key(p)
+        if key is None:
+            return Path(p).exists()
+        with self._lock:
+            row = self.db.execute("SELECT atime FROM entries WHERE path = ?", (key,)).fetchone()
+        if row is not None:
+            if not os.path.exists(p):
+                self.remove(p)
+                return False
+            now = time.time()
+            if now - row[0] >= self.atime_resolution:
+                with self._lock:
+                    self.db.execute("UPDATE entries SET atime = ? WHERE path = ?", (now, key))
+            return True
+        if os.path.isfile(p) or self.is_store(p):
+            self.add(p)
+            return True
+        ## e.g. the other directories, not indexed
+        return os.path.exists(p)
+
+    def add(
+        self,
+        p: str,
+    ) -> bool:
+        """Add a file written to the cache, or a directory store, and evict the least recently used ones beyond the budget.
+
+        Returns:
+            bool: whether the file is indexed i.e. inside the cache directory.
+        """
+        key = self.get_key(p)
+        if key is None:
+            return False
+        size, mtime_ns = self.get_stat(p)
+        with self._lock:
+            self.db.execute(
+                self._upsert,
+                (key, size, mtime_ns, time.time()),
+            )
+        if self.max_bytes is not None and self.get_size() > self.max_bytes:
+            self.prune(keep=[key])
+        return True
+
+    def remove(
+        self,
+        p: str,
+    ):
+        key = self.get_key(p)
+        if key is None:
+            return
+        with self._lock:
+            self.db.execute("DELETE FROM entries WHERE path = ?", (key,))
+
+    def get_size(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT size FROM totals WHERE id = 0").fetchone()[0]
+
+    def prune(
+        self,
+        max_bytes=None,
+        keep: list = [],
+        dry_run: bool = False,
+    ) -> list:
+        """Evict the least recently used files beyond the budget.
+
+        Args:
+            max_bytes (int|str, optional): size budget e.g. '10G'. Defaults to `self.max_bytes`.
+            keep (list, optional): keys not to be evicted e.g. of the file just written. Defaults to [].
+            dry_run (bool, optional): only list the files. Defaults to False.
+
+        Returns:
+            list: paths of the evicted files.
+        """
+        max_bytes = _to_bytes(max_bytes) if max_bytes is not None else self.max_bytes
+        if max_bytes is None:
+            return []
+        evicted = []
+        with self._lock:
+            ## the total and the selection in one transaction, consistent with the other processes
+            self.db.execute("BEGIN" if dry_run else "BEGIN IMMEDIATE")
+            try:
+                total = self.get_size()
+                if total > max_bytes:
+                    for key, size in self.db.execute("SELECT path, size FROM entries ORDER BY atime"):
+                        if total <= max_bytes:
+                            break
+                        if key in keep:
+                            continue
+                        evicted.append(key)
+                        total -= size
+                if not dry_run:
+                    ## un-indexed before removal, so that the lookups do not find the files being removed
+                    self.db.executemany("DELETE FROM entries WHERE path = ?", [(k,) for k in evicted])
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        if dry_run:
+            return [f"{self.cache_dir_path}/{key}" for key in evicted]
+        for key in evicted:
+            p = f"{self.cache_dir_path}/{key}"
+            try:
+                if os.path.isdir(p):
+                    ## the stores, whole
+                    shutil.rmtree(p)
+                else:
+                    os.remove(p)
+            except FileNotFoundError:
+                pass
+        logging.info(f"evicted {len(evicted)} files from the cache")
+        return [f"{self.cache_dir_path}/{key}" for key in evicted]
+
+    def stats(self):
+        """Summary of the cache, by the top-level directory e.g. the source of the data.
+
+        Returns:
+            pd.DataFrame: number of files, size in bytes and the last access time.
+        """
+        import pandas as pd
+
+        with self._lock:
+            df1 = pd.read_sql(
+                "SELECT path, size, atime FROM entries",
+                self.db,
+            )
+        return (
+            df1.assign(
+                **{
+                    "directory": lambda df: df["path"].str.split("/", n=1).str[0],
+                }
+            )
+            .groupby("directory")
+            .agg(
+                files=("path", "size"),
+                bytes=("size", "sum"),
+                accessed=("atime", "max"),
+            )
+            .sort_values("bytes", ascending=False)
+            .assign(
+                accessed=lambda df: pd.to_datetime(df["accessed"], unit="s").dt.floor("s"),
+            )
+            .reset_index()
+        )
+
+    def verify(
+        self,
+        dry_run: bool = False,
+    ) -> dict:
+        """Reconcile the index with the files in the cache directory.
+
+        Args:
+            dry_run (bool, optional): only count the differences. Defaults to False.
+
+        Returns:
+            dict: counts of the files missing from the directory, not in the index (untracked), and modified.
+        """
+        files = {}
+        for root, dirs, names in os.walk(self.cache_dir_path):
+            ## the directories being written e.g. of the stores
+            dirs[:] = [d for d in dirs if ".tmp" not in d]
+            if root != self.cache_dir_path and self.store_marker in names:
+                files[self.get_key(root)] = self.get_stat(root)
+                dirs[:] = []
+                continue
+            for name in names:
+                p = os.path.join(root, name)
+                ## the index, the locks and the partially written files
+                if name.startswith(self.db_name) or name.endswith(".lock") or ".tmp" in name:
+                    continue
+                key = self.get_key(p)
+                try:
+                    stat = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                files[key] = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entries = {
+                key: (size, mtime_ns)
+                for key, size, mtime_ns in self.db.execute(
+                    "SELECT path, size, mtime_ns FROM entries"
+                )
+            }
+            missing = [k for k in entries if k not in files]
+            untracked = [k for k in files if k not in entries]
+            modified = [k for k in files if k in entries and files[k] != entries[k]]
+            if not dry_run:
+                now = time.time()
+                self.db.execute("BEGIN IMMEDIATE")
+                self.db.executemany("DELETE FROM entries WHERE path = ?", [(k,) for k in missing])
+                self.db.executemany(
+                    self._upsert,
+                    [(k, *files[k], now) for k in untracked + modified],
+                )
+                self.db.execute("COMMIT")
+        return dict(
+            missing=len(missing),
+            untracked=len(untracked),
+            modified=len(modified),
+        )
+
+
+_indexes = {}
+
+
+def get_cache_index(
+    cache_dir_path: str = None,
+) -> CacheIndex:
+    """Get the index of a cache directory, one per process.
+
+    Args:
+        cache_dir_path (str, optional): cache directory. Defaults to `get_cache_dir()`.
+
+    Returns:
+        CacheIndex: index.
+    """
+    cache_dir_path = os.path.abspath(cache_dir_path or get_cache_dir())
+    if cache_dir_path not in _indexes:
+        _indexes[cache_dir_path] = CacheIndex(cache_dir_path)
+    return _indexes[cache_dir_path]
+
+
+def cache_exists(
+    p: str,
+) -> bool:
+    """Whether a file exists, looked up in the index if it is inside the cache directory (see `CacheIndex.exists`)."""
+    return get_cache_index().exists(p)
+
+
+def cache_add(
+    p: str,
+) -> bool:
+    """Index a file written inside the cache directory, ignored otherwise (see `CacheIndex.add`)."""
+    return get_cache_index().add(p)
+
+
+## the locks of the threads, since the file locks are held by the processes
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def lock_file(
+    p: str,
+):
+    """Hold the lock of a file, exclusive across the processes and the threads.
+
+    Args:
+        p (str): path of the file, locked through `{p}.lock`.
+    """
+    lockp = f"{os.path.abspath(p)}.lock"
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(lockp, threading.Lock())
+    with thread_lock:
+        os.makedirs(os.path.dirname(lockp), exist_ok=True)
+        while True:
+            f = open(lockp, "a+b")
+            _lock(f)
+            if _unlink_locks:
+                ## the lock of a file removed by the previous holder, retried on the current one
+                try:
+                    if os.stat(lockp).st_ino != os.fstat(f.fileno()).st_ino:
+                        raise FileNotFoundError(lockp)
+                except FileNotFoundError:
+                    _unlock(f)
+                    f.close()
+                    continue
+            break
+        try:
+            yield
+        finally:
+            if _unlink_locks:
+                ## removed while held, so that no other process holds it
+                try:
+                    os.remove(lockp)
+                except FileNotFoundError:
+                    pass
+            _unlock(f)
+            f.close()
+
+
+@contextlib.contextmanager
+def single_flight(
+    p: str,
+    force: bool = False,
+):
+    """Compute a cached file once, while the other processes wait for it and then read it.
+
+    Usage:
+        with single_flight(outp) as compute:
+            if compute:
+                ## written atomically e.g. by `to_table_atomic`
+                ...
+            else:
+                ## read
+                ...
+
+    Args:
+        p (str): path of the cached file.
+        force (bool, optional): re-compute, unless re-written by another process while waiting. Defaults to False.
+
+    Yields:
+        bool: whether to compute the file, else to read it.
+    """
+    if not force and cache_exists(p):
+        ## without the lock, since the files are replaced atomically
+        yield False
+        return
+    signature = get_file_signature(p)
+    with lock_file(p):
+        if force:
+            written = get_file_signature(p) not in [None, signature]
+        else:
+            written = cache_exists(p)
+        if written:
+            logging.info(f"written by another process: {p}")
+        yield not written
+
+
+## command line
+def stats(
+    cache_dir_path: str = None,
+):
+    """Show the size of the cache, by the source of the data."""
+    df1 = get_cache_index(cache_dir_path).stats()
+    return df1.to_string(index=False) if len(df1) != 0 else "empty cache"
+
+
+def prune(
+    max_bytes: str = None,
+    cache_dir_path: str = None,
+    dry_run: bool = False,
+):
+    """Evict the least recently used files beyond the size budget e.g. '10G' (default: CHROV_CACHE_MAX_BYTES)."""
+    index = get_cache_index(cache_dir_path)
+    evicted = index.prune(max_bytes=max_bytes, dry_run=dry_run)
+    return f"{'to be evicted' if dry_run else 'evicted'}: {len(evicted)} files, cache size: {index.get_size()} bytes"
+
+
+def verify(
+    cache_dir_path: str = None,
+    dry_run: bool = False,
+):
+    """Reconcile the index of the cache with the files."""
+    counts = get_cache_index(cache_dir_path).verify(dry_run=dry_run)
+    return ", ".join(f"{k}: {v}" for k, v in counts.items())
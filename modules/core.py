@@ -5,14 +5,20 @@ __all__ = [
     "to_ensembl_prefix",
     "get_ensembl_dataset_name",
     "get_cache_dir_path",
+    "get_biomart_query",
+    "biomart_dtypes",
+    "ingest_biomart_tsv",
+    "fetch_biomart_query",
+    "fetch_biomart_shards",
+    "biomart_renames",
+    "get_genes_path",
     "query_genes",
 ]
 
 # %% ../../dups/01_core.ipynb 3
 ## helper functions
+import io
 import logging
-import numpy as np
-from roux.lib.io import read_dict, to_table, read_table
 
 from pathlib import Path
 
@@ -20,6 +26,8 @@ try:
     from dups.utils import get_cache_dir
 except:
     from chrov.utils import get_cache_dir
+from chrov.utils import to_table_atomic
+from chrov.cache import cache_add, single_flight
 
 ## ensembl
 ## prefixes
@@ -84,6 +92,375 @@ def get_cache_dir_path(
     return f"{cache_dir_path}/{suffix}/"
 
 
+def get_biomart_query(
+    dataset_name: str,
+    attributes: list,
+    filters: dict,
+    completion_stamp: bool = False,
+) -> str:
+    """Get the XML query for BioMart.
+
+    Args:
+        dataset_name (str): name of the dataset.
+        attributes (list): attributes.
+        filters (dict): filters.
+        completion_stamp (bool): end the response with `[success]`, to detect the incomplete responses.
+
+    Returns:
+        str: XML query.
+    """
+    filter_str = ""
+    for k, v in filters.items():
+        if isinstance(v, list):
+            filter_str += f'<Filter name="{k}" value="{",".join(map(str, v))}"/>'
+        else:
+            filter_str += f'<Filter name="{k}" value="{v}"/>'
+
+    attributes_str = "".join(
+        [f'<Attribute name="{a}"/>' for a in sorted(set(attributes))]
+    )
+
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE Query>
+<Query virtualSchemaName="default" formatter="TSV" header="1" uniqueRows="1" datasetConfigVersion="0.6"{' completionStamp="1"' if completion_stamp else ''}>
+    <Dataset name="{dataset_name}" interface="default">
+        {filter_str}
+        {attributes_str}
+    </Dataset>
+</Query>'''
+
+
+## dtypes of the columns of the BioMart responses, by their display names; the other columns are inferred
+biomart_dtypes = {
+    "Chromosome/scaffold name": str,
+    "Strand": "Int8",
+    **{
+        k: "Int32"
+        for k in [
+            "Gene start (bp)",
+            "Gene end (bp)",
+            "Transcript start (bp)",
+            "Transcript end (bp)",
+            "Transcription start site (TSS)",
+            "Interpro start",
+            "Interpro end",
+        ]
+    },
+}
+
+
+class _BiomartResponse(io.RawIOBase):
+    """Readable stream of the chunks of a BioMart response, without the completion stamp."""
+
+    stamp = b"[success]"
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self._done = False
+        self.complete = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        ## the end of the response is held back until the stamp is checked
+        hold = len(self.stamp) + 2
+        while len(self._buffer) <= hold and not self._done:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                self._done = True
+                tail = self._buffer.rstrip()
+                if tail.endswith(self.stamp):
+                    self.complete = True
+                    self._buffer = tail[: -len(self.stamp)]
+        n = min(len(b), len(self._buffer) - (0 if self._done else hold))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def _promote_type(
+    t1,
+    t2,
+):
+    ## the type of a column, common to the chunks e.g. int and float to float
+    import pyarrow as pa
+
+    if t1 == t2 or pa.types.is_null(t2):
+        return t1
+    if pa.types.is_null(t1):
+        return t2
+    if pa.types.is_integer(t1) and pa.types.is_integer(t2):
+        return pa.int64()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in [t1, t2]):
+        return pa.float64()
+    return pa.string()
+
+
+def _unify_schemas(
+    schemas: list,
+    fixed: list = [],
+):
+    """Schema common to the tables, with the inferred types promoted and the `fixed` columns as in the first one."""
+    import pyarrow as pa
+
+    schema = schemas[0]
+    for other in schemas[1:]:
+        schema = pa.schema(
+            [
+                f
+                if f.name in fixed
+                else f.with_type(_promote_type(f.type, other.field(f.name).type))
+                for f in schema
+            ]
+        )
+    return schema
+
+
+def ingest_biomart_tsv(
+    f,
+    outp: str,
+    dtypes: dict = None,
+    chunksize: int = 100000,
+) -> str:
+    """Parse a BioMart TSV response in chunks, appended to a parquet file as row groups.
+
+    The peak memory is bounded by the size of the chunks rather than of the response.
+    The types of the other columns are inferred, and promoted across the chunks e.g. int to float if values are missing in a later chunk.
+
+    Args:
+        f: file-like object or path of the TSV.
+        outp (str): output path of the parquet file.
+        dtypes (dict): dtypes of the columns, `biomart_dtypes` if None. The categorical columns are saved as dictionary-encoded.
+        chunksize (int): number of the rows per chunk.
+
+    Returns:
+        str: output path.
+    """
+    import os
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if dtypes is None:
+        dtypes = biomart_dtypes
+    outp = Path(outp)
+    outp.parent.mkdir(parents=True, exist_ok=True)
+    ## written alternately, when the previous chunks are re-written with the promoted types
+    tmpps = [outp.with_name(f".{outp.stem}.{os.getpid()}.tmp{i}{outp.suffix}") for i in range(2)]
+    writer, schema = None, None
+    try:
+        for df in pd.read_csv(
+            f,
+            sep="\t",
+            chunksize=chunksize,
+            ## categories are encoded by parquet, consistently across the chunks
+            dtype={k: (str if v == "category" else v) for k, v in dtypes.items()},
+        ):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if schema is None:
+                schema = pa.schema(
+                    [
+                        pa.field(c.name, pa.dictionary(pa.int32(), pa.string()))
+                        if dtypes.get(c.name) == "category"
+                        ## missing in the first chunk
+                        else pa.field(c.name, pa.string())
+                        if c.type == pa.null() and c.name in dtypes
+                        else c
+                        for c in table.schema
+                    ]
+                )
+                writer = pq.ParquetWriter(tmpps[0], schema)
+            schema_ = _unify_schemas([schema, table.schema], fixed=list(dtypes))
+            if schema_ != schema:
+                writer.close()
+                tmpps = tmpps[::-1]
+                writer = pq.ParquetWriter(tmpps[0], schema_)
+                ## row group by row group, within the bounded memory
+                previous = pq.ParquetFile(tmpps[1])
+                for i in range(previous.num_row_groups):
+                    writer.write_table(previous.read_row_group(i).cast(schema_))
+                schema = schema_
+            writer.write_table(table.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    try:
+        os.replace(tmpps[0], outp)
+    finally:
+        for tmpp in tmpps:
+            if tmpp.exists():
+                tmpp.unlink()
+    return outp.as_posix()
+
+
+def fetch_biomart_query(
+    query: str,
+    outp: str,
+    url: str,
+    timeout: float = 600,
+    chunk_size: int = 2**20,
+    **kws_ingest,
+) -> str:
+    """Fetch the result of a BioMart query, parsed to a parquet file as it arrives.
+
+    Args:
+        query (str): XML query, with the completion stamp (see `get_biomart_query`).
+        outp (str): output path of the parquet file, written only if the response is complete.
+        url (str): URL of the BioMart service e.g. `https://www.ensembl.org/biomart/martservice`.
+        timeout (float): timeout in seconds.
+        chunk_size (int): size of the chunks of the response in bytes.
+        kws_ingest: parameters provided to `ingest_biomart_tsv`.
+
+    Returns:
+        str: output path.
+    """
+    import os
+    import requests
+
+    outp = Path(outp)
+    tmpp = outp.with_name(f".{outp.stem}.{os.getpid()}.response{outp.suffix}")
+    try:
+        with requests.post(
+            url, data={"query": query}, stream=True, timeout=timeout
+        ) as r:
+            r.raise_for_status()
+            f = _BiomartResponse(r.iter_content(chunk_size=chunk_size))
+            ingest_biomart_tsv(
+                io.BufferedReader(f, buffer_size=chunk_size),
+                outp=tmpp,
+                **kws_ingest,
+            )
+        if not f.complete:
+            raise ValueError("incomplete response from BioMart")
+        os.replace(tmpp, outp)
+    finally:
+        if tmpp.exists():
+            tmpp.unlink()
+    return outp.as_posix()
+
+
+def fetch_biomart_shards(
+    queries: dict,
+    outp: str,
+    url: str,
+    jobs: int = 4,
+    force: bool = False,
+    **kws_fetch,
+):
+    """Fetch the BioMart queries concurrently, each saved to its own part, so that a failed run resumes from the missing parts.
+
+    Args:
+        queries (dict): XML queries by the names of the shards.
+        outp (str): output path of the combined table.
+        url (str): URL of the BioMart service.
+        jobs (int): number of the concurrent queries.
+        force (bool): re-fetch all the shards.
+
+    Returns:
+        pd.DataFrame: combined table.
+    """
+    import shutil
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from concurrent.futures import ThreadPoolExecutor
+    from roux.lib.str import encode
+
+    parts_dir = Path(outp).with_suffix(".parts")
+    if force and parts_dir.exists():
+        shutil.rmtree(parts_dir)
+    ## the name of a part is specific to its query
+    partps = {
+        k: (parts_dir / f"{k}-{encode(q, short=True)}.pqt").as_posix()
+        for k, q in queries.items()
+    }
+
+    def fetch_part(k):
+        partp = partps[k]
+        if Path(partp).exists():
+            logging.info(f"part exists: {partp}")
+            return partp
+        return fetch_biomart_query(
+            queries[k],
+            outp=partp,
+            url=url,
+            **kws_fetch,
+        )
+
+    errors = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {k: executor.submit(fetch_part, k) for k in queries}
+        for k, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"failed to fetch the shard {k}: {e}")
+                errors[k] = e
+    if len(errors) != 0:
+        raise RuntimeError(
+            f"failed to fetch {len(errors)}/{len(queries)} shards ({list(errors)}); re-run to resume."
+        )
+
+    ## the types and the categories are unified across the parts
+    tables = [pq.read_table(partps[k]) for k in queries]
+    schema = _unify_schemas([t.schema for t in tables], fixed=list(biomart_dtypes))
+    df1 = (
+        pa.concat_tables([t.cast(schema) for t in tables])
+        .unify_dictionaries()
+        .to_pandas()
+    )
+    to_table_atomic(df1, outp)
+    shutil.rmtree(parts_dir)
+    return df1
+
+
+## names of the columns of the genes table, from the display names of the BioMart attributes in the cached tables
+biomart_renames = {
+    "Gene stable ID": "gene id",
+    "Chromosome/scaffold name": "chromosome",
+    "Gene name": "gene symbol",
+    "Gene description": "gene description",
+    "Ensembl Family Description": "gene family description",
+    "Transcript stable ID": "transcript id",
+    "Protein stable ID": "protein id",
+    "UniProtKB/Swiss-Prot ID": "protein id (UniProtKB/Swiss-Prot)",
+    "Peptide": "protein sequence",
+    "Gene start (bp)": "gene start",
+    "Gene end (bp)": "gene end",
+    "Strand": "gene strand",
+    "Gene type": "biotype",
+}
+
+
+def get_genes_path(
+    species,
+    release,
+    cols=[
+        "ensembl_gene_id",
+        "external_gene_name",
+        "chromosome_name",
+        "start_position",
+        "end_position",
+        "strand",
+    ],
+    cache_dir_path=None,
+    kws_get_cache={},
+) -> str:
+    """Get the path of the cached genes table, written by `query_genes`."""
+    from roux.lib.str import encode
+
+    if cache_dir_path is None:
+        cache_dir_path = get_cache_dir_path(
+            species=species,
+            ensembl_release=release,
+            source="www.ensembl.org/biomart",
+            **kws_get_cache,
+        )
+    return f"{cache_dir_path}{encode(dict(cols=cols), short=True)}.pqt"
+
+
 def query_genes(
     species,
     release,
@@ -103,8 +480,20 @@ def query_genes(
     force=False,
     filters={},
     kws_get_cache={},
+    jobs=None,
+    shard_by="chromosome_name",
+    shard_size=1,
     **kws_query,
 ):
+    """Query the genes from Ensembl BioMart.
+
+    Args:
+        jobs (int): number of the concurrent queries, split by the values of the `shard_by` filter. If None, the query is not split.
+        shard_by (str): filter to split the query by e.g. `chromosome_name` or `ensembl_gene_id`.
+        shard_size (int): number of the values of the `shard_by` filter per query.
+    """
+    from roux.lib.io import read_dict, read_table
+
     dataset_name = get_ensembl_dataset_name(species)
     logging.info(f"dataset_name={dataset_name} ..")
 
@@ -147,72 +536,62 @@ def query_genes(
     }
 
     # g: Cache file path
-    if cache_dir_path is None:
-        cache_dir_path = get_cache_dir_path(
-            species=species,
-            ensembl_release=release,
-            source="www.ensembl.org/biomart",
-            **kws_get_cache,
-        )
-        from roux.lib.str import encode
-
-        outp = f"{cache_dir_path}{encode(dict(cols=cols), short=True)}.pqt"
-
-    if not Path(outp).exists() or force:
-        # g: Build query XML
-        filter_str = ""
-        for k, v in filters.items():
-            if isinstance(v, list):
-                filter_str += f'<Filter name="{k}" value="{",".join(map(str, v))}"/>'
-            else:
-                filter_str += f'<Filter name="{k}" value="{v}"/>'
-
-        attributes_str = "".join(
-            [f'<Attribute name="{a}"/>' for a in np.unique(attributes)]
-        )
-
-        query = f'''<?xml version="1.0" encoding="UTF-8"?>
-<!DOCTYPE Query>
-<Query virtualSchemaName="default" formatter="TSV" header="1" uniqueRows="1" datasetConfigVersion="0.6">
-    <Dataset name="{dataset_name}" interface="default">
-        {filter_str}
-        {attributes_str}
-    </Dataset>
-</Query>'''
-
-        # g: Execute query
-        result = biomart.query(query, **kws_query)
-
-        # g: Parse result to DataFrame
-        from io import StringIO
-        import pandas as pd
-
-        df1 = pd.read_csv(StringIO(result), sep="\t")
+    outp = get_genes_path(
+        species=species,
+        release=release,
+        cols=cols,
+        cache_dir_path=cache_dir_path,
+        kws_get_cache=kws_get_cache,
+    )
 
-        if "Chromosome/scaffold name" in df1:
-            df1 = df1.astype({"Chromosome/scaffold name": str})
-        to_table(df1, outp)
-        logging.info(f"cache path: {outp}")
-    else:
-        logging.warning(f"read from cache: {outp}")
-        df1 = read_table(outp)
+    with single_flight(outp, force=force) as compute:
+        if compute and jobs is not None:
+            ## sharded and resumable
+            values = filters[shard_by]
+            if not isinstance(values, list):
+                values = [values]
+            queries = {
+                f"{shard_by}={i:05d}": get_biomart_query(
+                    dataset_name=dataset_name,
+                    attributes=attributes,
+                    filters={**filters, shard_by: values[i : i + shard_size]},
+                    completion_stamp=True,
+                )
+                for i in range(0, len(values), shard_size)
+            }
+            df1 = fetch_biomart_shards(
+                queries,
+                outp=outp,
+                url=biomart.url,
+                jobs=jobs,
+                force=force,
+            )
+            logging.info(f"cache path: {outp}")
+        elif compute:
+            # g: Build query XML
+            query = get_biomart_query(
+                dataset_name=dataset_name,
+                attributes=attributes,
+                filters=filters,
+                completion_stamp=True,
+            )
+
+            # g: Execute query, parsed to the cache as it arrives
+            fetch_biomart_query(
+                query,
+                outp=outp,
+                url=biomart.url,
+                **kws_query,
+            )
+            cache_add(outp)
+            df1 = read_table(outp)
+            logging.info(f"cache path: {outp}")
+        else:
+            logging.warning(f"read from cache: {outp}")
+            df1 = read_table(outp)
 
     return df1.rename(
-        columns={
-            "Gene stable ID": "gene id",
-            "Chromosome/scaffold name": "chromosome",
-            "Gene name": "gene symbol",
-            "Gene description": "gene description",
-            "Ensembl Family Description": "gene family description",
-            "Transcript stable ID": "transcript id",
-            "Protein stable ID": "protein id",
-            "UniProtKB/Swiss-Prot ID": "protein id (UniProtKB/Swiss-Prot)",
-            "Peptide": "protein sequence",
-            "Gene start (bp)": "gene start",
-            "Gene end (bp)": "gene end",
-            "Strand": "gene strand",
-            "Gene type": "biotype",
-        },
+        columns=biomart_renames,
         # errors="raise",
         errors="ignore",
     )
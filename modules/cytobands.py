@@ -0,0 +1,113 @@
+"""Registry of the cytobands of the reference genomes, loaded once per process."""
+
+__all__ = [
+    "register_cytobands",
+    "get_cytobands",
+    "get_genome_ends",
+]
+
+import functools
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+## bundled
+_assemblies = {
+    "GRCh38": Path(__file__).resolve().parent / "inputs" / "cytobands.tsv",
+}
+
+
+def register_cytobands(
+    assembly: str,
+    path: str,
+):
+    """Register the cytobands of an assembly, user-supplied.
+
+    Args:
+        assembly (str): name of the assembly e.g. 'GRCh38'.
+        path (str): path to the table, in the format of the bundled cytobands (`inputs/cytobands.tsv`).
+    """
+    _assemblies[assembly] = Path(path).resolve()
+    _read_cytobands.cache_clear()
+    _get_genome_ends.cache_clear()
+
+
+def _get_path(
+    assembly: str,
+) -> Path:
+    if assembly in _assemblies:
+        return _assemblies[assembly]
+    if Path(assembly).exists():
+        return Path(assembly).resolve()
+    raise ValueError(f"cytobands of {assembly} not found in {list(_assemblies)}")
+
+
+@functools.lru_cache(maxsize=None)
+def _read_cytobands(
+    path: Path,
+) -> pd.DataFrame:
+    from chrov.viz.chrom import format_chrom_names, sort_chrom_names
+
+    logging.info(f"reading cytobands from {path}")
+    df1 = pd.read_table(path, index_col=[0])
+    ## chromosomes as the categories in their order, the names unchanged
+    chroms = df1["chromosome"].astype(str)
+    df1["chromosome"] = pd.Categorical(
+        chroms,
+        categories=[str(k) for k in sort_chrom_names(format_chrom_names(chroms.unique()))],
+        ordered=True,
+    )
+    for c in ["p start", "q end", "start", "end"]:
+        if c in df1:
+            df1[c] = df1[c].astype(np.int32)
+    for c in ["cytoband type", "arm", "chromosome arm"]:
+        if c in df1:
+            df1[c] = df1[c].astype("category")
+    return df1.sort_values(["chromosome", "start"], kind="stable").reset_index(drop=True)
+
+
+def get_cytobands(
+    assembly: str = "GRCh38",
+) -> pd.DataFrame:
+    """Get the cytobands, read once per process into a typed table.
+
+    The chromosomes are ordered categories (numeric first), the coordinates int32, and the rows sorted by the chromosomes and the start positions.
+
+    Args:
+        assembly (str, optional): name of the assembly (see `register_cytobands`), or path to the table. Defaults to 'GRCh38' (bundled).
+
+    Returns:
+        pd.DataFrame: cytobands, a copy of the shared table.
+    """
+    return _read_cytobands(_get_path(assembly)).copy()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_genome_ends(
+    path: Path,
+) -> pd.Series:
+    from chrov.viz.chrom import format_chrom_names
+
+    df1 = _read_cytobands(path)
+    ends = df1.groupby("chromosome", observed=True, sort=True)["end"].max()
+    return pd.Series(
+        ends.astype(np.int64).cumsum().to_numpy(),
+        index=pd.Index(format_chrom_names(ends.index.astype(str)).tolist(), dtype=object, name="chromosome"),
+        name="genome end",
+    )
+
+
+def get_genome_ends(
+    assembly: str = "GRCh38",
+) -> pd.Series:
+    """Get the end positions of the chromosomes on the genome i.e. the chromosomes concatenated, precomputed once per process.
+
+    Args:
+        assembly (str, optional): name of the assembly, or path to the table. Defaults to 'GRCh38'.
+
+    Returns:
+        pd.Series: end positions, indexed by the formatted chromosome names (see `format_chrom_names`), to be used e.g. with `get_genome_offsets`.
+    """
+    return _get_genome_ends(_get_path(assembly)).copy()
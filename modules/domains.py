@@ -4,11 +4,15 @@
 __all__ = [
     "query_domains",
     "format_domains",
+    "get_domains_path",
     "get_domains",
     "get_ploc",
     "get_p_bounds",
     "get_protein_cds_coords",
+    "get_cds_ranges",
+    "map_ppos_to_gpos",
     "to_gpos",
+    "get_ds_data_path",
     "get_ds_data",
     "plot_domains",
     "annot_feats",
@@ -17,8 +21,7 @@ __all__ = [
 # %% ../../dups/04_domains.ipynb 5
 ## helper functions
 import logging
-
-logging.basicConfig(level=logging.INFO)
+from pathlib import Path
 
 import pandas as pd
 
@@ -33,10 +36,11 @@ except:
     pass
 
 from chrov.core import query_genes, get_cache_dir_path
+from chrov.utils import get_file_signature, to_table_atomic
+from chrov.cache import cache_exists, single_flight
 from chrov.annots import is_protein_coding, get_annots
-from chrov.annots import get_ts
+from chrov.annots import get_ts, get_ranges
 from chrov.isoforms import (
-    get_ranges,
     get_blocks,
     get_plot_data,
     set_plot_data,
@@ -46,6 +50,7 @@ from chrov.isoforms import (
     map_feats_to_blocks,
 )
 
+import functools
 from functools import partial
 
 query_domains = partial(
@@ -108,16 +113,15 @@ def format_domains(
     return df2_doms
 
 
-def get_domains(
+def get_domains_path(
     species,
     ensembl_release,
-    cache_dir_path=None,
     cols=["p.id", "d.id", "d.start", "d.end", "d.length"],
-    force=False,
+    min_length=10,
     **kws_get_cache,
-):
-    from pathlib import Path
-    from roux.lib.io import read_table, to_table
+) -> str:
+    """Get the path of the cached domains table."""
+    from roux.lib.str import encode
 
     cache_dir_path = get_cache_dir_path(
         species=species,
@@ -125,36 +129,69 @@ def get_domains(
         source="www.ensembl.org/biomart",
         **kws_get_cache,
     )
+    kws_encode = dict(cols=cols)
+    if min_length != 10:
+        ## encoded only if not the default, to keep the existing caches valid
+        kws_encode["min_length"] = min_length
+    return f"{cache_dir_path}{encode(kws_encode, short=True)}.pqt"
 
-    from roux.lib.str import encode
 
-    outp = f"{cache_dir_path}{encode(dict(cols=cols), short=True)}.pqt"
+def get_domains(
+    species,
+    ensembl_release,
+    cache_dir_path=None,
+    cols=["p.id", "d.id", "d.start", "d.end", "d.length"],
+    min_length=10,
+    force=False,
+    **kws_get_cache,
+):
+    if cache_dir_path is not None:
+        kws_get_cache["cache_dir_path"] = cache_dir_path
+    outp = get_domains_path(
+        species=species,
+        ensembl_release=ensembl_release,
+        cols=cols,
+        min_length=min_length,
+        **kws_get_cache,
+    )
 
-    if not Path(outp).exists() or force:
-        logging.warning("fetching domains..")
-        df0_doms = query_domains(
-            species=species,
-            release=ensembl_release,
-            verbose=False,
-        )
-        df1 = format_domains(
-            df0_doms,
-            min_length=10,
-        )
-        if df1["d.start"].min() == 0:
-            logging.warning(
-                "zero-based indexing found converted to 1-based since these are protein sequences.. "
+    with single_flight(outp, force=force) as compute:
+        if compute:
+            logging.warning("fetching domains..")
+            df0_doms = query_domains(
+                species=species,
+                release=ensembl_release,
+                verbose=False,
             )
-            df1["d.start"] = df1["d.start"] + 1
-        to_table(df1, outp)
-
-        logging.info(f"cache path: {outp}")
-    else:
-        logging.warning(f"read from cache: {outp}")
-        df1 = read_table(outp)
+            df1 = format_domains(
+                df0_doms,
+                min_length=min_length,
+            )
+            if df1["d.start"].min() == 0:
+                logging.warning(
+                    "zero-based indexing found converted to 1-based since these are protein sequences.. "
+                )
+                df1["d.start"] = df1["d.start"] + 1
+            to_table_atomic(df1, outp)
+
+            logging.info(f"cache path: {outp}")
+        else:
+            logging.warning(f"read from cache: {outp}")
+            df1 = _read_domains(outp, Path(outp).stat().st_mtime).copy(deep=False)
     return df1
 
 
+@functools.lru_cache(maxsize=2)
+def _read_domains(
+    path: str,
+    mtime: float,
+) -> pd.DataFrame:
+    """Read the cached domains table once per process e.g. for plotting many genes, until it is re-written (`mtime`)."""
+    from roux.lib.io import read_table
+
+    return read_table(path)
+
+
 def get_ploc(pids, **kws_annots):
     """
     Get protein location.
@@ -265,14 +302,239 @@ def get_protein_cds_coords(annots, protein_id: str, strict=True) -> pd.DataFrame
     )
 
 
+@functools.lru_cache(maxsize=2)
+def _read_codon_lengths(
+    db_path: str,
+    mtime: float,
+) -> dict:
+    """Number of the positions in the start and stop codons per transcript, read once per annotation database."""
+    import sqlite3
+
+    con = sqlite3.connect(db_path)
+    try:
+        tables = pd.read_sql_query(
+            "SELECT name FROM sqlite_master WHERE type='table'", con
+        )["name"].tolist()
+        return {
+            k: (
+                pd.read_sql_query(
+                    f'SELECT transcript_id AS "t.id", SUM(end - start + 1) AS "n" FROM {k} GROUP BY transcript_id',
+                    con,
+                ).set_index("t.id")["n"]
+                if k in tables
+                else pd.Series(dtype=int)
+            )
+            for k in ["start_codon", "stop_codon"]
+        }
+    finally:
+        con.close()
+
+
+def _query_cds_ranges(
+    annots,
+    protein_ids: list,
+    strict=True,
+    chunksize=900,
+) -> pd.DataFrame:
+    """Query the CDS ranges of many proteins from the annotation database.
+
+    The strand and contig are read once per protein along with the ranges. With `strict`, the transcripts need start and stop codons and a CDS length divisible by 3, as in pyensembl's `Transcript.complete`, except for the check of the sequence.
+    """
+    con = annots.db.connection
+    ## absent in the GTFs of the older releases, then none of the transcripts are protein-coding, as in pyensembl
+    col_biotype = (
+        "transcript_biotype"
+        if annots.db.column_exists("CDS", "transcript_biotype")
+        else "NULL"
+    )
+    protein_ids = list(protein_ids)
+    df1 = pd.concat(
+        [
+            pd.read_sql_query(
+                f"""
+                SELECT
+                    protein_id AS "p.id",
+                    transcript_id AS "t.id",
+                    {col_biotype} AS "t.biotype",
+                    seqname AS "chrom",
+                    strand,
+                    start AS "c.start",
+                    end AS "c.end"
+                FROM CDS
+                WHERE protein_id IN ({",".join(["?"] * len(ids))})
+                """,
+                con,
+                params=ids,
+            )
+            for ids in [
+                protein_ids[i : i + chunksize]
+                for i in range(0, max(len(protein_ids), 1), chunksize)
+            ]
+        ],
+        axis=0,
+    )
+    ## order of the input
+    df1 = df1.assign(
+        **{"p.id": pd.Categorical(df1["p.id"], categories=pd.Series(protein_ids, dtype=str).unique())}
+    ).query(expr="`t.biotype` == 'protein_coding'")
+    if strict:
+        ## number of the positions in the codons per transcript
+        db_path = annots.db.local_db_path
+        codons = {
+            k: v.reindex(df1["t.id"]).to_numpy()
+            for k, v in _read_codon_lengths(db_path, Path(db_path).stat().st_mtime).items()
+        }
+        length = (
+            (df1["c.end"] - df1["c.start"] + 1).groupby(df1["t.id"]).transform("sum")
+        )
+        complete = (
+            (codons["start_codon"] == 3)
+            & (codons["stop_codon"] > 0)
+            & (length % 3 == 0).to_numpy()
+        )
+        for k in df1.loc[~complete, "p.id"].unique():
+            logging.error(
+                f"Excluded protein id {k} because either it is not protein-coding or does not contain start and stop codons."
+            )
+        df1 = df1.loc[complete, :]
+    df1 = df1.assign(
+        _pos=lambda df: df["c.start"].where(df["strand"] == "+", -df["c.start"])
+    ).sort_values(["p.id", "_pos"])
+    assert (
+        ((df1["c.end"] - df1["c.start"] + 1).groupby(df1["p.id"], observed=True).sum() % 3 == 0).all()
+    ), "CDS length is not compatible with the protein sequence"
+    return (
+        df1.astype({"p.id": str, "c.start": int, "c.end": int})
+        .loc[:, ["p.id", "chrom", "strand", "c.start", "c.end"]]
+        .reset_index(drop=True)
+    )
+
+
+def get_cds_ranges(
+    annots,
+    protein_ids: list,
+    strict=True,
+    batch=False,
+) -> pd.DataFrame:
+    """Get the CDS ranges of the proteins, in the order of translation.
+
+    Args:
+        annots: pyensembl annotations
+        protein_ids (list): protein IDs
+        strict (bool): only the complete CDSs
+        batch (bool): query the ranges of all the proteins from the annotation database at once, instead of per transcript.
+
+    Returns:
+        pd.DataFrame: output table with a row per CDS range, and the offset of the range (`c.offset`, 0-based) within the CDS.
+    """
+    if batch:
+        df1 = _query_cds_ranges(
+            annots,
+            protein_ids=protein_ids,
+            strict=strict,
+        )
+        length = df1["c.end"] - df1["c.start"] + 1
+        return df1.assign(
+            **{
+                "c.offset": length.groupby(df1["p.id"]).cumsum() - length,
+            }
+        )
+    ranges = []
+    for protein_id in protein_ids:
+        t = annots.transcript_by_protein_id(protein_id)
+        if not is_protein_coding(
+            t,
+            strict=strict,
+        ):
+            logging.error(
+                f"Excluded protein id {protein_id} because either it is not protein-coding or does not contain start and stop codons."
+            )
+            continue
+        cds = sorted(t.coding_sequence_position_ranges, reverse=t.strand == "-")
+        assert (
+            sum([i[1] - i[0] + 1 for i in cds]) % 3 == 0
+        ), "CDS length is not compatible with the protein sequence"
+        ranges += [(protein_id, t.contig, t.strand, start, end) for start, end in cds]
+    df1 = pd.DataFrame(
+        ranges,
+        columns=["p.id", "chrom", "strand", "c.start", "c.end"],
+    ).astype({"c.start": int, "c.end": int})
+    length = df1["c.end"] - df1["c.start"] + 1
+    return df1.assign(
+        **{
+            "c.offset": length.groupby(df1["p.id"]).cumsum() - length,
+        }
+    )
+
+
+def map_ppos_to_gpos(
+    df_cds: pd.DataFrame,
+    protein_ids,
+    aa_pos,
+    pstart,
+) -> pd.Series:
+    """Map the protein positions to the genome coordinates, by interval arithmetic on the CDS ranges.
+
+    Args:
+        df_cds (pd.DataFrame): CDS ranges from `get_cds_ranges`.
+        protein_ids: protein IDs, one per position.
+        aa_pos: amino acid positions (1-based).
+        pstart: whether the position is the start of a feature, mapped to the first base of the codon, else to the last base.
+
+    Returns:
+        pd.Series: genome coordinates, missing if the position is outside of the protein.
+    """
+    import numpy as np
+
+    protein_ids = pd.Series(protein_ids).to_numpy()
+    aa_pos = pd.Series(aa_pos).to_numpy(dtype=float)
+    pstart = np.broadcast_to(np.asarray(pstart, dtype=bool), aa_pos.shape)
+
+    ## ranges of all the proteins laid end to end
+    start = df_cds["c.start"].to_numpy()
+    end = df_cds["c.end"].to_numpy()
+    length = end - start + 1
+    offset = np.cumsum(length) - length
+    is_first = df_cds["c.offset"].to_numpy() == 0
+    proteins = pd.Index(df_cds.loc[is_first, "p.id"])
+    protein_offset = offset[is_first]
+    protein_length = (
+        pd.Series(length).groupby(df_cds["p.id"].to_numpy()).sum().reindex(proteins).to_numpy()
+    )
+
+    ## 0-based position of the base in the CDS
+    nt_pos = np.where(pstart, (aa_pos - 1) * 3, aa_pos * 3 - 1)
+    pi = proteins.get_indexer(protein_ids)
+    valid = (pi != -1) & (nt_pos >= 0)
+    valid[valid] &= nt_pos[valid] < protein_length[pi[valid]]
+
+    nt_pos = (protein_offset[pi[valid]] + nt_pos[valid]).astype(int)
+    ri = np.searchsorted(offset, nt_pos, side="right") - 1
+    delta = nt_pos - offset[ri]
+    gpos = np.full(len(aa_pos), np.nan)
+    gpos[valid] = np.where(
+        df_cds["strand"].to_numpy()[ri] == "+",
+        start[ri] + delta,
+        end[ri] - delta,
+    )
+    return pd.Series(gpos)
+
+
 def to_gpos(
     df3,
     ensembl_release,
     species,
     cols_feats=["d.id", "d.start", "d.end"],
+    strict=True,
+    batch=False,
 ):
     """
     To the genome positions of the domains.
+
+    Args:
+        df3: domains of the proteins, of one or more genes.
+        strict (bool): only the complete CDSs.
+        batch (bool): query the CDS ranges of all the proteins at once, for mapping the domains of many genes.
     """
 
     for c in cols_feats:
@@ -295,54 +557,30 @@ def to_gpos(
     )
 
     ## map the aa pos to genome coord.s
-    # from beditor.lib.get_mutations import get_protein_cds_coords
-    df4_ = (
-        df3.groupby("p.id")
-        .apply(
-            lambda df: get_protein_cds_coords(
-                annots=annots,
-                protein_id=df.name,
-            )
-        )
-        .reset_index(0)
-    )
-    # print(df4_)
-
-    df4 = (
-        df4_.groupby(
-            [
-                "p.id",
-                "aa pos",
-            ]
-        )
-        .agg({"pos": list})
-        .reset_index()
+    df_cds = get_cds_ranges(
+        annots=annots,
+        protein_ids=df3["p.id"].unique(),
+        strict=strict,
+        batch=batch,
     )
-    # print(df4)
 
     ## merging
+    df5 = df3.melt(
+        id_vars=["t.id", "p.id", "d.id"],
+        value_vars=["d.start", "d.end"],
+        value_name="aa pos",
+    )
     df5 = (
-        df3.melt(
-            id_vars=["t.id", "p.id", "d.id"],
-            value_vars=["d.start", "d.end"],
-            value_name="aa pos",
-        )
-        .merge(
-            right=df4,
-            on=["p.id", "aa pos"],
-            how="inner",
-            validate="m:1",
-        )
-        .assign(
-            posi=lambda df: df.apply(
-                lambda x: get_p_bounds(
-                    pos=x["pos"],
-                    pstart=x["variable"].endswith("start"),
-                    strand=annots.transcript_by_protein_id(x["p.id"]).strand,
-                ),
-                axis=1,
-            )
+        df5.assign(
+            posi=map_ppos_to_gpos(
+                df_cds,
+                protein_ids=df5["p.id"],
+                aa_pos=df5["aa pos"],
+                pstart=df5["variable"].str.endswith("start"),
+            ).to_numpy(),
         )
+        .dropna(subset=["posi"])
+        .astype({"posi": int})
     )
 
     # print(df5)
@@ -384,100 +622,172 @@ def to_gpos(
 
 
 ## cache
-from pathlib import Path
+## to be incremented when the format of the cached domain layouts changes
+DS_CACHE_VERSION = 1
 
 
-def get_ds_data(
+def get_ds_data_path(
     gene_id,
     ensembl_release,
     species,
     layout,
     suffix,
-    # flt=None,#'longest',
-    force=False,
+    min_length=10,
     **kws_get_cache,
-):
-    ## cache
+) -> str:
+    """Get the path of the cached domain layout of a gene.
+
+    The file name is a hash of the parameters, the cache version and the signature of the domains table, so that the cache is invalidated when either changes.
+    """
+    from roux.lib.str import encode
+
     cache_dir_path = get_cache_dir_path(
         species=species,
         ensembl_release=ensembl_release,
         source="www.ensembl.org/pyensembl/",
         **kws_get_cache,
     )
-    cachep = f"{cache_dir_path}/{gene_id}/ps/layout={layout}.pqt"
+    key = encode(
+        dict(
+            version=DS_CACHE_VERSION,
+            ensembl_release=ensembl_release,
+            species=species,
+            layout=layout,
+            suffix=suffix,
+            min_length=min_length,
+            domains=get_file_signature(
+                get_domains_path(
+                    species=species,
+                    ensembl_release=ensembl_release,
+                    min_length=min_length,
+                    **kws_get_cache,
+                )
+            ),
+        ),
+        short=True,
+    )
+    return f"{cache_dir_path}/{gene_id}/ps/layout={layout}/{key}.pqt"
 
-    if (not Path(cachep).exists()) or force:
-        logging.info("fetching data for protein-coding transcripts")
-        # if not protein_coding:
-        #     # protein_coding=True
-        #     logging.warning(f"protein_coding set to True because biotype={biotype}")
-        logging.info("fetching domains data")
 
-        ## domains
-        df0_dom = get_domains(
+def get_ds_data(
+    gene_id,
+    ensembl_release,
+    species,
+    layout,
+    suffix,
+    min_length=10,
+    # flt=None,#'longest',
+    force=False,
+    **kws_get_cache,
+):
+    ## cache
+    kws_cache = dict(
+        gene_id=gene_id,
+        ensembl_release=ensembl_release,
+        species=species,
+        layout=layout,
+        suffix=suffix,
+        min_length=min_length,
+        **kws_get_cache,
+    )
+    ## the domains table first, since its signature keys the path to be locked and written
+    if not cache_exists(
+        get_domains_path(
             species=species,
             ensembl_release=ensembl_release,
+            min_length=min_length,
+            **kws_get_cache,
         )
-
-        ## Querying protein ids by gene id
-        ts = get_ts(
-            gene_id=gene_id,
-            ensembl_release=ensembl_release,
+    ):
+        get_domains(
             species=species,
-            protein_coding=True,
+            ensembl_release=ensembl_release,
+            min_length=min_length,
+            **kws_get_cache,
         )
+    cachep = get_ds_data_path(**kws_cache)
+
+    with single_flight(cachep, force=force) as compute:
+        if compute:
+            logging.info("fetching data for protein-coding transcripts")
+            # if not protein_coding:
+            #     # protein_coding=True
+            #     logging.warning(f"protein_coding set to True because biotype={biotype}")
+            logging.info("fetching domains data")
+
+            ## domains
+            df0_dom = get_domains(
+                species=species,
+                ensembl_release=ensembl_release,
+                min_length=min_length,
+                **kws_get_cache,
+            )
 
-        # if 'order' in kws_plot_seq_feats:
-        # if flt=='longest':
-        #     # =df3.sort_values('t.length',ascending=False).head(1)['t.id'].tolist()
-        #     ts=sorted(ts, key=lambda p: p.length)[-1:]
-
-        df_ = pd.DataFrame(
-            [(t.id, t.protein_id) for t in ts],
-            columns=[
-                "t.id",
-                "p.id",
-            ],
-        )
+            ## Querying protein ids by gene id
+            ts = get_ts(
+                gene_id=gene_id,
+                ensembl_release=ensembl_release,
+                species=species,
+                protein_coding=True,
+            )
 
-        ## map to domains
-        df1 = df_.merge(
-            right=df0_dom,
-            how="left",
-            on="p.id",
-            validate="1:m",
-        )
+            # if 'order' in kws_plot_seq_feats:
+            # if flt=='longest':
+            #     # =df3.sort_values('t.length',ascending=False).head(1)['t.id'].tolist()
+            #     ts=sorted(ts, key=lambda p: p.length)[-1:]
+
+            df_ = pd.DataFrame(
+                [(t.id, t.protein_id) for t in ts],
+                columns=[
+                    "t.id",
+                    "p.id",
+                ],
+            )
 
-        ### Mapping start and end of protein
-        df2 = get_ploc(
-            pids=df1["p.id"].unique(),
-            species=species,
-            ensembl_release=ensembl_release,
-        )
+            ## map to domains
+            df1 = df_.merge(
+                right=df0_dom,
+                how="left",
+                on="p.id",
+                validate="1:m",
+            )
 
-        df3 = df2.merge(
-            right=df1,
-            on="p.id",
-            how="inner",
-            validate="1:m",
-        ).sort_values(
-            ["p.end", "d.length"],
-            ascending=[True, False],
-        )
-        # df3.head(1)
-        if layout == "blocks":
-            df3 = get_blocks(
-                df3.log.dropna(),
-                col_start="d.start",
-                col_end="d.end",
-                col_block_start=f"d{suffix}.start",
-                col_block_end=f"d{suffix}.end",
+            ### Mapping start and end of protein
+            df2 = get_ploc(
+                pids=df1["p.id"].unique(),
+                species=species,
+                ensembl_release=ensembl_release,
             )
-    else:
-        from roux.lib.io import read_table
 
-        logging.info(f"read ts from cache: {cachep}")
-        df3 = read_table(cachep)
+            df3 = df2.merge(
+                right=df1,
+                on="p.id",
+                how="inner",
+                validate="1:m",
+            ).sort_values(
+                ["p.end", "d.length"],
+                ascending=[True, False],
+            )
+            # df3.head(1)
+            if layout == "blocks":
+                df3 = get_blocks(
+                    df3.log.dropna(),
+                    col_start="d.start",
+                    col_end="d.end",
+                    col_block_start=f"d{suffix}.start",
+                    col_block_end=f"d{suffix}.end",
+                )
+            logging.info(f"saving cache to {cachep}")
+            to_table_atomic(df3, cachep)
+            ## the cache of the previous versions, not keyed by the domains table
+            legacyp = Path(cachep).parent.with_suffix(".pqt")
+            if legacyp.exists():
+                legacyp.unlink()
+        else:
+            from roux.lib.io import read_table
+
+            logging.info(f"read ds from cache: {cachep}")
+            df3 = read_table(cachep)
     return df3
 
 
@@ -512,6 +822,8 @@ def plot_domains(
         feats=feats,
         force=force,
     )
+    ## drawn from the plot data e.g. the cached layout, without the recompute
+    from_plot_data = data is not None
 
     if layout == "blocks":
         suffix = "b"
@@ -573,7 +885,7 @@ def plot_domains(
         )
 
     elif biotype.startswith("t"):
-        if feats is None:
+        if feats is None and not from_plot_data:
             feats = to_gpos(
                 data,
                 ensembl_release=ensembl_release,
@@ -598,7 +910,11 @@ def plot_domains(
             color_feats=hue,
             # i/o
             feats=feats,
-            data=data if protein_coding else data_t,
+            data=(
+                set_plot_data(data, feats)
+                if from_plot_data
+                else (data if protein_coding else data_t)
+            ),
             return_data=return_data,
             force=force,
             ax=ax,
@@ -1,41 +1,243 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../../modules_nbs/fig_mat.ipynb.
 
 # %% auto 0
-__all__ = ["get_gid_info", "Plot_levels"]
+__all__ = ["get_gid_info", "read_level", "Plot_levels"]
 
 # %% ../../modules_nbs/fig_mat.ipynb 2
 import logging
 import matplotlib.pyplot as plt
 
 from chrov.utils import get_src_path
+from chrov.cache import cache_exists, cache_add
 
 import pandas as pd
+import numpy as np
 
 import functools
+import os
+from pathlib import Path
 
 # %run ../modules/plot/mat.py
 from chrov.plot.mat import plot_tri
 
 
+def _get_gid_info_annots(
+    gid,
+    species,
+    ensembl_release,
+    **kws_get_cache,
+):
+    ## only if the database is available locally, without downloading it
+    from chrov.annots import get_annots
+
+    annots = get_annots(ensembl_release=ensembl_release, species=species)
+    if annots is None or not annots.required_local_files_exist():
+        return
+    try:
+        g = annots.gene_by_id(gid)
+    except ValueError:
+        return
+    return dict(
+        id=g.id,
+        display_name=g.gene_name,
+        biotype=g.biotype,
+        seq_region_name=g.contig,
+        start=g.start,
+        end=g.end,
+        strand=1 if g.strand == "+" else -1,
+    )
+
+
+def _get_gid_info_index(
+    gid,
+    species,
+    ensembl_release,
+    **kws_get_cache,
+):
+    ## the genes table cached by `query_genes`, with the display names of the BioMart attributes
+    from chrov.core import get_genes_path, biomart_renames
+
+    genes_path = get_genes_path(
+        species=species,
+        release=ensembl_release,
+        kws_get_cache=kws_get_cache,
+    )
+    if not Path(genes_path).exists():
+        return
+    col_id = {v: k for k, v in biomart_renames.items()}["gene id"]
+    df1 = pd.read_parquet(genes_path, filters=[(col_id, "==", gid)]).rename(
+        columns=biomart_renames
+    )
+    if len(df1) == 0:
+        return
+    x = df1.iloc[0, :]
+    return dict(
+        id=gid,
+        display_name=x["gene symbol"],
+        seq_region_name=str(x["chromosome"]),
+        start=int(x["gene start"]),
+        end=int(x["gene end"]),
+        strand=int(x["gene strand"]),
+    )
+
+
 @functools.cache
-def get_gid_info(gid):
+def get_gid_info(
+    gid,
+    species="homo sapiens",
+    ensembl_release=112,
+    remote=True,
+    **kws_get_cache,
+):
+    """Get the metadata of a gene e.g. seq_region_name, start, end and strand.
+
+    Resolved locally from the pyensembl database or the genes table of `query_genes`, if available.
+    Else, looked up from the Ensembl REST API, and cached on disk.
+
+    Args:
+        gid (str): Ensembl gene id.
+        species (str, optional): species name. Defaults to "homo sapiens".
+        ensembl_release (int, optional): Ensembl release. Defaults to 112.
+        remote (bool, optional): look up from the REST API, if not found locally. Defaults to True.
+
+    Returns:
+        dict: metadata of the gene, as in the REST API.
+    """
+    for get_info in [_get_gid_info_annots, _get_gid_info_index]:
+        try:
+            info = get_info(
+                gid,
+                species=species,
+                ensembl_release=ensembl_release,
+                **kws_get_cache,
+            )
+        except Exception as e:
+            logging.warning(f"{get_info.__name__}: {e}")
+            info = None
+        if info is not None:
+            return info
+    ## fallback
+    import json
+    from chrov.core import get_cache_dir_path
+
+    cachep = Path(
+        get_cache_dir_path(
+            species=species,
+            source="rest.ensembl.org/lookup",
+            **kws_get_cache,
+        )
+    ) / f"{gid}.json"
+    if cache_exists(cachep):
+        return json.loads(cachep.read_text())
+    if not remote:
+        raise KeyError(f"{gid} not found locally")
     import requests
-    import sys
 
     server = "https://rest.ensembl.org"
     ext = f"/lookup/id/{gid}?format=full"
 
     r = requests.get(server + ext, headers={"Content-Type": "application/json"})
-
-    if not r.ok:
-        r.raise_for_status()
-        sys.exit()
+    r.raise_for_status()
 
     decoded = r.json()
     # print(repr(decoded))
+    cachep.parent.mkdir(parents=True, exist_ok=True)
+    tmpp = cachep.with_suffix(f".{os.getpid()}.tmp")
+    tmpp.write_text(json.dumps(decoded))
+    os.replace(tmpp, cachep)
+    cache_add(cachep)
     return decoded
 
 
+class _ArrowMatrix:
+    """Dense matrix in the columns of a memory-mapped Arrow table, sliced without reading the rest."""
+
+    def __init__(self, table):
+        self.table = table
+        self.shape = (table.num_rows, table.num_columns)
+
+    def __getitem__(self, key):
+        rows, cols = key
+        start, stop, _ = rows.indices(self.shape[0])
+        return np.column_stack(
+            [
+                self.table.column(i).slice(start, stop - start).to_numpy()
+                for i in range(*cols.indices(self.shape[1]))
+            ]
+        ).reshape(stop - start, -1)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[:, :], dtype=dtype)
+
+
+def read_level(
+    path: str,
+    cols_triplet: list = ["row", "col", "value"],
+    shape: tuple = None,
+):
+    """Read the matrix of a level, without loading more than needed.
+
+    Args:
+        path (str): path to the matrix, dense or sparse triplets (`cols_triplet`) in parquet (.pqt) or Arrow (.arrow, .feather), or dense numpy (.npy).
+        cols_triplet (list, optional): columns of the sparse triplets. Defaults to ['row', 'col', 'value'].
+        shape (tuple, optional): shape of the sparse matrix, including the trailing empty rows and columns. Defaults to the `shape` in the metadata of the schema e.g. b'[1000, 1000]', else inferred from the largest indices.
+
+    Returns:
+        matrix: `pd.DataFrame` (dense parquet), `scipy.sparse.coo_matrix` (triplets), memory-mapped `np.ndarray` (.npy), or columns of a memory-mapped Arrow table.
+    """
+    path = Path(path)
+    if path.suffix == ".npy":
+        return np.load(path, mmap_mode="r")
+    if path.suffix in [".arrow", ".feather"]:
+        import pyarrow as pa
+
+        table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+        columns = table.column_names
+    else:
+        import pyarrow.parquet as pq
+
+        table, schema = None, pq.read_schema(path)
+        columns = schema.names
+    if set(cols_triplet) <= set(columns):
+        from scipy.sparse import coo_matrix
+
+        if table is None:
+            table = pq.read_table(path, columns=cols_triplet)
+        else:
+            schema = table.schema
+        row, col, value = [table.column(c).to_numpy() for c in cols_triplet]
+        if shape is None and b"shape" in (schema.metadata or {}):
+            import json
+
+            shape = json.loads(schema.metadata[b"shape"])
+        if shape is None:
+            ## the trailing empty rows and columns are not known
+            n = int(max(row.max(), col.max())) + 1 if len(row) else 0
+            shape = (n, n)
+        return coo_matrix((value, (row, col)), shape=tuple(shape))
+    if table is not None:
+        return _ArrowMatrix(table)
+    from roux.lib.io import read_table
+
+    return read_table(str(path))
+
+
+_plot_levels, _levels = None, None
+
+
+def _init_worker(plot_levels, levels):
+    ## inherited by the forked workers, not pickled
+    global _plot_levels, _levels
+    plt.switch_backend("Agg")
+    _plot_levels, _levels = plot_levels, levels
+
+
+def _plot_level(level, kws_level):
+    ax, plotp = _plot_levels.plot_level(level, _levels[level], **kws_level)
+    plt.close(ax.figure)
+    return plotp
+
+
 class Plot_levels:
     def __init__(
         self,
@@ -53,13 +255,15 @@ class Plot_levels:
         self.species = species
         self.ensembl_release = ensembl_release
 
-        cytobands = pd.read_table(
-            f"{get_src_path()}/modules/{self.in_dir_name}/cytobands.tsv",
-            index_col=[0],
-        )
+        from chrov.cytobands import get_cytobands
+
+        ## read once per process, shared by the genes
+        cytobands = get_cytobands(f"{get_src_path()}/modules/{self.in_dir_name}/cytobands.tsv")
 
         mdata_gid = get_gid_info(
-            gid="ENSG00000187634",
+            gid=gene_id,
+            species=species,
+            ensembl_release=ensembl_release,
         )
         self.chrom = mdata_gid["seq_region_name"]
 
@@ -183,6 +387,99 @@ class Plot_levels:
 
         self.domain = domain
 
+        def share_data():
+            """Fetch the data of the levels once, so that the workers do not query it again."""
+            from chrov.domains import get_ds_data, to_gpos
+
+            for level, layout in [("gene", None), ("isoform", "blocks")]:
+                ## as in `plot_forms`
+                feats = to_gpos(
+                    get_ds_data(
+                        layout=layout,
+                        suffix="b" if layout == "blocks" else "",
+                        **kws_domains,
+                    ),
+                    ensembl_release=ensembl_release,
+                    species=species,
+                )
+                if feats is not None:
+                    setattr(
+                        self,
+                        level,
+                        partial(
+                            getattr(self, level),
+                            feats=feats.loc[:, ["t.id", "d.id", "d.start", "d.end"]],
+                        ),
+                    )
+
+        self.share_data = share_data
+
+        def plot_level(
+            level: str,
+            matrix,
+            height_ratios=[3, 1],
+            show_title=False,
+            figsize=[3, 1.5],
+            outd=None,
+            kws_to_plot={},
+            **kws_mat,
+        ):
+            from roux.viz.io import to_plot
+
+            ## loaded just before drawing
+            if isinstance(matrix, (str, Path)):
+                matrix = read_level(matrix)
+            fig, axd = plt.subplot_mosaic(
+                [["data"], ["region"]],
+                height_ratios=height_ratios,
+                # sharex=True,
+                # wspace=0,
+                figsize=figsize,
+            )
+            # ax=plot_genome(
+            ax = getattr(
+                # plot_levels,
+                self,
+                level,
+            )(
+                ax=axd["region"],
+            )
+            _ = ax.set(
+                # ylim=[-0.1,0.1],
+                xticks=[],
+                xticklabels=[],
+                xlabel=None,
+            )
+            # axd['region'].plot([0,1],[0,1])
+            # axd['data'].plot([0,1],[0,1])
+            ax = plot_tri(
+                matrix,
+                # cmap='Blues',
+                ax=axd["data"],
+                proportional=False,
+                **kws_mat,
+            )
+            if show_title:
+                ax.set_title(
+                    level,
+                    va="top",
+                    y=0.75,
+                )
+            plt.subplots_adjust(hspace=0.05)
+            plotp = None
+            if outd is not None:
+                plotp = to_plot(
+                    **{
+                        **dict(
+                            plotp=f"{outd}/{level}.png",
+                        ),
+                        **kws_to_plot,
+                    }
+                )
+            return ax, plotp
+
+        self.plot_level = plot_level
+
         def plot(
             levels: dict,
             height_ratios=[3, 1],
@@ -194,56 +491,74 @@ class Plot_levels:
             kws_to_plot={},
             **kws_mat,
         ):
-            from roux.viz.io import to_plot
+            """Plot the levels, one figure each.
 
-            for level in levels:
-                fig, axd = plt.subplot_mosaic(
-                    [["data"], ["region"]],
-                    height_ratios=height_ratios,
-                    # sharex=True,
-                    # wspace=0,
-                    figsize=figsize,
-                )
-                # ax=plot_genome(
-                ax = getattr(
-                    # plot_levels,
-                    self,
+            Args:
+                levels (dict): matrices (or paths, see `read_level`) by the levels.
+
+            Returns:
+                plt.Axes: subplot of the last level.
+            """
+            for i, level in enumerate(levels):
+                ax, plotp = plot_level(
                     level,
-                )(
-                    ax=axd["region"],
-                )
-                _ = ax.set(
-                    # ylim=[-0.1,0.1],
-                    xticks=[],
-                    xticklabels=[],
-                    xlabel=None,
-                )
-                # axd['region'].plot([0,1],[0,1])
-                # axd['data'].plot([0,1],[0,1])
-                ax = plot_tri(
                     levels[level],
-                    # cmap='Blues',
-                    ax=axd["data"],
-                    proportional=False,
+                    height_ratios=height_ratios,
+                    show_title=show_title,
+                    figsize=figsize,
+                    outd=outd,
+                    kws_to_plot=kws_to_plot,
                     **kws_mat,
                 )
-                if show_title:
-                    ax.set_title(
-                        level,
-                        va="top",
-                        y=0.75,
-                    )
-                plt.subplots_adjust(hspace=0.05)
-                if outd is not None:
-                    to_plot(
-                        **{
-                            **dict(
-                                plotp=f"{outd}/{level}.png",
-                            ),
-                            **kws_to_plot,
-                        }
-                    )
+                if plotp is not None and i < len(levels) - 1:
+                    plt.close(ax.figure)
                 # break
             return ax
 
         self.plot = plot
+
+        def to_plots(
+            levels: dict,
+            outd: str,
+            jobs: int = 1,
+            **kws_level,
+        ) -> list:
+            """Save the plots of the levels, one figure each.
+
+            Args:
+                levels (dict): matrices (or paths, see `read_level`) by the levels.
+                outd (str): output directory.
+                jobs (int, optional): render the levels in parallel processes. Defaults to 1.
+                kws_level: parameters of `plot_level`.
+
+            Returns:
+                list: output paths in the order of the levels.
+            """
+            kws_level = dict(outd=outd, **kws_level)
+            if jobs == 1:
+                plotps = []
+                for level in levels:
+                    ax, plotp = plot_level(level, levels[level], **kws_level)
+                    plt.close(ax.figure)
+                    plotps.append(plotp)
+                return plotps
+            self.share_data()
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            ## the workers are forked, sharing the data fetched above and the levels; only the names of the levels are sent
+            with ProcessPoolExecutor(
+                max_workers=min(jobs, len(levels)),
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_worker,
+                initargs=(self, levels),
+            ) as executor:
+                return list(
+                    executor.map(
+                        _plot_level,
+                        list(levels),
+                        [kws_level] * len(levels),
+                    )
+                )
+
+        self.to_plots = to_plots
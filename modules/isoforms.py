@@ -3,6 +3,7 @@
 # %% auto 0
 __all__ = [
     "get_blocks",
+    "get_blocks_batch",
     "map_feats_to_blocks",
     "plot_seq_feats",
     "get_plot_data",
@@ -15,17 +16,107 @@ __all__ = [
 
 import logging
 import roux.lib.df as rd  # noqa
+import numpy as np
 import pandas as pd
 
 import matplotlib.pyplot as plt
 
-from roux.stat.paired import get_diff_sorted
 from roux.stat.transform import rescale
 
 try:
-    from chrov.annots import get_ranges, intersect_with_feats, get_ts_data
+    from chrov.annots import intersect_with_feats, get_ts_data
 except:
-    from dups.annots import get_ranges, intersect_with_feats, get_ts_data
+    from dups.annots import intersect_with_feats, get_ts_data
+
+
+def _cluster_ranges(
+    df: pd.DataFrame,
+    col_start: str,
+    col_end: str,
+    col_group: str = None,
+) -> pd.DataFrame:
+    """Cluster the overlapping (or book-ended) ranges, per group if provided.
+
+    Equivalent to `PyRanges.cluster` followed by `merge(by="Cluster")`, with the cluster ids restarting from 1 in each group.
+
+    Args:
+        df (pd.DataFrame): unique ranges.
+        col_start (str): column with start positions.
+        col_end (str): column with end positions.
+        col_group (str, optional): column with the group ids e.g. gene ids. Defaults to None.
+
+    Returns:
+        pd.DataFrame: ranges with the `b.id`, `b.start` and `b.end` columns.
+    """
+    ## sorted copy, the input order is restored at the end
+    df = df.sort_values(
+        ([] if col_group is None else [col_group]) + [col_start, col_end]
+    )
+    groups = (
+        pd.Series(0, index=df.index)
+        if col_group is None
+        else df.groupby(col_group, sort=False).ngroup()
+    )
+    ## running max. of the ends of the previous ranges in the group
+    ends_prev = df[col_end].groupby(groups).cummax().groupby(groups).shift()
+    is_new = ends_prev.isnull() | (df[col_start] > ends_prev)
+    keys = ([] if col_group is None else [col_group]) + ["b.id"]
+    return (
+        df.assign(
+            **{
+                "b.id": is_new.astype(int).groupby(groups).cumsum(),
+            }
+        )
+        .assign(
+            **{
+                "b.start": lambda df: df.groupby(keys)[col_start].transform("min"),
+                "b.end": lambda df: df.groupby(keys)[col_end].transform("max"),
+            }
+        )
+        .sort_index()
+    )
+
+
+def _get_block_coords(
+    df: pd.DataFrame,
+    col_start: str,
+    col_end: str,
+    col_block_start: str,
+    col_block_end: str,
+) -> pd.DataFrame:
+    """Project the ranges onto their blocks with array arithmetic.
+
+    Args:
+        df (pd.DataFrame): ranges with the `b.id`, `b.start` and `b.end` columns.
+
+    Returns:
+        pd.DataFrame: with the `b.length` and `eb.*` columns.
+    """
+    bid = df["b.id"].to_numpy()
+    bstart, bend = df["b.start"].to_numpy(), df["b.end"].to_numpy()
+    start, end = df[col_start].to_numpy(), df[col_end].to_numpy()
+
+    blength = np.abs(bstart - bend)
+    block_start = bid + (np.abs(start - bstart) / blength)
+    block_end_raw = (bid + 1) - (np.abs(end - bend) / blength)
+    block_end = rescale(
+        block_end_raw,
+        range1=[bid, bid + 1],
+        range2=[bid, bid + 0.9],
+    )
+    return df.assign(
+        **{
+            "b.length": blength,
+            "eb.overlap": np.minimum(1, np.abs(start - end) / blength),
+            col_block_start: block_start,
+            f"{col_block_end} raw": block_end_raw,
+            col_block_end: block_end,
+            "eb.id": lambda df: (
+                df[col_block_start].astype(str) + "-" + df[col_block_end].astype(str)
+            ),
+            "eb.length": np.abs(block_start - block_end),
+        }
+    )
 
 
 def get_blocks(
@@ -34,16 +125,24 @@ def get_blocks(
     col_end="e.end",
     col_block_start="eb.start",
     col_block_end="eb.end",
+    col_group: str = None,
     # col_strand='t.strand',
 ) -> pd.DataFrame:
+    """Get the blocks of the overlapping ranges e.g. exons.
+
+    Args:
+        df1 (pd.DataFrame): input table.
+        col_start (str, optional): column with start positions. Defaults to "e.start".
+        col_end (str, optional): column with end positions. Defaults to "e.end".
+        col_block_start (str, optional): output column with block start positions. Defaults to "eb.start".
+        col_block_end (str, optional): output column with block end positions. Defaults to "eb.end".
+        col_group (str, optional): column with group ids e.g. gene ids, blocks are computed per group. Defaults to None.
+
+    Returns:
+        pd.DataFrame: output table.
+    """
     if df1[col_start].isnull().all() or df1[col_end].isnull().all():
         logging.warning("missing feats data")
-        # df1=df1.assign(
-        #     **{
-        #         col_block_start : col_start,
-        #         col_block_end : col_end,
-        #     }
-        # )
         # logging.warning("feats set to 1 block")
         return df1.drop(
             [
@@ -56,132 +155,69 @@ def get_blocks(
     ## no features
     df2_ = df1.query(expr=f"`{col_start}`.isnull()")
 
-    gr = (
+    cols_keys = ([] if col_group is None else [col_group]) + [col_start, col_end]
+    df2 = (
         df1.dropna(
             subset=[col_start],
         )
-        .loc[
-            :,
-            [
-                col_start,
-                col_end,
-                # col_strand,
-            ],
-        ]
+        .loc[:, cols_keys]
         .log.drop_duplicates()
+        .astype({col_start: int, col_end: int})
         .pipe(
-            get_ranges,
+            _cluster_ranges,
             col_start=col_start,
             col_end=col_end,
-            convert=False,
-        )
-    )
-    # gr.head(1)
-
-    gr_clu = gr.cluster(
-        # count=True
-    )
-    # gr_clu.head(1)
-
-    gr_mer = gr_clu.merge(by="Cluster")
-    # gr_mer.head(1)
-
-    df2 = (
-        gr.as_df()
-        .log.merge(
-            right=gr_clu.as_df(),
-            how="inner",
-            on=[
-                "Start",
-                "End",
-                # 'Strand',
-                "Chromosome",
-            ],
-            validate="1:1",
-        )
-        .drop(["Chromosome"], axis=1)
-        .log.merge(
-            right=(
-                gr_mer.as_df()
-                .loc[:, ["Start", "End", "Cluster"]]
-                .rename(
-                    columns={
-                        "Start": "b.start",
-                        "End": "b.end",
-                    },
-                    errors="raise",
-                )
-            ),
-            how="inner",
-            on="Cluster",
-            validate="m:1",
-        )
-        .rename(
-            columns={
-                "Cluster": "b.id",
-                "Start": col_start,
-                "End": col_end,
-                # 'Strand':col_strand,
-            },
-            errors="raise",
+            col_group=col_group,
         )
         .merge(
             right=df1,
-            on=[
-                # col_strand,
-                col_start,
-                col_end,
-            ],
+            on=cols_keys,
             how="inner",
             validate="1:m",
         )
         .sort_index(axis=1)
-        .assign(
-            **{
-                "b.length": lambda df: df.apply(
-                    lambda x: get_diff_sorted(x["b.start"], x["b.end"]), axis=1
-                ),
-                "eb.overlap": lambda df: df.apply(
-                    lambda x: min(
-                        [1, get_diff_sorted(x[col_start], x[col_end]) / x["b.length"]]
-                    ),
-                    axis=1,
-                ),
-                col_block_start: lambda df: df.apply(
-                    lambda x: (
-                        x["b.id"]
-                        + (get_diff_sorted(x[col_start], x["b.start"]) / x["b.length"])
-                    ),
-                    axis=1,
-                ),
-                f"{col_block_end} raw": lambda df: df.apply(
-                    lambda x: (
-                        (x["b.id"] + 1)
-                        - (get_diff_sorted(x[col_end], x["b.end"]) / x["b.length"])
-                    ),
-                    axis=1,
-                ),
-                col_block_end: lambda df: df.apply(
-                    lambda x: rescale(
-                        [x[col_block_start], x[f"{col_block_end} raw"]],
-                        range1=[x["b.id"], x["b.id"] + 1],
-                        range2=[x["b.id"], x["b.id"] + 0.9],
-                    )[1],
-                    axis=1,
-                ),
-                "eb.id": lambda df: df.apply(
-                    lambda x: f"{x[col_block_start]}-{x[col_block_end]}", axis=1
-                ),
-                "eb.length": lambda df: df.apply(
-                    lambda x: get_diff_sorted(x[col_block_start], x[col_block_end]),
-                    axis=1,
-                ),
-            }
+        .pipe(
+            _get_block_coords,
+            col_start=col_start,
+            col_end=col_end,
+            col_block_start=col_block_start,
+            col_block_end=col_block_end,
         )
     )
     return pd.concat([df2, df2_], axis=0).reset_index(drop=True)
 
 
+def get_blocks_batch(
+    data,
+    col_group: str = "g.id",
+    **kws_get_blocks,
+) -> pd.DataFrame:
+    """Get the blocks for many genes in a single call.
+
+    Args:
+        data (dict|pd.DataFrame): tables keyed by the gene ids, or a table with the `col_group` column.
+        col_group (str, optional): column with the gene ids. Defaults to "g.id".
+
+    Keyword Args:
+        kws_get_blocks: parameters provided to `get_blocks`.
+
+    Returns:
+        pd.DataFrame: output table with the `col_group` column.
+    """
+    if isinstance(data, dict):
+        data = pd.concat(
+            data,
+            axis=0,
+            names=[col_group],
+        ).reset_index(0)
+    assert col_group in data, col_group
+    return get_blocks(
+        data,
+        col_group=col_group,
+        **kws_get_blocks,
+    )
+
+
 def map_feats_to_blocks(
     data,
     feat_start="c.start",
@@ -1,15 +1,117 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../../modules_nbs/plot_mat.ipynb.
 
 # %% auto 0
-__all__ = ["plot_tri"]
+__all__ = ["get_band_blocks", "plot_tri"]
 
 # %% ../../modules_nbs/plot_mat.ipynb 2
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy.ndimage import gaussian_filter
+from scipy.sparse import coo_matrix, issparse
 import seaborn as sns
 
 
+def _get_bin_means(
+    matrix,
+    n: int,
+    factor: int,
+    rows: tuple,
+    cols: tuple,
+) -> np.ndarray:
+    """
+    Means of the values in the bins of `factor` x `factor` cells of a matrix.
+
+    :param matrix: dense `np.ndarray`, or sparse `scipy.sparse` csr matrix with the sums of the bins
+    :param n: cells along each axis of the matrix
+    :param factor: cells per bin, along each axis
+    :param rows: start and end of the bins of the rows
+    :param cols: start and end of the bins of the columns
+    """
+    ## cells per bin, at the ends
+    sizes = [
+        np.minimum((np.arange(*lim) + 1) * factor, n) - np.arange(*lim) * factor
+        for lim in [rows, cols]
+    ]
+    if issparse(matrix):
+        return matrix[slice(*rows), slice(*cols)].toarray() / np.outer(*sizes)
+    block = matrix[
+        rows[0] * factor : rows[1] * factor, cols[0] * factor : cols[1] * factor
+    ].astype(float)
+    if factor == 1:
+        return block
+    block = np.pad(
+        block,
+        [(0, len(sizes[0]) * factor - block.shape[0]), (0, len(sizes[1]) * factor - block.shape[1])],
+        constant_values=np.nan,
+    ).reshape(len(sizes[0]), factor, len(sizes[1]), factor)
+    counts = (~np.isnan(block)).sum(axis=(1, 3))
+    return np.divide(
+        np.nansum(block, axis=(1, 3)),
+        counts,
+        out=np.full(counts.shape, np.nan),
+        where=counts > 0,
+    )
+
+
+def get_band_blocks(
+    matrix,
+    max_dist: int = None,
+    factor: int = 1,
+    block_size: int = None,
+    smoothing_sigma: float = None,
+):
+    """
+    Blocks along the diagonal band of a matrix, downsampled by the means of the bins.
+
+    Only the band up to `max_dist` from the diagonal is materialised i.e. O(n x max_dist) instead of O(n^2).
+
+    :param matrix: square matrix, dense (`np.ndarray`) or sparse (`scipy.sparse` e.g. COO)
+    :param max_dist: distance from the diagonal, in the cells of the matrix. Default: None (all)
+    :param factor: cells per bin along each axis, averaged. Default: 1
+    :param block_size: bins along the diagonal per block. Default: None (the band width, up to 64 blocks)
+    :param smoothing_sigma: Sigma parameter for Gaussian smoothing, in the bins. Default: None (no smoothing)
+    :return: blocks, as tuples of the edges of the rows and the columns (in the cells of the matrix), and the bin means, with NaN outside the band
+    """
+    n = matrix.shape[0]
+    if max_dist is None:
+        max_dist = n - 1
+    bins = -(-n // factor)
+    ## bins with a visible cell
+    dist = min((max_dist - 1) // factor + 1 if max_dist > 0 else 0, bins - 1)
+    if issparse(matrix):
+        ## sums of the bins, from all the non-zero values
+        matrix = matrix.tocoo()
+        matrix = coo_matrix(
+            (matrix.data, (matrix.row // factor, matrix.col // factor)),
+            shape=(bins, bins),
+        ).tocsr()
+    if block_size is None:
+        block_size = max(dist, -(-bins // 64), 1)
+    margin = int(np.ceil(4 * smoothing_sigma)) if smoothing_sigma else 0
+    blocks = []
+    for start in range(0, bins, block_size):
+        end = min(bins, start + block_size)
+        rows = (max(0, start - margin), min(bins, end + margin))
+        cols = (max(0, start - margin), min(bins, end + dist + margin))
+        values = _get_bin_means(matrix, n, factor, rows, cols)
+        if smoothing_sigma:
+            values = gaussian_filter(values, sigma=smoothing_sigma)
+        values = values[
+            start - rows[0] : end - rows[0], start - cols[0] : min(bins, end + dist) - cols[0]
+        ]
+        ## outside the band
+        diff = np.arange(start, min(bins, end + dist))[None, :] - np.arange(start, end)[:, None]
+        values[(diff < 0) | (diff > dist)] = np.nan
+        blocks.append(
+            (
+                np.minimum(np.arange(start, end + 1) * factor, n),
+                np.minimum(np.arange(start, min(bins, end + dist) + 1) * factor, n),
+                values,
+            )
+        )
+    return blocks
+
+
 def plot_tri(
     df,
     ax=None,
@@ -18,31 +120,82 @@ def plot_tri(
     rasterized=True,
     smoothing_sigma=None,
     show_x=False,
+    banded=None,
+    downsample=True,
     **kws_pcolormesh,
 ):
     """
     Plot a triangular heatmap for a given adjacency matrix.
 
-    :param df: pandas DataFrame containing the adjacency matrix
+    :param df: pandas DataFrame containing the adjacency matrix, or a square `np.ndarray` (e.g. memory-mapped) or `scipy.sparse` matrix (e.g. COO)
     :param ax: matplotlib Axes object to plot on
     :param max_dist: Only draw interactions up to this distance
     :param proportional: Automatically determine aspect ratio of plot so that x- and y-axis are proportional. Default: True
     :param rasterized: Draw map as image (True) or vector graphic (False). Default: True
     :param smoothing_sigma: Sigma parameter for Gaussian smoothing. Default: None (no smoothing)
+    :param banded: Only materialise the diagonal band up to `max_dist`, in blocks (see `get_band_blocks`). Default: None (if sparse or larger than 1000 x 1000)
+    :param downsample: In the banded mode, average the cells in bins, by a factor (int), or to the width of the subplot in pixels (True). Default: True
     """
     if ax is None:
         ax = plt.gca()
 
-    matrix = df.values
+    ## memory-mapped and sparse matrices are sliced in the banded mode
+    matrix = df.values if hasattr(df, "columns") else df
+    n = matrix.shape[0]
+    if banded is None:
+        banded = issparse(matrix) or n > 1000
+
+    if banded:
+        if downsample is True:
+            factor = max(1, int(n // ax.get_window_extent().width))
+        else:
+            factor = max(1, int(downsample or 1))
+        blocks = get_band_blocks(
+            matrix,
+            max_dist=max_dist,
+            factor=factor,
+            smoothing_sigma=smoothing_sigma / factor if smoothing_sigma else None,
+        )
+        ## same colors across the blocks
+        if kws_pcolormesh.get("norm") is None:
+            from matplotlib.colors import Normalize
 
-    if smoothing_sigma:
-        matrix = gaussian_filter(matrix, sigma=smoothing_sigma)
+            norm = Normalize(
+                vmin=kws_pcolormesh.pop("vmin", None),
+                vmax=kws_pcolormesh.pop("vmax", None),
+            )
+            norm.autoscale_None(
+                np.ma.masked_invalid(np.concatenate([v.ravel() for _, _, v in blocks]))
+            )
+            kws_pcolormesh["norm"] = norm
+        for row_edges, col_edges, values in blocks:
+            x, y = np.meshgrid(col_edges, row_edges)
+            ax.pcolormesh(
+                (x + y) / 2,
+                (x - y) / 2,
+                np.ma.masked_invalid(values),
+                rasterized=rasterized,
+                **kws_pcolormesh,
+            )
+        ax.set_xlim(0, n)
+    else:
+        matrix = matrix.toarray() if issparse(matrix) else np.asarray(matrix)
+        if smoothing_sigma:
+            matrix = gaussian_filter(matrix, sigma=smoothing_sigma)
 
-    bin_coords = np.arange(matrix.shape[0] + 1)
-    bin_coords = np.true_divide(bin_coords, np.sqrt(2))
-    x, y = np.meshgrid(bin_coords, bin_coords)
-    sin45 = np.sin(np.radians(45))
-    x_, y_ = x * sin45 + y * sin45, x * sin45 - y * sin45
+        bin_coords = np.arange(matrix.shape[0] + 1)
+        bin_coords = np.true_divide(bin_coords, np.sqrt(2))
+        x, y = np.meshgrid(bin_coords, bin_coords)
+        sin45 = np.sin(np.radians(45))
+        x_, y_ = x * sin45 + y * sin45, x * sin45 - y * sin45
+
+        ax.pcolormesh(
+            x_,
+            y_,
+            matrix,
+            rasterized=rasterized,
+            **kws_pcolormesh,
+        )
 
     aspect = (
         0.5
@@ -51,20 +204,13 @@ def plot_tri(
     )
     ax.set_aspect(aspect if proportional else "auto")
 
-    ax.pcolormesh(
-        x_,
-        y_,
-        matrix,
-        rasterized=rasterized,
-        **kws_pcolormesh,
-    )
     ax.set_ylim(0, max_dist / 2 if max_dist else matrix.shape[0] / 2)
     ax.set_yticks([])
     sns.despine(ax=ax, top=True, bottom=not show_x, right=True, left=True)
     if show_x:
         ax.set(
-            xticks=(np.arange(1, len(df) + 1, 1) - 0.5),
-            xticklabels=df.columns.tolist(),
+            xticks=(np.arange(1, n + 1, 1) - 0.5),
+            xticklabels=df.columns.tolist() if hasattr(df, "columns") else np.arange(n),
         )
     else:
         ax.set(
@@ -1,4 +1,5 @@
 from pathlib import Path
+from functools import partial
 import logging
 
 
@@ -8,6 +9,17 @@ def setup():
     get_src_path()
 
 
+def _get_levels(
+    levels_path: str,
+) -> dict:
+    ## paths, read lazily level by level
+    return {
+        Path(p).with_suffix("").stem: str(p)
+        for p in sorted(Path(levels_path).with_suffix("").glob("*"))
+        if p.suffix in [".pqt", ".npy", ".arrow", ".feather"]
+    }
+
+
 def plot(
     gene_id: str,
     outd: str,
@@ -21,6 +33,7 @@ def plot(
     cmap: str = "Reds_r",
     log_level="WARNING",
     force: bool = False,
+    jobs: int = 1,
 ):
     """
     Plots the level-wise interaction heatmaps.
@@ -36,6 +49,7 @@ def plot(
         figsize: list=[2,1]: figure size,
         cmap: str='Reds_r': colormap,
         force: bool = False: Over-write,
+        jobs: int = 1: render the levels in parallel processes,
 
     Examples:
 
@@ -50,6 +64,7 @@ def plot(
             └── protein.pqt
 
             where, pqt is Apache parquete format (ideal for large data).
+            The matrices can be dense, or sparse triplets (columns: row, col and value), in parquet (.pqt) or Arrow (.arrow, .feather) formats, or dense numpy arrays (.npy), memory-mapped.
     """
     logging.basicConfig(level=log_level)
     ## inputs
@@ -66,23 +81,19 @@ def plot(
     )
     # from roux.lib.io import read_tables
     # dfs_mats=read_tables(levels_path)
-    from roux.lib.io import read_table
-
-    dfs_mat = {
-        Path(p).with_suffix("").stem: read_table(str(p))
-        for p in list(Path(levels_path).with_suffix("").glob("*.pqt"))
-    }
+    dfs_mat = _get_levels(levels_path)
     if "examples/" in levels_path:
         logging.warning("this is example data ..")
     # if levels is not None:
     # assert levels is not None, "proide out. dir."
     (
-        plot_levels.plot(
+        plot_levels.to_plots(
             dfs_mat,
             figsize=[3, 1.5],
             height_ratios=[3, 1],
             cmap=cmap,
             outd=outd,
+            jobs=jobs,
             # **kws
         )
     )
@@ -100,16 +111,177 @@ def plot(
     )
 
 
+def _plot_gene(
+    gene_id: str,
+    outd: str,
+    levels_path: str,
+    species: str,
+    ensembl_release: int,
+    force: bool,
+    kws_plot: dict,
+) -> dict:
+    """Plot the levels of a gene, unless the outputs are up to date."""
+    import time
+
+    start = time.time()
+    info = dict(gene_id=gene_id, status=None, seconds=None, error=None)
+    try:
+        levels_path = levels_path.format(gene_id=gene_id)
+        levels = _get_levels(levels_path)
+        assert len(levels) != 0, f"no levels found: {levels_path}"
+        outd = f"{outd}/{gene_id}"
+        outps = [Path(f"{outd}/{level}.png") for level in levels]
+        if (
+            not force
+            and all(p.exists() for p in outps)
+            and min(p.stat().st_mtime for p in outps)
+            >= max(Path(p).stat().st_mtime for p in levels.values())
+        ):
+            info["status"] = "skipped"
+        else:
+            from chrov.fig.mat import Plot_levels
+
+            Plot_levels(
+                gene_id=gene_id,
+                species=species,
+                ensembl_release=ensembl_release,
+            ).plot(
+                levels,
+                outd=outd,
+                **kws_plot,
+            )
+            import matplotlib.pyplot as plt
+
+            plt.close("all")
+            info["status"] = "done"
+    except Exception as e:
+        logging.error(f"{gene_id}: {e}")
+        info.update(status="failed", error=f"{type(e).__name__}: {e}")
+    info["seconds"] = round(time.time() - start, 3)
+    return info
+
+
+def _init_worker(
+    species: str,
+    ensembl_release: int,
+):
+    import matplotlib.pyplot as plt
+
+    plt.switch_backend("Agg")
+    ## once per worker, instead of per gene
+    from chrov.annots import get_annots
+
+    get_annots(ensembl_release=ensembl_release, species=species)
+
+
+def plot_batch(
+    genes_path: str,
+    outd: str,
+    levels_path: str,
+    species: str = "homo sapiens",
+    ensembl_release: int = 112,
+    cmap: str = "Reds_r",
+    jobs: int = 1,
+    log_level="WARNING",
+    force: bool = False,
+):
+    """
+    Plots the level-wise interaction heatmaps of many genes.
+
+    Args:
+        genes_path: str: text file with the Ensembl gene ids, one per line,
+        outd: str: Output directory path, with a sub-directory per gene,
+        levels_path: str: level-wise data paths of a gene, with the gene id as the '{gene_id}' placeholder,
+        species: str='homo sapiens': species name,
+        ensembl_release: int=112: Ensembl release,
+        cmap: str='Reds_r': colormap,
+        jobs: int=1: genes rendered in parallel processes,
+        force: bool = False: Over-write, else the genes with the outputs newer than the inputs are skipped,
+
+    Examples:
+
+        CLI:
+            chrov plot-batch genes.txt examples/outputs/ints_levels "examples/inputs/{gene_id}/ints.yaml" --jobs 8
+
+        Summary of the runs: manifest.tsv in the output directory, with the status ('done', 'skipped' or 'failed'), time taken and errors per gene.
+    """
+    logging.basicConfig(level=log_level)
+    import time
+
+    start = time.time()
+    with open(genes_path) as f:
+        gene_ids = [s.strip() for s in f if s.strip() and not s.startswith("#")]
+    ## warm-up: opened once, shared by the genes
+    from chrov.annots import get_annots
+    from chrov.domains import get_domains
+    from chrov.cytobands import get_cytobands
+
+    get_annots(ensembl_release=ensembl_release, species=species)
+    get_domains(species=species, ensembl_release=ensembl_release)
+    get_cytobands()
+
+    kws_gene = dict(
+        outd=outd,
+        levels_path=levels_path,
+        species=species,
+        ensembl_release=ensembl_release,
+        force=force,
+        kws_plot=dict(
+            figsize=[3, 1.5],
+            height_ratios=[3, 1],
+            cmap=cmap,
+        ),
+    )
+    if jobs > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        ## the workers are forked, sharing the tables read above
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(species, ensembl_release),
+        ) as executor:
+            infos = list(
+                executor.map(
+                    partial(_plot_gene, **kws_gene),
+                    gene_ids,
+                )
+            )
+    else:
+        infos = [_plot_gene(gene_id, **kws_gene) for gene_id in gene_ids]
+    import pandas as pd
+
+    df1 = pd.DataFrame(infos, columns=["gene_id", "status", "seconds", "error"])
+    Path(outd).mkdir(parents=True, exist_ok=True)
+    df1.to_csv(f"{outd}/manifest.tsv", sep="\t", index=False)
+    print(
+        f"Genes: {df1['status'].value_counts().to_dict()} in {time.time() - start:.1f}s, manifest: {outd}/manifest.tsv"
+    )
+
+
 import argh
+from chrov import cache
 
 parser = argh.ArghParser()
 parser.add_commands(
     [
         plot,
+        plot_batch,
         # gui,
         setup,
     ]
 )
+parser.add_commands(
+    [
+        cache.stats,
+        cache.prune,
+        cache.verify,
+    ],
+    group_name="cache",
+    group_kwargs=dict(help="manage the cache directory"),
+)
 
 if __name__ == "__main__":
     # from datetime import datetime
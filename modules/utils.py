@@ -3,7 +3,14 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../00_utils.ipynb.
 
 # %% auto 0
-__all__ = ["get_pkg_name", "get_src_path", "get_cache_dir", "log_time_elapsed"]
+__all__ = [
+    "get_pkg_name",
+    "get_src_path",
+    "get_cache_dir",
+    "get_file_signature",
+    "to_table_atomic",
+    "log_time_elapsed",
+]
 
 # %% ../00_utils.ipynb 3
 import logging
@@ -74,6 +81,56 @@ def get_cache_dir(
     return str(cache_dir)
 
 
+def get_file_signature(
+    p: str,
+) -> str:
+    """Get a signature of a file that changes when the file is re-written.
+
+    Args:
+        p (str): path.
+
+    Returns:
+        str: size and modification time of the file, None if the file does not exist.
+    """
+    if not Path(p).exists():
+        return
+    stat = Path(p).stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def to_table_atomic(
+    df,
+    p: str,
+    **kws_to_table,
+) -> str:
+    """Save a table atomically i.e. readers never see a partially written file.
+
+    Args:
+        df (pd.DataFrame): table.
+        p (str): output path.
+
+    Returns:
+        str: output path.
+    """
+    from roux.lib.io import to_table
+
+    p = Path(p)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    ## temporary file in the same directory, with the same extension
+    tmpp = p.with_name(f".{p.stem}.{os.getpid()}.tmp{p.suffix}")
+    try:
+        to_table(df, tmpp.as_posix(), **kws_to_table)
+        os.replace(tmpp, p)
+    finally:
+        if tmpp.exists():
+            tmpp.unlink()
+    ## indexed, if inside the cache directory
+    from chrov.cache import cache_add
+
+    cache_add(p)
+    return p.as_posix()
+
+
 def log_time_elapsed(start):
     """Log time elapsed.
 
@@ -1,25 +1,24 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../05_viz.ipynb.
 
 # %% auto 0
-__all__ = ["get_plot_path", "get_data_byeids", "plot_forms", "get_labels_pos"]
+__all__ = [
+    "get_plot_path",
+    "get_layout_path",
+    "get_data_byeids",
+    "plot_forms",
+    "get_labels_pos",
+]
 
 # %% ../05_viz.ipynb 5
 ## helper functions
 import logging
 
-logging.basicConfig(level=logging.INFO)
-
 import pandas as pd
 
-import roux.lib.df as rd  # noqa
-
-from roux.viz.io import begin_plot, to_plot, read_plot
-import matplotlib.pyplot as plt
-
 from pathlib import Path
 
-from ..utils import get_cache_dir
-from ..domains import plot_domains
+from ..utils import get_cache_dir, to_table_atomic
+from ..cache import single_flight
 
 
 # from roux.lib.io import read_table,to_table
@@ -64,6 +63,60 @@ def get_plot_path(
     return outp
 
 
+## the parameters of plot_domains that change the data, the rest only the looks
+_kws_layout = ["feats", "cds_prefix", "kws_get_cache"]
+
+
+def get_layout_path(
+    gene_id,
+    species,
+    ensembl_release,
+    biotype,
+    layout,
+    kws_layout={},
+):
+    """Path to the cached layout of a plot i.e. the drawable data, keyed only by the data-affecting parameters.
+
+    Args:
+        gene_id (str): gene id.
+        species (str): species name.
+        ensembl_release (int): Ensembl release.
+        biotype (str): 'p'rotein or 't'ranscript.
+        layout (str): layout e.g. 'blocks'.
+        kws_layout (dict, optional): other data-affecting parameters (see `_kws_layout`). Defaults to {}.
+
+    Returns:
+        str: output path.
+    """
+    kws_layout = {
+        k: (
+            ## tables by their contents
+            str(pd.util.hash_pandas_object(v, index=False).sum())
+            if isinstance(v, pd.DataFrame)
+            else v
+        )
+        for k, v in kws_layout.items()
+        if v is not None and not (isinstance(v, dict) and len(v) == 0)
+    }
+    return Path(
+        get_plot_path(
+            gene_id=gene_id,
+            species=species,
+            ensembl_release=ensembl_release,
+            biotype=biotype,
+            layout=layout,
+            kws_plot=dict(
+                gene_id=gene_id,
+                species=species,
+                ensembl_release=ensembl_release,
+                biotype=biotype,
+                layout=layout,
+                **kws_layout,
+            ),
+        )
+    ).with_suffix(".pqt").as_posix()
+
+
 ## for mapping to the plots
 def get_data_byeids(
     data,
@@ -111,6 +164,19 @@ def get_data_byeids(
     )
 
 
+def _read_layout(
+    outp: str,
+) -> pd.DataFrame:
+    """Read a cached layout, with the missing values as NaNs as in the computed one."""
+    import numpy as np
+
+    df = pd.read_parquet(outp)
+    ## the missing strings are read from parquet as None
+    cols = df.select_dtypes(include="object").columns
+    df[cols] = df[cols].where(df[cols].notna(), np.nan)
+    return df
+
+
 def plot_forms(
     gene_id,
     species,
@@ -125,43 +191,55 @@ def plot_forms(
     # kws_plot={},
     **kws_plot_domains,
 ):
-    ## parameters
-    kws_plot = dict(
-        plot=dict(
-            gene_id=gene_id,
-            species=species,
-            ensembl_release=ensembl_release,
-            biotype=biotype,
-            layout=layout,
-            # protein_coding=protein_coding,
-        ),
-        plot_extra={
-            **dict(
-                return_data=True,
-            ),
-            **kws_plot_domains,
-        },
-    )
+    """Plot the forms of a gene, drawn from the cached layout.
+
+    The layout i.e. the data returned by `plot_domains` is cached as a parquet file keyed only by the data-affecting parameters (see `get_layout_path`).
+    The other parameters e.g. colors and figure size only restyle it i.e. a redraw without the recompute.
+
+    Args:
+        gene_id (str): gene id.
+        species (str): species name.
+        ensembl_release (int): Ensembl release.
+        biotype (str): 'p'rotein or 't'ranscript.
+        layout (str): layout e.g. 'blocks'.
+        protein_coding (bool): protein coding transcripts.
+        return_data_for_mapping (bool, optional): return the data of the blocks (see `get_data_byeids`). Defaults to False.
+        force (bool, optional): over-write the cached layout. Defaults to False.
+        validate (bool, optional): not used, for compatibility. Defaults to False.
+        ax (plt.Axes, optional): subplot. Defaults to None.
+
+    Keyword Args:
+        parameters provided to `plot_domains`.
+
+    Returns:
+        plt.Axes|pd.DataFrame: subplot, or the data if `return_data`.
+    """
+    import matplotlib.pyplot as plt
+    from roux.viz.io import begin_plot
+    from ..domains import plot_domains
 
-    outp = get_plot_path(
+    return_data = kws_plot_domains.pop("return_data", False)
+    if return_data_for_mapping:
+        assert layout.lower().startswith("b"), (
+            "return_data_for_mapping is only developed for blocks"
+        )
+        return_data = True
+    kws_layout = {k: kws_plot_domains.get(k) for k in _kws_layout}
+    outp = get_layout_path(
         gene_id=gene_id,
         species=species,
         ensembl_release=ensembl_release,
         biotype=biotype,
         layout=layout,
-        kws_plot=kws_plot,
+        kws_layout=kws_layout,
     )
-    if "return_data" in kws_plot_domains:
-        return_data = kws_plot_domains["return_data"]
-    else:
-        return_data = False
-    if return_data_for_mapping:
-        assert layout.lower().startswith("b"), (
-            "return_data_for_mapping is only developed for blocks"
-        )
-        return_data = True
-    if not Path(outp).exists() or force:
-        data = None
+    ## computed once across the processes, drawn by each
+    with single_flight(outp, force=force) as compute:
+        if compute:
+            data = None
+        else:
+            logging.info(f"reading layout from {outp}")
+            data = _read_layout(outp)
 
         ## plot
         begin_plot()
@@ -169,38 +247,31 @@ def plot_forms(
             _, ax = plt.subplots(
                 figsize=[4, 2],
             )
-        data = plot_domains(
-            **kws_plot["plot"],
-            **kws_plot["plot_extra"],
-            kws_legend=dict(
-                title="Domains",
-                ncol=2,
+        kws_plot_domains = {
+            **dict(
+                kws_legend=dict(
+                    title="Domains",
+                    ncol=2,
+                ),
             ),
+            **kws_plot_domains,
+        }
+        data_plot = plot_domains(
+            gene_id=gene_id,
+            species=species,
+            ensembl_release=ensembl_release,
+            biotype=biotype,
+            layout=layout,
+            return_data=True,
             data=data,
             ax=ax,
+            **kws_plot_domains,
         )
-
-        logging.info(f"saving cache to {outp}")
-        try:
-            to_plot(
-                outp,
-                kws_plot=kws_plot,
-                data=data,
-                validate=validate,
-            )
-        except:
-            logging.warning("install roux[all] for to_plot to work")
-    else:
-        logging.info(f"reading cache from {outp}")
-        ax = read_plot(
-            outp,
-            ax=ax,
-            # kws_plot=kws_plot,
-        )
-        if return_data:
-            from roux.lib.io import read_table
-
-            data = read_table(Path(outp).with_suffix("").as_posix() + "/data.tsv")
+        if data is None:
+            data = data_plot
+            if data is not None:
+                logging.info(f"saving layout to {outp}")
+                to_table_atomic(data, outp)
     if not return_data:
         return ax
     else:
@@ -211,6 +282,8 @@ def plot_forms(
 
 
 def get_labels_pos(ax_gv):
+    import matplotlib.pyplot as plt
+
     return (
         pd.DataFrame(
             # if t.get_position()[0]==1
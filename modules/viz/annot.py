@@ -1,10 +1,12 @@
 """Annotations."""
 
+import functools
 import logging
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 
+from matplotlib.collections import LineCollection
 from roux.stat.transform import rescale
 
 
@@ -60,6 +62,103 @@ def _set_text(
     return ax
 
 
+@functools.lru_cache(maxsize=None)
+def _get_text_height(
+    fontsize: float,
+) -> float:
+    """Height of the text in points, measured once per font size."""
+    from matplotlib.textpath import TextPath
+
+    return TextPath((0, 0), "Ag", size=fontsize).get_extents().height
+
+
+def pack_labels(
+    x: np.ndarray,
+    width,
+    lim: tuple = None,
+) -> np.ndarray:
+    """Positions of the labels along an axis, without the overlaps and close to their anchors.
+
+    The labels are packed in one sorted pass: the anchors are shifted by the cumulative minimum gaps between the neighbouring labels, and fitted by an isotonic regression (pool adjacent violators), in O(n log n).
+
+    Args:
+        x (np.ndarray): positions of the anchors.
+        width (float|np.ndarray): widths of the labels, same for all or per label.
+        lim (tuple, optional): limits of the axis. If the labels do not fit, the gaps are shrunk evenly. Defaults to None.
+
+    Returns:
+        np.ndarray: positions of the labels, in the order of the anchors.
+    """
+    x = np.asarray(x, dtype=float)
+    if len(x) == 0:
+        return x
+    order = np.argsort(x, kind="stable")
+    widths = np.broadcast_to(np.asarray(width, dtype=float), x.shape)[order]
+    offsets = np.concatenate([[0], np.cumsum((widths[:-1] + widths[1:]) / 2)])
+    if lim is not None:
+        lim = (lim[0] + widths[0] / 2, lim[1] - widths[-1] / 2)
+        if offsets[-1] > lim[1] - lim[0] and offsets[-1] > 0:
+            offsets *= max(lim[1] - lim[0], 0) / offsets[-1]
+    ## isotonic regression of the shifted anchors
+    values, sizes = [], []
+    for v in x[order] - offsets:
+        value, size = v, 1
+        while values and values[-1] >= value:
+            value = (values[-1] * sizes[-1] + value * size) / (sizes[-1] + size)
+            size += sizes[-1]
+            values.pop()
+            sizes.pop()
+        values.append(value)
+        sizes.append(size)
+    positions = np.repeat(values, sizes)
+    if lim is not None:
+        positions = np.clip(positions, lim[0], max(lim[0], lim[1] - offsets[-1]))
+    positions += offsets
+    out = np.empty_like(positions)
+    out[order] = positions
+    return out
+
+
+class _Leaders(LineCollection):
+    """Lines between the points in the data coordinates of two subplots, drawn as a single figure-level collection.
+
+    Like `ConnectionPatch`, the ends are transformed when drawn, so that the lines follow the changes in the subplots, but for all the lines at once.
+    """
+
+    def __init__(
+        self,
+        xyA: np.ndarray,
+        xyB: np.ndarray,
+        transA,
+        transB,
+        **kws_collection,
+    ):
+        from matplotlib.transforms import IdentityTransform
+
+        super().__init__(
+            [],
+            transform=IdentityTransform(),
+            linewidths=plt.rcParams["patch.linewidth"],
+            ## looks of the patches
+            capstyle="butt",
+            snap=False,
+            clip_on=False,
+            **kws_collection,
+        )
+        self._xyA, self._xyB = xyA, xyB
+        self._transA, self._transB = transA, transB
+
+    def draw(self, renderer):
+        ## in the display coordinates
+        self.set_segments(
+            np.stack(
+                [self._transA.transform(self._xyA), self._transB.transform(self._xyB)],
+                axis=1,
+            )
+        )
+        super().draw(renderer)
+
+
 def annot_labels(
     ax_chrom: plt.Axes,  # A
     data: pd.DataFrame,  # coordinates
@@ -76,6 +175,9 @@ def annot_labels(
     off_labels_segments: float = 20,
     scale_polar: float = 1.5,
     fig: plt.Figure = None,
+    layout: str = "rank",
+    fontsize: float = None,
+    leaders: str = "collection",
     test: bool = False,
 ) -> plt.Axes:
     """Annot labels e.g. gene names
@@ -89,6 +191,9 @@ def annot_labels(
         off_labels_segments (float, optional): offset for the label segments. Defaults to 20.
         scale_polar (float, optional): scale for the polar plot. Defaults to 1.5.
         fig (plt.Figure, optional): figure. Defaults to None.
+        layout (str, optional): spread the labels by the ranks of the positions ('rank'), or pack them without the overlaps ('pack', see `pack_labels`). Defaults to 'rank'.
+        fontsize (float, optional): font size of the labels. Defaults to None.
+        leaders (str, optional): draw the leader lines as a collection per leg ('collection') or as a `ConnectionPatch` per line ('patches'). Defaults to 'collection'.
         test (bool, optional): test-mode. Defaults to False.
 
     Returns:
@@ -98,10 +203,17 @@ def annot_labels(
         fig = plt.gcf()
     if col_start is None:
         col_start = colx
+    if fontsize is None:
+        fontsize = plt.rcParams["font.size"]
     ## labels
     ### rescale coordinates
     # data=data.assign(**{colx:lambda df: to_polar(df[colx],range1=[df[colx].min(),df[colx].max()],range2=xlim)})
-    if ax_chrom.name != "polar":
+    if layout == "pack":
+        ## after the offsets below
+        df1 = data.sort_values(colx)
+    elif layout != "rank":
+        raise ValueError(layout)
+    elif ax_chrom.name != "polar":
         df1 = data.sort_values(colx).assign(
             **{
                 col_labelx: lambda df: rescale(
@@ -175,194 +287,105 @@ def annot_labels(
         label_yoff = (line3A_yoff + line2B_yoff) / 2
     # print(dist*0.12)
     # print(f"label_yoff={label_yoff}")
-
-    from matplotlib.patches import ConnectionPatch
-
-    if loc == "out":
-        # default
-        # # -..to gene
-        if test:
-            logging.info(df1)
-        _ = df1.apply(
-            lambda x: fig.add_artist(
-                ConnectionPatch(
-                    xyA=[x[col_start], chrom_y + chrom_yoff],
-                    xyB=[x[col_start], ax_chrom.get_ylim()[1] + line1B_yoff],
-                    coordsA=ax_chrom.transData,  # "data",
-                    coordsB=ax_chrom.transData,  # "data",
-                    # axesA=ax_chrom,
-                    # axesB=ax,
-                    color=color,
-                    alpha=0.5,
-                    zorder=2,
-                    clip_on=False,
-                ),
-            ),
-            axis=1,
-        )
-        # .-. chromosome
-        _ = df1.apply(
-            lambda x: fig.add_artist(
-                ConnectionPatch(
-                    xyA=[x[col_start], ax_chrom.get_ylim()[1] + line1B_yoff],
-                    xyB=[x[col_labelx], ax_chrom.get_ylim()[1] + line2B_yoff],
-                    coordsA=ax_chrom.transData,  # "data",
-                    coordsB=ax_chrom.transData,  # "data",
-                    # axesA=ax_chrom,
-                    # axesB=ax,
-                    color=color,
-                    alpha=0.5,
-                    zorder=2,
-                    clip_on=False,
-                ),
-            ),
-            axis=1,
+    if layout == "pack":
+        ## the labels are rotated, so that their extents along x are the heights of the text, in the data units at the labels
+        xlim, y = ax_chrom.get_xlim(), ax_chrom.get_ylim()[1 if loc == "out" else 0] + label_yoff
+        x, xeps = np.mean(xlim), (xlim[1] - xlim[0]) * 1e-3
+        ## pixels per unit of x
+        scale = (
+            np.linalg.norm(
+                np.diff(ax_chrom.transData.transform([[x, y], [x + xeps, y]]), axis=0)
+            )
+            / xeps
         )
-        _ = df1.apply(
-            lambda x: fig.add_artist(
-                ConnectionPatch(
-                    xyA=[x[col_labelx], ax_chrom.get_ylim()[1] + line2B_yoff],
-                    xyB=[x[col_labelx], ax_chrom.get_ylim()[1] + line3A_yoff],
-                    coordsA=ax_chrom.transData,  # "data",
-                    coordsB=ax_chrom.transData,  # "data",
-                    # axesA=ax_chrom,
-                    # axesB=ax,
-                    color=color,
-                    alpha=0.5,
-                    zorder=2,
-                    clip_on=False,
-                ),
-            ),
-            axis=1,
+        df1[col_labelx] = pack_labels(
+            df1[colx],
+            width=_get_text_height(fontsize) * fig.dpi / 72 / scale,
+            lim=xlim,
         )
-        # ..- to data
-        if coly is not None:
-            _ = df1.apply(
-                lambda x: fig.add_artist(
-                    ConnectionPatch(
-                        xyA=[x[col_start], chrom_y + chrom_yoff],
-                        xyB=[x[colx], ax.get_ylim()[1] + line3B_yoff],
-                        coordsA=ax_chrom.transData,  # "data",
-                        coordsB=ax.transData,  # "data",
-                        axesA=ax_chrom,
-                        axesB=ax,
-                        color=color,
-                        alpha=0.5,
-                        zorder=2,
-                        clip_on=False,
-                    ),
-                ),
-                axis=1,
-            )
-            _ = df1.apply(
-                lambda x: fig.add_artist(
-                    ConnectionPatch(
-                        xyA=[x[colx], ax.get_ylim()[1] + line3B_yoff],
-                        xyB=[x[colx], x[coly]],
-                        coordsA=ax.transData,  # "data",
-                        coordsB=ax.transData,  # "data",
-                        axesA=ax,
-                        axesB=ax,
-                        color=color,
-                        alpha=0.5,
-                        zorder=2,
-                        clip_on=False,
-                    ),
-                ),
-                axis=1,
-            )
-    else:
-        # # -.. chromosome
-        if test:
-            logging.info(df1)
-        _ = df1.apply(
-            lambda x: fig.add_artist(
-                ConnectionPatch(
-                    xyA=[x[col_start], chrom_y + chrom_yoff],
-                    xyB=[x[col_start], ax_chrom.get_ylim()[0] + line1B_yoff],
-                    coordsA=ax_chrom.transData,  # "data",
-                    coordsB=ax_chrom.transData,  # "data",
-                    # axesA=ax_chrom,
-                    # axesB=ax,
-                    color=color,
-                    alpha=0.5,
-                    zorder=2,
-                    clip_on=False,
-                ),
+
+    ## leader lines: legs from the chromosome to the labels, and to the data
+    ylim_chrom = ax_chrom.get_ylim()[1 if loc == "out" else 0]
+    y_chrom = np.repeat(chrom_y + chrom_yoff, len(df1))
+    legs = [
+        # -.. to the gene
+        (
+            [df1[col_start], y_chrom],
+            [df1[col_start], ylim_chrom + line1B_yoff],
+            ax_chrom,
+            ax_chrom,
+        ),
+        # .-. chromosome
+        (
+            [df1[col_start], ylim_chrom + line1B_yoff],
+            [df1[col_labelx], ylim_chrom + line2B_yoff],
+            ax_chrom,
+            ax_chrom,
+        ),
+        (
+            [df1[col_labelx], ylim_chrom + line2B_yoff],
+            [df1[col_labelx], ylim_chrom + line3A_yoff],
+            ax_chrom,
+            ax_chrom,
+        ),
+    ]
+    if coly is not None:
+        # ..- to the data
+        legs += [
+            (
+                [df1[col_start], y_chrom]
+                if loc == "out"
+                else [df1[col_labelx], ylim_chrom + line3A_yoff],
+                [df1[colx], ax.get_ylim()[1] + line3B_yoff],
+                ax_chrom,
+                ax,
             ),
-            axis=1,
-        )
-        # .-. gene
-        _ = df1.apply(
-            lambda x: fig.add_artist(
-                ConnectionPatch(
-                    xyA=[x[col_start], ax_chrom.get_ylim()[0] + line1B_yoff],
-                    xyB=[x[col_labelx], ax_chrom.get_ylim()[0] + line2B_yoff],
-                    coordsA=ax_chrom.transData,  # "data",
-                    coordsB=ax_chrom.transData,  # "data",
-                    # axesA=ax_chrom,
-                    # axesB=ax,
-                    color=color,
-                    alpha=0.5,
-                    zorder=2,
-                    clip_on=False,
-                ),
+            (
+                [df1[colx], ax.get_ylim()[1] + line3B_yoff],
+                [df1[colx], df1[coly]],
+                ax,
+                ax,
             ),
-            axis=1,
-        )
-        _ = df1.apply(
-            lambda x: fig.add_artist(
-                ConnectionPatch(
-                    xyA=[x[col_labelx], ax_chrom.get_ylim()[0] + line2B_yoff],
-                    xyB=[x[col_labelx], ax_chrom.get_ylim()[0] + line3A_yoff],
-                    coordsA=ax_chrom.transData,  # "data",
-                    coordsB=ax_chrom.transData,  # "data",
-                    # axesA=ax_chrom,
-                    # axesB=ax,
-                    color=color,
+        ]
+    if test:
+        logging.info(df1)
+    for xyA, xyB, axA, axB in legs:
+        xyA, xyB = [
+            np.column_stack(np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in xy]))
+            for xy in [xyA, xyB]
+        ]
+        if leaders == "collection":
+            fig.add_artist(
+                _Leaders(
+                    xyA=xyA,
+                    xyB=xyB,
+                    transA=axA.transData,
+                    transB=axB.transData,
+                    colors=color,
                     alpha=0.5,
                     zorder=2,
-                    clip_on=False,
-                ),
-            ),
-            axis=1,
-        )
-        # ..- data
-        if coly is not None:
-            _ = df1.apply(
-                lambda x: fig.add_artist(
-                    ConnectionPatch(
-                        xyA=[x[col_labelx], ax_chrom.get_ylim()[0] + line3A_yoff],
-                        xyB=[x[colx], ax.get_ylim()[1] + line3B_yoff],
-                        coordsA=ax_chrom.transData,  # "data",
-                        coordsB=ax.transData,  # "data",
-                        axesA=ax_chrom,
-                        axesB=ax,
-                        color=color,
-                        alpha=0.5,
-                        zorder=2,
-                        clip_on=False,
-                    ),
                 ),
-                axis=1,
             )
-            _ = df1.apply(
-                lambda x: fig.add_artist(
+        elif leaders == "patches":
+            from matplotlib.patches import ConnectionPatch
+
+            for xyA_, xyB_ in zip(xyA, xyB):
+                fig.add_artist(
                     ConnectionPatch(
-                        xyA=[x[colx], ax.get_ylim()[1] + line3B_yoff],
-                        xyB=[x[colx], x[coly]],
-                        coordsA=ax.transData,  # "data",
-                        coordsB=ax.transData,  # "data",
-                        axesA=ax,
-                        axesB=ax,
+                        xyA=xyA_,
+                        xyB=xyB_,
+                        coordsA=axA.transData,
+                        coordsB=axB.transData,
+                        axesA=axA,
+                        axesB=axB,
                         color=color,
                         alpha=0.5,
                         zorder=2,
                         clip_on=False,
                     ),
-                ),
-                axis=1,
-            )
+                )
+        else:
+            raise ValueError(leaders)
     if ax is None:
         ax = ax_chrom
     if ax.name != "polar":
@@ -394,17 +417,18 @@ def annot_labels(
             ymax=0.85,  # if loc=='out' else ((ax_chrom.get_ylim()[0])-ax_chrom.get_ylim()[0])/(ax_chrom.get_ylim()[1]-ax_chrom.get_ylim()[0]),
             color="w",
         )
-    _ = df1.drop_duplicates(subset=[col_label, col_labelx]).apply(
-        lambda x: _set_text(
+    df_ = df1.drop_duplicates(subset=[col_label, col_labelx])
+    label_y = ax_chrom.get_ylim()[1 if loc == "out" else 0] + label_yoff
+    for x, label in zip(df_[col_labelx], df_[col_label]):
+        _set_text(
             ax=ax_chrom,
-            x=x[col_labelx],
-            y=(ax_chrom.get_ylim()[1 if loc == "out" else 0] + label_yoff),
-            s=x[col_label],
+            x=x,
+            y=label_y,
+            s=label,
             ha="center",  # if loc!='out' and not ax_chrom.name=='polar' else 'left',
             va="bottom" if loc == "out" and ax_chrom.name != "polar" else "center",
-        ),
-        axis=1,
-    )
+            fontsize=fontsize,
+        )
     if ax.name == "polar":
         ax.set(
             # xlabel=None,
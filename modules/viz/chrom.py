@@ -10,6 +10,18 @@ from roux.viz.ax_ import get_line_cap_length
 
 import roux.lib.df as rd  # noqa
 
+__all__ = [
+    "to_polar",
+    "plot_arm",
+    "plot_chrom",
+    "format_chrom_names",
+    "sort_chrom_names",
+    "get_genome_offsets",
+    "to_genome_coords",
+    "plot_chroms",
+    "annot_chroms",
+]
+
 
 def _to_polar_intrapolate(
     start: int,
@@ -189,6 +201,62 @@ def _format_polar_subplot(ax: plt.Axes, xlim: list, **kws_set) -> plt.Axes:
     return ax
 
 
+def _add_segments(
+    segments: dict,
+    xs: list,
+    ys: list,
+    layer: str,
+    **kws_line,
+) -> dict:
+    """Add a line to the segments to be drawn together, keyed by the layer e.g. outline and the style of the line."""
+    key = (("layer", layer),) + tuple(sorted(kws_line.items()))
+    segments.setdefault(key, []).append(np.column_stack([xs, ys]))
+    return segments
+
+
+def _draw_segments(
+    segments: dict,
+    ax: plt.Axes,
+) -> list:
+    """Draw the segments as collections, one per style of the line, in the order in which the styles were added.
+
+    Args:
+        segments (dict): lines keyed by their style, from `_add_segments`.
+        ax (plt.Axes): subplot.
+
+    Returns:
+        list: collections.
+    """
+    from matplotlib.collections import LineCollection
+    from matplotlib.colors import to_rgba
+
+    collections = []
+    for key, lines in segments.items():
+        kws = dict(key)
+        ## lines joined in a single path, separated by the missing values
+        xys = np.concatenate(
+            [np.vstack([xy, [np.nan, np.nan]]) for xy in lines]
+        )[:-1]
+        collections.append(
+            ax.add_collection(
+                LineCollection(
+                    [xys],
+                    colors=[to_rgba(kws["color"], alpha=kws["alpha"])],
+                    linewidths=kws["lw"],
+                    capstyle=kws["capstyle"],
+                    zorder=kws["zorder"],
+                    clip_on=False,
+                ),
+                autolim=False,
+            )
+        )
+        ## limits as set by the lines
+        ax.update_datalim(xys[~np.isnan(xys).any(axis=1)])
+    ax.autoscale_view()
+    segments.clear()
+    return collections
+
+
 def plot_arm(
     data: pd.DataFrame,
     arc: bool = False,
@@ -207,6 +275,7 @@ def plot_arm(
     ax: plt.Axes = None,
     test: bool = False,
     solid_capstyle="round",
+    collection: bool = True,
 ) -> plt.Axes:
     """Plot chromosome arm.
 
@@ -217,6 +286,7 @@ def plot_arm(
         ec (str, optional): edge color. Defaults to 'k'.
         ax (plt.Axes, optional): subplot. Defaults to None.
         test (bool, optional): test-mode. Defaults to False.
+        collection (bool|dict, optional): draw the lines of a style together as a collection, instead of a line per cytoband. A dict collects the lines to be drawn later with `_draw_segments` e.g. for all the chromosomes at once. Defaults to True.
 
     Returns:
         plt.Axes: subplot
@@ -269,64 +339,111 @@ def plot_arm(
         logging.warning("cytoband type not found in the data")
     else:
         ## cytobands
-        data.loc[data["cytoband type"].str.startswith("gpos"), :].apply(
-            lambda x: ax.plot(
-                *_pre_xys([x[col_start], x[col_end]], [y, y], **kws_pre_xys),
-                lw=lw,
-                solid_capstyle="butt",
-                alpha=int(x["cytoband type"].replace("gpos", "")) * 0.01,
-                color="k",
-                zorder=2,
-                clip_on=False,
-            ),
-            axis=1,
-        )
-        data.loc[data["cytoband type"].str.startswith("gneg"), :].apply(
-            lambda x: ax.plot(
-                *_pre_xys([x[col_start], x[col_end]], [y, y], **kws_pre_xys),
-                lw=lw,
-                solid_capstyle="butt",
-                color="w",
-                alpha=1,
-                zorder=1,
-                clip_on=False,
-            ),
-            axis=1,
-        )
-        ## centromere
-        data.loc[(data["cytoband type"] == "acen"), :].log().apply(
-            lambda x: ax.plot(
-                *_pre_xys([x[col_start], x[col_end]], [y, y], **kws_pre_xys),
-                lw=lw * 0.75,
-                solid_capstyle="butt",
-                color=color_centromer,  #'lightcoral', ##F5B8B7
-                zorder=2,
-                clip_on=False,
-            ),
-            axis=1,
-        )
+        if collection is not False:
+            ## the lines are drawn together as collections
+            segments = {} if collection is True else collection
+            for kind, start_band, end_band in zip(
+                data["cytoband type"], data[col_start], data[col_end]
+            ):
+                if kind.startswith("gpos"):
+                    kws_line = dict(
+                        color="k",
+                        alpha=int(kind.replace("gpos", "")) * 0.01,
+                        lw=lw,
+                        zorder=2,
+                    )
+                elif kind.startswith("gneg"):
+                    kws_line = dict(color="w", alpha=1, lw=lw, zorder=1)
+                elif kind == "acen":
+                    kws_line = dict(
+                        color=color_centromer, alpha=1, lw=lw * 0.75, zorder=2
+                    )
+                else:
+                    continue
+                _add_segments(
+                    segments,
+                    *_pre_xys([start_band, end_band], [y, y], **kws_pre_xys),
+                    layer="cytobands",
+                    capstyle="butt",
+                    **kws_line,
+                )
+        else:
+            data.loc[data["cytoband type"].str.startswith("gpos"), :].apply(
+                lambda x: ax.plot(
+                    *_pre_xys([x[col_start], x[col_end]], [y, y], **kws_pre_xys),
+                    lw=lw,
+                    solid_capstyle="butt",
+                    alpha=int(x["cytoband type"].replace("gpos", "")) * 0.01,
+                    color="k",
+                    zorder=2,
+                    clip_on=False,
+                ),
+                axis=1,
+            )
+            data.loc[data["cytoband type"].str.startswith("gneg"), :].apply(
+                lambda x: ax.plot(
+                    *_pre_xys([x[col_start], x[col_end]], [y, y], **kws_pre_xys),
+                    lw=lw,
+                    solid_capstyle="butt",
+                    color="w",
+                    alpha=1,
+                    zorder=1,
+                    clip_on=False,
+                ),
+                axis=1,
+            )
+            ## centromere
+            data.loc[(data["cytoband type"] == "acen"), :].log().apply(
+                lambda x: ax.plot(
+                    *_pre_xys([x[col_start], x[col_end]], [y, y], **kws_pre_xys),
+                    lw=lw * 0.75,
+                    solid_capstyle="butt",
+                    color=color_centromer,  #'lightcoral', ##F5B8B7
+                    zorder=2,
+                    clip_on=False,
+                ),
+                axis=1,
+            )
         ## outlines
         start_line, end_line = (
             data.query("`cytoband type`!='acen'")
             .agg({col_start: "min", col_end: "max"})
             .tolist()
         )
-        ax.plot(
-            *_pre_xys([start_line + offx, end_line - offx], [y, y], **kws_pre_xys),
-            lw=lw + 2,
-            solid_capstyle=solid_capstyle,
-            color=ec,
-            zorder=1,
-            clip_on=False,
-        )
-        ax.plot(
-            *_pre_xys([start_line + offx, end_line - offx], [y, y], **kws_pre_xys),
-            lw=lw,
-            solid_capstyle=solid_capstyle,
-            color="w",
-            zorder=1,
-            clip_on=False,
-        )
+        if collection is not False:
+            for kws_line in [
+                dict(layer="outline edge", color=ec, lw=lw + 2),
+                dict(layer="outline", color="w", lw=lw),
+            ]:
+                _add_segments(
+                    segments,
+                    *_pre_xys(
+                        [start_line + offx, end_line - offx], [y, y], **kws_pre_xys
+                    ),
+                    capstyle=solid_capstyle,
+                    alpha=1,
+                    zorder=1,
+                    **kws_line,
+                )
+            if collection is True:
+                _draw_segments(segments, ax=ax)
+        else:
+            ax.plot(
+                *_pre_xys([start_line + offx, end_line - offx], [y, y], **kws_pre_xys),
+                lw=lw + 2,
+                solid_capstyle=solid_capstyle,
+                color=ec,
+                zorder=1,
+                clip_on=False,
+            )
+            ax.plot(
+                *_pre_xys([start_line + offx, end_line - offx], [y, y], **kws_pre_xys),
+                lw=lw,
+                solid_capstyle=solid_capstyle,
+                color="w",
+                zorder=1,
+                clip_on=False,
+            )
     if not test:
         ax.axis("off")
     _format_polar_subplot(
@@ -368,6 +485,10 @@ def plot_chrom(
     """
     ## subplot
     ax = _get_ax(ax=ax, arc=arc, figsize=figsize)
+    ## the lines of the arms drawn together
+    draw_segments = kws_plot_arm.get("collection", True) is True
+    if draw_segments:
+        kws_plot_arm["collection"] = {}
     if "kws_pre_xys" not in kws_plot_arm:
         kws_plot_arm["kws_pre_xys"] = {}
     if "range2" not in kws_plot_arm["kws_pre_xys"]:
@@ -393,6 +514,8 @@ def plot_chrom(
             )
         )
     )
+    if draw_segments:
+        _draw_segments(kws_plot_arm["collection"], ax=ax)
     if ax.name == "polar":
         try:
             ax.set(
@@ -410,6 +533,102 @@ def plot_chrom(
     return ax
 
 
+def _factorize_chrom_names(
+    chroms,
+) -> tuple:
+    """Factorize the chromosome names, formatted once per unique name."""
+
+    def _format_chrom_name(x):
+        return (
+            int(x)
+            if isinstance(x, (float, np.floating))
+            else int(x)
+            if isinstance(x, (int, np.integer))
+            else int(x)
+            if x.isnumeric()
+            else x
+        )
+
+    codes, uniques = pd.factorize(pd.Series(chroms), use_na_sentinel=False)
+    names = np.empty(len(uniques), dtype=object)
+    names[:] = [_format_chrom_name(x) for x in uniques]
+    return codes, names
+
+
+def format_chrom_names(
+    chroms,
+) -> pd.Series:
+    """Format the chromosome names, the numeric ones to integers.
+
+    The names are formatted once per unique name, for the tables with many loci.
+
+    Args:
+        chroms: chromosome names.
+
+    Returns:
+        pd.Series: formatted names.
+    """
+    chroms = pd.Series(chroms)
+    codes, names = _factorize_chrom_names(chroms)
+    return pd.Series(names[codes], index=chroms.index, name=chroms.name)
+
+
+def sort_chrom_names(
+    chroms: list,
+) -> list:
+    """Sort the chromosome names, the numeric ones first.
+
+    Args:
+        chroms (list): chromosome names, formatted by `format_chrom_names`.
+
+    Returns:
+        list: sorted unique names.
+    """
+    chroms = pd.unique(np.asarray(chroms, dtype=object))
+    return sorted([x for x in chroms if isinstance(x, int)]) + sorted(
+        [x for x in chroms if not isinstance(x, int)]
+    )
+
+
+def get_genome_offsets(
+    genome_ends: pd.Series,
+) -> pd.Series:
+    """Get the offsets of the chromosomes on the genome i.e. the chromosomes concatenated.
+
+    Args:
+        genome_ends (pd.Series): end positions of the chromosomes on the genome, indexed by the chromosomes in their order on the genome.
+
+    Returns:
+        pd.Series: offsets i.e. the end positions of the previous chromosomes.
+    """
+    return genome_ends.shift(fill_value=0)
+
+
+def to_genome_coords(
+    chroms,
+    positions,
+    genome_offsets: pd.Series,
+) -> np.ndarray:
+    """Map the positions on the chromosomes to the positions on the genome.
+
+    Args:
+        chroms: chromosome names.
+        positions: positions on the chromosomes (1-based).
+        genome_offsets (pd.Series): offsets of the chromosomes, from `get_genome_offsets`.
+
+    Returns:
+        np.ndarray: positions on the genome.
+
+    Examples:
+        genome_offsets = get_genome_offsets(cytobands.groupby("chromosome", sort=False)["end"].max().cumsum())
+        to_genome_coords(loci["chromosome"], loci["position"], genome_offsets)
+    """
+    ## looked up once per unique chromosome
+    codes, uniques = pd.factorize(pd.Series(chroms), use_na_sentinel=False)
+    offsets = genome_offsets.reindex(uniques).to_numpy(dtype=float)[codes]
+    return offsets + np.asarray(positions)
+
+
 def _rescale_to_chroms(
     df: pd.DataFrame,
     col_start: str,
@@ -433,17 +652,13 @@ def _rescale_to_chroms(
     """
     df = df.assign(
         **{
-            col_chroms_start: lambda df: df.apply(
-                lambda x: x[col_chrom_start] - 1 + x[col_start], axis=1
-            ),
+            col_chroms_start: lambda df: df[col_chrom_start] - 1 + df[col_start],
         }
     )
     if col_chroms_end is not None:
         df = df.assign(
             **{
-                col_chroms_end: lambda df: df.apply(
-                    lambda x: x[col_chrom_start] - 1 + x[col_end], axis=1
-                ),
+                col_chroms_end: lambda df: df[col_chrom_start] - 1 + df[col_end],
             }
         )
     return df
@@ -464,56 +679,56 @@ def _sort_chroms(
     Returns:
         pd.DataFrame: table with sorted chromosomes.
     """
-
-    def _format_chrom_names(x):
-        return (
-            int(x)
-            if isinstance(x, float)
-            else x
-            if isinstance(x, int)
-            else int(x)
-            if x.isnumeric()
-            else x
-        )
-
     ## sort chroms
-    data = data.assign(
-        **{
-            "chromosome": lambda df: df["chromosome"].apply(
-                # lambda x: int(x) if x.isnumeric() else x
-                _format_chrom_names,
-            ),
-            "chrom name instance": lambda df: df["chromosome"].apply(
-                lambda x: not isinstance(x, int)
-            ),
-        }
-    ).sort_values(["chrom name instance", "chromosome"], ascending=[True, True])
-    chromosomes_all = data["chromosome"].drop_duplicates().tolist()
+    codes, names = _factorize_chrom_names(data["chromosome"])
+    chromosomes_all = sort_chrom_names(names)
     if chromosomes is None:
         # sort chromosomes
-        chromosomes = list(map(_format_chrom_names, chromosomes_all))
-        if len(chromosomes) > 1 and len(chromosomes) != len(chromosomes_all):
-            logging.warning(
-                f"chromosomes order not provided. inferred one: {chromosomes}"
-            )
+        chromosomes = chromosomes_all
     else:
-        chromosomes = list(map(lambda x: _format_chrom_names(x), chromosomes))
+        chromosomes = format_chrom_names(chromosomes).tolist()
         from roux.lib.set import assert_overlaps_with
 
         assert_overlaps_with(chromosomes, chromosomes_all)
         ## sort
         chromosomes = [k for k in chromosomes_all if k in chromosomes]
+    ## codes of the chromosomes in their order, -1 if filtered out
+    cat_codes = pd.Index(chromosomes, dtype=object).get_indexer(names)[codes]
+    data = data.assign(
+        **{
+            "chromosome": pd.Categorical.from_codes(
+                cat_codes, categories=chromosomes, ordered=True
+            ),
+            "chrom name instance": ~np.array(
+                [isinstance(x, int) for x in names], dtype=bool
+            )[codes],
+        }
+    )
+    if len(chromosomes) != len(chromosomes_all):
         ## filter
-        data = data.log.query(expr=f"`chromosome` == {chromosomes}")
+        keep = cat_codes != -1
+        logging.info(f"chromosomes filtered: {len(data)} -> {keep.sum()}")
+        data, cat_codes = data.loc[keep, :], cat_codes[keep]
     assert len(data) != 0, chromosomes
-    # print(data)
-    data.rd.assert_no_na(subset=["chromosome"])
 
     # sort loci
-    data = data.rd.astype_cat(col="chromosome", cats=chromosomes).sort_values(
-        ["chromosome"] + ([] if col_start is None else [col_start])
-    )
-    return data
+    if col_start is None:
+        order = np.argsort(cat_codes, kind="stable")
+    else:
+        starts = data[col_start].to_numpy()
+        if np.issubdtype(starts.dtype, np.integer) and len(starts) != 0:
+            ## a single key, faster to sort than a pair of keys
+            span = int(starts.max()) - int(starts.min()) + 1
+            if span * len(chromosomes) < 2**62:
+                starts = starts - starts.min()
+                order = np.argsort(
+                    cat_codes.astype(np.int64) * span + starts, kind="stable"
+                )
+            else:
+                order = np.lexsort((starts, cat_codes))
+        else:
+            order = np.lexsort((starts, cat_codes))
+    return data.iloc[order, :]
 
 
 def _concat_chroms(
@@ -557,18 +772,18 @@ def _concat_chroms(
         )
 
     ### .. of previous chromosome
-    _genome_ends = genome_ends.shift(fill_value=0).to_dict()
+    genome_offsets = get_genome_offsets(genome_ends)
 
     if test:
         print(data.groupby("chromosome", sort=False, observed=False)[col_end].max())
-        print(_genome_ends)
+        print(genome_offsets.to_dict())
 
     df1 = data.assign(
         **{
-            "chrom i": lambda df: df.groupby(
-                "chromosome", sort=False, observed=False
-            ).ngroup(),
-            col_chrom_start: lambda df: df["chromosome"].map(_genome_ends).astype(int)
+            "chrom i": data["chromosome"].cat.codes.to_numpy().astype(int),
+            col_chrom_start: lambda df: df["chromosome"]
+            .map(genome_offsets)
+            .astype(int)
             + 1,
             col_chrom_end: lambda df: df["chromosome"].map(genome_ends),
         }
@@ -657,7 +872,7 @@ def plot_chroms(
     """Plot chromosomes joined.
 
     Args:
-        data (pd.DataFrame): cytonbands
+        data (pd.DataFrame): cytonbands, or name of the assembly e.g. 'GRCh38' (see `chrov.cytobands.get_cytobands`).
         arc (bool, optional): arc/polar mode. Defaults to True.
         chromosomes (list, optional): chromosomes. Defaults to None.
         col_start (str, optional): column with start position. Defaults to 'start'.
@@ -676,9 +891,17 @@ def plot_chroms(
         figsize (list, optional): figure size. Defaults to None.
         out_data (bool, optional): output data. Defaults to False.
     """
+    if isinstance(data, str):
+        from chrov.cytobands import get_cytobands
+
+        data = get_cytobands(data)
     ## subplot
     ax = _get_ax(ax=ax, arc=arc, figsize=figsize)
 
+    ## the lines of all the chromosomes drawn together
+    draw_segments = kws_plot_arm.get("collection", True) is True
+    if draw_segments:
+        kws_plot_arm["collection"] = {}
     if "kws_pre_xys" not in kws_plot_arm:
         kws_plot_arm["kws_pre_xys"] = {}
     if "range2" not in kws_plot_arm["kws_pre_xys"]:
@@ -717,6 +940,8 @@ def plot_chroms(
             ax=ax,
         )
     )
+    if draw_segments:
+        _draw_segments(kws_plot_arm["collection"], ax=ax)
 
     ## vspans
     _xlim = df1.agg({"genome start": "min", "genome end": "max"}).tolist()
@@ -911,7 +1136,7 @@ def annot_chroms(
 
 
     Args:
-        data (pd.DataFrame): table with cytobands
+        data (pd.DataFrame): table with cytobands, or name of the assembly e.g. 'GRCh38'.
         chromosomes (list): chromosomes
         ax_chrom (plt.Axes, optional): subplot with chromosome plot. Defaults to None.
         chrom_y (float, optional): chromosome y-position. Defaults to 0.
@@ -97,12 +97,8 @@ def plot_ranges(
         # .sort_values(col_start,ascending=False)
         .assign(
             **{
-                col_start: lambda df: df[col_start].apply(
-                    lambda x: x if x >= start else start
-                ),  # trim
-                col_end: lambda df: df[col_end].apply(
-                    lambda x: x if x <= end else end
-                ),  # trim
+                col_start: lambda df: df[col_start].clip(lower=start),  # trim
+                col_end: lambda df: df[col_end].clip(upper=end),  # trim
             }
         )
     )
@@ -167,65 +163,48 @@ def plot_ranges(
     if zorders is None:
         zorders = {}
 
-    ## lines
-    _ = df1.apply(
-        lambda x: ax.hlines(
-            y=x[y],
-            xmin=x[col_start],
-            xmax=x[col_end],
-            color=colors.get(x[col_hue], color),
+    ## lines, drawn as a single collection, in the order of the rows
+    df_ = df1.loc[df1[y].notnull(), :]
+    if len(df_) != 0:
+        ax.hlines(
+            y=df_[y].to_numpy(),
+            xmin=df_[col_start].to_numpy(),
+            xmax=df_[col_end].to_numpy(),
+            colors=df_[col_hue].map(lambda x: colors.get(x, color)).tolist(),
             lw=lw,
             **kws_hlines,
         )
-        if not pd.isnull(x[y])
-        else None,
-        axis=1,
-    )
     ax.invert_yaxis()
     # labels
     if show_labels:
         if kind in [None, "split", "separate"]:
-            _ = df1.apply(
-                lambda x: ax.text(
-                    x=x[col_start],
-                    y=x[y],
-                    s=f"{x[col_label]} ",
+            for x_, y_, s_ in zip(df_[col_start], df_[y], df_[col_label]):
+                ax.text(
+                    x=x_,
+                    y=y_,
+                    s=f"{s_} ",
                     ha="right",
                     va="center",
-                    # color=x['label_color'],
                 )
-                if not pd.isnull(x[y])
-                else None,
-                axis=1,
-            )
             if col_label_right is not None:
-                _ = df1.apply(
-                    lambda x: ax.text(
-                        x=x[col_end],
-                        y=x[y],
-                        s=f"{x[col_label_right]} ",
+                for x_, y_, s_ in zip(df1[col_end], df1[y], df1[col_label_right]):
+                    ax.text(
+                        x=x_,
+                        y=y_,
+                        s=f"{s_} ",
                         ha="left",
                         va="center",
-                        # color=x['label_color'],
-                    ),
-                    axis=1,
-                )
+                    )
         elif kind.lower().startswith("join"):
-            _ = (
-                df1.loc[:, [col_label, y]]
-                .drop_duplicates()
-                .apply(
-                    lambda x: ax.text(
-                        x=start if strand != "-" else end,
-                        y=x[y],
-                        s=f"{x[col_label]} ",
-                        ha="right",
-                        va="center",
-                        # color=x['label_color'],
-                    ),
-                    axis=1,
+            df_ = df1.loc[:, [col_label, y]].drop_duplicates()
+            for y_, s_ in zip(df_[y], df_[col_label]):
+                ax.text(
+                    x=start if strand != "-" else end,
+                    y=y_,
+                    s=f"{s_} ",
+                    ha="right",
+                    va="center",
                 )
-            )
     # _=df1.apply(lambda x: ax.plot(
     #     [x['start'],x['end']],[x[y],x[y]],
     #     color=colors[x[hue]] if x[hue] in colors else 'w',
@@ -280,10 +259,7 @@ def plot_ranges(
         df_ = df1.loc[:, [y, col_groupby]].drop_duplicates()
         ax.set(
             yticks=df_[y].tolist(),
-            yticklabels=df_.apply(
-                lambda x: f"{x[col_groupby]}:{x[y]}",
-                axis=1,
-            ),
+            yticklabels=df_[col_groupby].astype(str) + ":" + df_[y].astype(str),
         )
         from roux.viz.ax_ import split_ticklabels
 
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def write_gtf(
+    path,
+    n_genes=6,
+    chroms=("1", "2", "X"),
+    seed=0,
+):
+    """Write a small GTF with overlapping isoforms, for testing without the Ensembl downloads."""
+    rng = np.random.default_rng(seed)
+
+    def to_attrs(**kws):
+        return " ".join(f'{k} "{v}";' for k, v in kws.items())
+
+    lines = []
+    for gi in range(n_genes):
+        chrom, strand = chroms[gi % len(chroms)], "+" if gi % 2 == 0 else "-"
+        gene_id = f"ENSG{gi:011d}"
+        exons, pos = [], int(rng.integers(1e5, 1e7))
+        for _ in range(int(rng.integers(4, 9))):
+            start = pos + int(rng.integers(100, 2000))
+            pos = start + int(rng.integers(60, 400))
+            exons.append((start, pos))
+        kws_gene = dict(gene_id=gene_id, gene_name=f"GENE{gi}", gene_biotype="protein_coding")
+        lines.append([chrom, "gene", exons[0][0], exons[-1][1], strand, ".", to_attrs(**kws_gene)])
+        for ti in range(int(rng.integers(2, 5))):
+            exon_ids = sorted(set([0, len(exons) - 1] + list(rng.choice(len(exons), size=2))))
+            if strand == "-":
+                exon_ids = exon_ids[::-1]
+            biotype = "protein_coding" if ti < 2 else "retained_intron"
+            kws_transcript = dict(
+                **kws_gene,
+                transcript_id=f"ENST{gi:06d}{ti:05d}",
+                transcript_name=f"GENE{gi}-{ti}",
+                transcript_biotype=biotype,
+            )
+            starts, ends = zip(*[exons[i] for i in exon_ids])
+            lines.append([chrom, "transcript", min(starts), max(ends), strand, ".", to_attrs(**kws_transcript)])
+            for n, i in enumerate(exon_ids):
+                lines.append(
+                    [
+                        chrom,
+                        "exon",
+                        *exons[i],
+                        strand,
+                        ".",
+                        to_attrs(**kws_transcript, exon_number=n + 1, exon_id=f"ENSE{gi:06d}{i:05d}"),
+                    ]
+                )
+            if biotype != "protein_coding":
+                continue
+            ## UTRs trimmed from the first and last exons
+            cds = [list(exons[i]) for i in exon_ids]
+            cds[0][0 if strand == "+" else 1] += 10 if strand == "+" else -10
+            cds[-1][1 if strand == "+" else 0] += -13 if strand == "+" else 13
+            ## in frame
+            extra = sum(end - start + 1 for start, end in cds) % 3
+            cds[-1][1 if strand == "+" else 0] += -extra if strand == "+" else extra
+            for n, (start, end) in enumerate(cds):
+                lines.append(
+                    [
+                        chrom,
+                        "CDS",
+                        start,
+                        end,
+                        strand,
+                        "0",
+                        to_attrs(**kws_transcript, exon_number=n + 1, protein_id=f"ENSP{gi:06d}{ti:05d}"),
+                    ]
+                )
+    with open(path, "w") as f:
+        for chrom, feature, start, end, strand, frame, attrs in lines:
+            f.write("\t".join(map(str, [chrom, "ensembl", feature, start, end, ".", strand, frame, attrs])) + "\n")
+    return path
+
+
+@pytest.fixture(scope="session")
+def make_annots(tmp_path_factory):
+    """Make the pyensembl annotations from a small GTF, with the arguments of `write_gtf` e.g. `n_genes`."""
+    from pyensembl import Genome
+
+    def make(**kws_write_gtf):
+        dir_path = tmp_path_factory.mktemp("annots")
+        genome = Genome(
+            reference_name="test",
+            annotation_name="test",
+            gtf_path_or_url=str(write_gtf(dir_path / "test.gtf", **kws_write_gtf)),
+            cache_directory_path=str(dir_path),
+        )
+        genome.index()
+        return genome
+
+    return make
+
+
+@pytest.fixture(scope="session")
+def annots(make_annots):
+    """pyensembl annotations from the small GTF."""
+    return make_annots()
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """The gene plots, without the Ensembl queries."""
+    import chrov.annots
+    import chrov.domains
+    import chrov.fig.mat
+
+    monkeypatch.setattr(chrov.annots, "get_annots", lambda **kws: None)
+    monkeypatch.setattr(chrov.domains, "get_domains", lambda **kws: None)
+    monkeypatch.setattr(chrov.fig.mat, "get_gid_info", lambda gid, **kws: {"seq_region_name": "1"})
+    monkeypatch.setattr(chrov.annots, "get_ts_data", lambda **kws: pd.DataFrame({"t.id": ["T1"], "t.length": [10]}))
+    monkeypatch.setattr(
+        chrov.domains, "get_ds_data", lambda **kws: pd.DataFrame({"d.start": [1], "d.end": [5], "d.length": [4]})
+    )
+    monkeypatch.setattr(
+        chrov.domains,
+        "to_gpos",
+        lambda *args, **kws: pd.DataFrame({"t.id": ["T1"], "d.id": ["D1"], "d.start": [1], "d.end": [5]}),
+    )
+    monkeypatch.setattr(chrov.domains, "plot_domains", lambda ax=None, **kws: ax.plot([0, 1], [0, 1])[0].axes)
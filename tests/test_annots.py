@@ -0,0 +1,261 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from chrov.annots import (
+    get_es,
+    get_cs,
+    intersect_with_seqs,
+    intersect_with_feats,
+    build_ts_store,
+    read_ts_store,
+    get_ts_data,
+)
+
+
+def test_ts_store(annots, tmp_path):
+    store_path = build_ts_store(
+        ensembl_release=1,
+        species="homo sapiens",
+        annots=annots,
+        cache_dir_path=str(tmp_path),
+    )
+    for g in annots.genes():
+        ts = [t for t in g.transcripts if t.biotype == "protein_coding"]
+        df1, df2 = read_ts_store(g.id, store_path=store_path)
+        ## the order of the tied rows is not defined
+        pd.testing.assert_frame_equal(
+            *[
+                df.sort_values(df.columns.tolist()).reset_index(drop=True)
+                for df in [
+                    intersect_with_feats(df1, df2, feat2_prefix="c"),
+                    intersect_with_feats(get_es(ts), get_cs(ts), feat2_prefix="c"),
+                ]
+            ]
+        )
+    ## read through the store, without the per-gene cache
+    df3 = get_ts_data(
+        g.id,
+        ensembl_release=1,
+        species="homo sapiens",
+        protein_coding=True,
+        cds_prefix="c",
+        cache_dir_path=str(tmp_path),
+    )
+    assert df3["t.id"].nunique() == len(ts)
+    assert not any(tmp_path.rglob(f"{g.id}/ts/*.pqt"))
+
+
+def test_ts_store_rebuilt(annots, make_annots, tmp_path):
+    from chrov.annots import _read_ts_store_genes
+
+    kws = dict(ensembl_release=1, species="homo sapiens", cache_dir_path=str(tmp_path))
+    store_path = build_ts_store(annots=annots, **kws)
+    assert set(_read_ts_store_genes(store_path)) == set(annots.gene_ids())
+    ## re-built in the same process, from the other annotations
+    annots_more = make_annots(n_genes=len(annots.gene_ids()) + 1)
+    build_ts_store(annots=annots_more, force=True, **kws)
+    assert set(_read_ts_store_genes(store_path)) == set(annots_more.gene_ids())
+
+
+def test_ts_store_missing(annots, make_annots, tmp_path, monkeypatch):
+    import chrov.annots
+
+    build_ts_store(ensembl_release=1, species="homo sapiens", annots=annots, cache_dir_path=str(tmp_path))
+    ## a gene not in the store, fetched per gene
+    annots_more = make_annots(n_genes=len(annots.gene_ids()) + 1)
+    monkeypatch.setattr(chrov.annots, "get_annots", lambda **kws: annots_more)
+    g = annots_more.gene_by_id(sorted(set(annots_more.gene_ids()) - set(annots.gene_ids()))[0])
+    df1 = get_ts_data(
+        g.id,
+        ensembl_release=1,
+        species="homo sapiens",
+        protein_coding=True,
+        cds_prefix="c",
+        cache_dir_path=str(tmp_path),
+    )
+    assert set(df1["t.id"]) == {t.id for t in g.transcripts if t.biotype == "protein_coding"}
+    assert any(tmp_path.rglob(f"{g.id}/ts/*.pqt"))
+
+
+def get_isoforms():
+    ## a gene with 50 isoforms
+    rng = np.random.default_rng(0)
+    starts = np.sort(rng.choice(np.arange(1000, 10000000, 500), 40, replace=False))
+    df1 = pd.DataFrame(
+        [
+            {
+                "t.id": f"T{ti:02d}",
+                "e.id": f"E{i}",
+                "e.start": starts[i],
+                "e.end": starts[i] + 100 + i,
+            }
+            for ti in range(50)
+            for i in sorted(rng.choice(len(starts), size=20, replace=False))
+        ]
+    )
+    df2 = (
+        df1.assign(
+            **{
+                "c.start": lambda df: df["e.start"] + 5,
+                "c.end": lambda df: df["e.end"] - 3,
+            }
+        )
+        .loc[:, ["t.id", "c.start", "c.end"]]
+        .sample(frac=0.8, random_state=0)
+    )
+    return df1, df2
+
+
+def test_intersect_with_seqs():
+    df1, df2 = get_isoforms()
+    pd.testing.assert_frame_equal(
+        intersect_with_seqs(df1, df2, engine="join"),
+        intersect_with_seqs(df1, df2, engine="groupby"),
+    )
+
+
+@pytest.mark.benchmark
+def test_intersect_with_seqs_benchmark():
+    df1, df2 = get_isoforms()
+    timings = {}
+    for engine in ["groupby", "join"]:
+        start = time.time()
+        intersect_with_seqs(df1, df2, engine=engine)
+        timings[engine] = time.time() - start
+    print(timings)
+    assert timings["join"] < timings["groupby"]
+
+
+def get_es_records(ts):
+    ## reference: a dict per exon
+    from roux.stat.paired import get_diff_sorted
+
+    return (
+        pd.DataFrame(
+            [
+                {
+                    "t.id": t.id,
+                    "t.length": t.length,
+                    "t.start": t.start,
+                    "t.end": t.end,
+                    "t.strand": t.strand,
+                    "e.start": e.start,
+                    "e.end": e.end,
+                    "e.id": e.id,
+                }
+                for t in ts
+                for e in t.exons
+            ]
+        )
+        .sort_values(["e.start"], ascending=[True])
+        .assign(
+            **{
+                "e.length": lambda df: df.apply(lambda x: get_diff_sorted(x["e.start"], x["e.end"]), axis=1),
+            },
+        )
+    )
+
+
+def get_cs_records(ts):
+    ## reference: the CDSs of a transcript repeated per exon, then de-duplicated
+    from chrov.annots import is_protein_coding
+
+    return (
+        pd.DataFrame(
+            [
+                {"t.id": t.id, "t.cds": t.coding_sequence_position_ranges if is_protein_coding(t) else None}
+                for t in ts
+                for e in t.exons
+            ]
+        )
+        .explode("t.cds")
+        .set_index("t.id")["t.cds"]
+        .apply(pd.Series)
+        .reset_index()
+        .rename(columns={0: "c.start", 1: "c.end"}, errors="raise")
+        .sort_values(["c.start"], ascending=[True])
+        .drop_duplicates()
+        .assign(**{"c.id": lambda df: df.apply(lambda x: f"{x['c.start']}-{x['c.end']}", axis=1)})
+        .dropna()
+    )
+
+
+def test_get_es_cs(annots):
+    for ts in [
+        ## with the non-coding transcripts
+        annots.transcripts(),
+        [t for t in annots.transcripts() if t.biotype == "protein_coding"],
+        ## with the repeated transcripts
+        annots.transcripts() + annots.transcripts()[:3],
+    ]:
+        pd.testing.assert_frame_equal(get_es(ts), get_es_records(ts))
+        ## the order of the tied rows is not defined
+        pd.testing.assert_frame_equal(
+            *[df.sort_values(df.columns.tolist()).reset_index(drop=True) for df in [get_cs(ts), get_cs_records(ts)]]
+        )
+
+
+@pytest.mark.benchmark
+def test_get_es_cs_benchmark(make_annots):
+    ts = make_annots(n_genes=300).transcripts()
+    timings = {}
+    for engine, (f_es, f_cs) in {
+        "records": (get_es_records, get_cs_records),
+        "columnar": (get_es, get_cs),
+    }.items():
+        start = time.time()
+        f_es(ts), f_cs(ts)
+        timings[engine] = time.time() - start
+    print(timings)
+    assert timings["columnar"] * 5 < timings["records"]
+
+
+def test_annots_pool(annots):
+    from concurrent.futures import ThreadPoolExecutor
+    from chrov.annots import AnnotsPool
+
+    opened = []
+
+    def open_annots(ensembl_release, species):
+        opened.append(ensembl_release)
+        ## fresh instance with its own connection
+        from pyensembl import Genome
+
+        return Genome(
+            reference_name=annots.reference_name,
+            annotation_name=annots.annotation_name,
+            gtf_path_or_url=annots.gtf_path,
+            cache_directory_path=annots.cache_directory_path,
+        )
+
+    with AnnotsPool(maxsize=2, open_annots=open_annots) as pool:
+        with ThreadPoolExecutor(4) as executor:
+            ## the connection is shared between the threads
+            ids = list(
+                executor.map(
+                    lambda gene_id: pool.get(1, "homo sapiens").gene_by_id(gene_id).id,
+                    [g.id for g in annots.genes()] * 4,
+                )
+            )
+        assert ids == [g.id for g in annots.genes()] * 4
+        assert opened == [1]
+        annots1 = pool.get(1, "homo sapiens")
+        pool.get(2, "homo sapiens")
+        pool.get(3, "homo sapiens")
+        ## least recently used is closed
+        assert opened == [1, 2, 3] and len(pool) == 2
+        assert annots1.db._connection is None
+    assert len(pool) == 0
+
+
+def test_share_connection_fallback():
+    from types import SimpleNamespace
+    from chrov.annots import _share_connection, _close_annots
+
+    ## other internals of pyensembl
+    annots = SimpleNamespace(db=SimpleNamespace(), _db=SimpleNamespace(), clear_cache=lambda: None)
+    assert _share_connection(annots) is annots
+    _close_annots(annots)
@@ -0,0 +1,167 @@
+import os
+import time
+
+import pandas as pd
+
+from chrov.cache import CacheIndex
+
+
+def write(p, size):
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_bytes(b"0" * size)
+    return p
+
+
+def test_cache_index(tmp_path):
+    index = CacheIndex(tmp_path, max_bytes="3K")
+    ## every access recorded
+    index.atime_resolution = 0
+    ps = [write(tmp_path / "source" / f"{i}.pqt", 1024) for i in range(3)]
+    for p in ps:
+        assert index.add(p)
+        time.sleep(0.01)
+    assert index.get_size() == 3 * 1024
+    ## accessed, the least recently used is the second
+    assert index.exists(ps[0])
+    assert index.add(write(tmp_path / "source" / "3.pqt", 1024))
+    assert not ps[1].exists() and ps[0].exists()
+    assert index.get_size() == 3 * 1024
+    ## outside the cache
+    assert not index.add(write(tmp_path.parent / f"{tmp_path.name}.pqt", 1))
+    ## the file not indexed e.g. cached by an older version
+    index.max_bytes = None
+    p = write(tmp_path / "other" / "4.pqt", 10)
+    assert index.exists(p) and index.get_size() == 3 * 1024 + 10
+    df1 = index.stats()
+    assert df1.set_index("directory")["files"].to_dict() == {"source": 3, "other": 1}
+    ## removed outside chrov, detected by verify
+    os.remove(ps[2])
+    write(tmp_path / "other" / "5.pqt", 10)
+    assert index.verify() == dict(missing=1, untracked=1, modified=0)
+    assert index.verify() == dict(missing=0, untracked=0, modified=0)
+    assert not index.exists(ps[2])
+    ## removed outside chrov, detected on the lookup
+    os.remove(p)
+    assert not index.exists(p)
+    assert index.verify() == dict(missing=0, untracked=0, modified=0)
+    assert len(index.prune(max_bytes=1024)) == 2
+
+
+def test_cache_atime(tmp_path):
+    index = CacheIndex(tmp_path, wal=False)
+    assert index.db.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    p = write(tmp_path / "source" / "1.pqt", 10)
+    index.add(p)
+    atime = index.db.execute("SELECT atime FROM entries").fetchone()[0]
+    ## the repeated accesses not written
+    assert index.exists(p)
+    assert index.db.execute("SELECT atime FROM entries").fetchone()[0] == atime
+    index.atime_resolution = 0
+    assert index.exists(p)
+    assert index.db.execute("SELECT atime FROM entries").fetchone()[0] > atime
+
+
+def test_cache_removed(annots, tmp_path, monkeypatch):
+    import chrov.annots
+    from chrov.annots import get_ts_data
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(chrov.annots, "get_annots", lambda **kws: annots)
+    calls = []
+    get_es = chrov.annots.get_es
+    monkeypatch.setattr(chrov.annots, "get_es", lambda **kws: calls.append(1) or get_es(**kws))
+    kws = dict(
+        gene_id=next(iter(annots.genes())).id,
+        ensembl_release=1,
+        species="homo sapiens",
+        protein_coding=True,
+        cds_prefix="c",
+    )
+    df1 = get_ts_data(**kws)
+    (p,) = tmp_path.rglob("protein_coding=True.pqt")
+    pd.testing.assert_frame_equal(get_ts_data(**kws), df1)
+    assert len(calls) == 1
+    ## removed to be re-fetched
+    os.remove(p)
+    pd.testing.assert_frame_equal(get_ts_data(**kws), df1)
+    assert len(calls) == 2 and p.exists()
+
+
+def test_cache_add(tmp_path, monkeypatch):
+    from chrov.utils import get_cache_dir, to_table_atomic
+    from chrov.cache import get_cache_index
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    p = to_table_atomic(pd.DataFrame({"a": [1]}), f"{get_cache_dir()}/source/1.pqt")
+    index = get_cache_index()
+    assert index.get_key(p) == "source/1.pqt"
+    assert index.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 1
+
+
+def compute_once(p):
+    from chrov.cache import single_flight
+    from chrov.utils import to_table_atomic
+
+    with single_flight(p) as compute:
+        if compute:
+            with open(f"{p}.computed", "a") as f:
+                f.write(f"{os.getpid()}\n")
+            time.sleep(0.2)
+            to_table_atomic(pd.DataFrame({"pid": [os.getpid()] * 10000}), p)
+    return pd.read_parquet(p)["pid"].unique().tolist()
+
+
+def test_single_flight(tmp_path, monkeypatch):
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from multiprocessing import get_context
+    from chrov.cache import get_cache_index
+    from chrov.utils import get_cache_dir
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    keys = [f"{get_cache_dir()}/source/{i}.pqt" for i in range(3)]
+    with ProcessPoolExecutor(8, mp_context=get_context("fork")) as executor:
+        outputs = list(executor.map(compute_once, [k for _ in range(8) for k in keys]))
+    ## computed once per key, by a process, and read whole by the others
+    for i, k in enumerate(keys):
+        pids = open(f"{k}.computed").read().split()
+        assert len(pids) == 1
+        assert all(o == [int(pids[0])] for o in outputs[i :: len(keys)])
+    ## and by the threads
+    k = f"{get_cache_dir()}/source/threads.pqt"
+    with ThreadPoolExecutor(4) as executor:
+        outputs = list(executor.map(compute_once, [k] * 8))
+    assert len(open(f"{k}.computed").read().split()) == 1
+    ## the lock files removed, and not indexed
+    assert not list(tmp_path.rglob("*.lock"))
+    index = get_cache_index()
+    index.verify()
+    assert not index.db.execute("SELECT path FROM entries WHERE path LIKE '%.lock'").fetchall()
+
+
+def test_cache_store(annots, tmp_path, monkeypatch):
+    import chrov.annots
+    from chrov.annots import build_ts_store, get_ts_data
+    from chrov.cache import get_cache_index
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(chrov.annots, "get_annots", lambda **kws: annots)
+    kws = dict(ensembl_release=1, species="homo sapiens")
+    store_path = build_ts_store(annots=annots, **kws)
+    index = get_cache_index()
+    key = index.get_key(store_path)
+    ## indexed as one entry, also by verify
+    assert [k for (k,) in index.db.execute("SELECT path FROM entries")] == [key]
+    assert index.verify() == dict(missing=0, untracked=0, modified=0)
+    ## the total size, as summed
+    write(tmp_path / "other" / "1.pqt", 10)
+    index.verify()
+    write(tmp_path / "other" / "1.pqt", 20)
+    index.add(tmp_path / "other" / "1.pqt")
+    assert index.get_size() == index.db.execute("SELECT SUM(size) FROM entries").fetchone()[0]
+    ## evicted whole, and fetched per gene after
+    index.db.execute("UPDATE entries SET atime = 0 WHERE path = ?", (key,))
+    assert index.prune(max_bytes=100) == [f"{index.cache_dir_path}/{key}"]
+    assert not os.path.exists(store_path)
+    g = next(iter(annots.genes()))
+    df1 = get_ts_data(g.id, protein_coding=True, cds_prefix="c", **kws)
+    assert set(df1["t.id"]) == {t.id for t in g.transcripts if t.biotype == "protein_coding"}
@@ -0,0 +1,95 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pandas as pd
+import pytest
+
+from chrov.core import get_biomart_query, fetch_biomart_shards
+
+
+@pytest.fixture
+def biomart_url():
+    """Local stand-in for the BioMart service, serving the genes of the queried chromosome."""
+    import re
+
+    requests, fail = [], {"2"}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            query = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())["query"][0]
+            chrom = re.search(r'name="chromosome_name" value="(.*?)"', query).group(1)
+            requests.append(chrom)
+            if chrom in fail:
+                ## truncated response
+                fail.remove(chrom)
+                body = "Gene stable ID\tChromosome/scaffold name\nENSG1\t2\n"
+            else:
+                body = "Gene stable ID\tChromosome/scaffold name\n" + "".join(
+                    f"ENSG{chrom}{i}\t{chrom}\n" for i in range(3)
+                )
+                body += "[success]\n"
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/biomart/martservice", requests
+    server.shutdown()
+
+
+def test_fetch_biomart_shards(biomart_url, tmp_path):
+    url, requests = biomart_url
+    chroms = ["1", "2", "X"]
+    queries = {
+        f"chromosome_name={c}": get_biomart_query(
+            "hsapiens_gene_ensembl",
+            attributes=["ensembl_gene_id", "chromosome_name"],
+            filters={"chromosome_name": [c]},
+            completion_stamp=True,
+        )
+        for c in chroms
+    }
+    outp = (tmp_path / "genes.pqt").as_posix()
+    with pytest.raises(RuntimeError):
+        fetch_biomart_shards(queries, outp=outp, url=url, jobs=2)
+    ## resumed from the missing shard
+    df1 = fetch_biomart_shards(queries, outp=outp, url=url, jobs=2)
+    assert sorted(requests) == ["1", "2", "2", "X"]
+    assert df1["Chromosome/scaffold name"].tolist() == [c for c in chroms for _ in range(3)]
+    pd.testing.assert_frame_equal(pd.read_parquet(outp), df1)
+    assert not (tmp_path / "genes.parts").exists()
+
+
+def test_ingest_biomart_tsv(tmp_path):
+    import io
+    import pyarrow.parquet as pq
+    from chrov.core import ingest_biomart_tsv
+
+    tsv = (
+        "Gene stable ID\tChromosome/scaffold name\tGene start (bp)\tInterpro ID\tTranscript length (including UTRs and CDS)\tGene % GC content\n"
+        + "".join(
+            f"ENSG{i}\t{i % 3 + 1}\t{i * 100}\t{'' if i < 5 else f'IPR{i}'}\t{i * 10}\t{'' if i == 9 else i * 5}\n"
+            for i in range(10)
+        )
+    )
+    outp = ingest_biomart_tsv(io.BytesIO(tsv.encode()), tmp_path / "genes.pqt", chunksize=4)
+    ## appended as row groups
+    assert pq.ParquetFile(outp).num_row_groups == 3
+    df1 = pd.read_parquet(outp)
+    assert df1.dtypes.astype(str).tolist() == ["object", "object", "int32", "object", "int64", "float64"]
+    assert df1["Chromosome/scaffold name"].tolist() == [str(i % 3 + 1) for i in range(10)]
+    assert df1["Interpro ID"].isnull().sum() == 5
+    ## the other columns as inferred from the whole response, promoted across the chunks
+    df0 = pd.read_csv(io.StringIO(tsv), sep="\t")
+    pd.testing.assert_frame_equal(df1.iloc[:, 3:], df0.iloc[:, 3:])
+
+    ## no rows
+    df2 = pd.read_parquet(
+        ingest_biomart_tsv(io.BytesIO(tsv.split("\n")[0].encode() + b"\n"), tmp_path / "empty.pqt")
+    )
+    assert df2.columns.tolist() == df1.columns.tolist() and len(df2) == 0
@@ -0,0 +1,65 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from chrov.cytobands import get_cytobands, get_genome_ends, register_cytobands
+
+
+def test_get_cytobands():
+    df0 = pd.read_table("modules/inputs/cytobands.tsv", index_col=[0])
+    df1 = get_cytobands()
+    assert len(df1) == len(df0)
+    assert isinstance(df1["chromosome"].dtype, pd.CategoricalDtype) and df1["chromosome"].cat.ordered
+    assert df1["start"].dtype == np.int32 and df1["end"].dtype == np.int32
+    assert df1["chromosome"].cat.categories.tolist()[:3] == ["1", "2", "3"]
+    assert df1["chromosome"].cat.codes.is_monotonic_increasing
+    ## a copy, the shared table unchanged
+    df1["start"] = 0
+    assert get_cytobands()["start"].max() > 0
+    ## same ends as the concatenated chromosomes
+    from chrov.viz.chrom import _concat_chroms
+
+    df2 = _concat_chroms(
+        df0,
+        col_start="start",
+        col_end="end",
+        col_chroms_start="genome start",
+        col_chroms_end="genome end",
+    )
+    ends = get_genome_ends()
+    assert ends.to_dict() == df2.groupby("chromosome", observed=True)["genome end"].max().to_dict()
+    with pytest.raises(ValueError):
+        get_cytobands("GRCh00")
+
+
+def test_register_cytobands(tmp_path):
+    df0 = pd.read_table("modules/inputs/cytobands.tsv", index_col=[0])
+    path = tmp_path / "cytobands.tsv"
+    df0.query("`chromosome` == ['X', '2']").to_csv(path, sep="\t")
+    register_cytobands("test", path)
+    df1 = get_cytobands("test")
+    assert df1["chromosome"].cat.categories.tolist() == ["2", "X"]
+    assert get_genome_ends("test").index.tolist() == [2, "X"]
+    ## or by the path
+    pd.testing.assert_frame_equal(get_cytobands(str(path)), df1)
+
+
+def test_plot_chroms_assembly():
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from chrov.viz.chrom import plot_chroms
+
+    images = []
+    for data in [pd.read_table("modules/inputs/cytobands.tsv", index_col=[0]), "GRCh38"]:
+        fig, ax = plt.subplots(figsize=[10, 2])
+        plot_chroms(data, arc=False, ax=ax)
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=100)
+        plt.close(fig)
+        buf.seek(0)
+        images.append(plt.imread(buf))
+    assert np.array_equal(*images)
@@ -0,0 +1,140 @@
+import os
+
+import pandas as pd
+import pytest
+
+import chrov.domains as domains
+
+
+@pytest.fixture
+def kws_ds_data(annots, tmp_path, monkeypatch):
+    gene = annots.genes()[0]
+    ts = [t for t in gene.transcripts if t.biotype == "protein_coding"]
+    ## cached domains table
+    domains_path = domains.get_domains_path(
+        species="homo sapiens",
+        ensembl_release=1,
+        cache_dir_path=str(tmp_path),
+    )
+    os.makedirs(os.path.dirname(domains_path), exist_ok=True)
+    pd.DataFrame(
+        [
+            {"p.id": t.protein_id, "d.id": f"domain{i}", "d.start": 5 + i, "d.end": 40 + i, "d.length": 35}
+            for t in ts
+            for i in range(2)
+        ]
+    ).to_parquet(domains_path)
+
+    calls = []
+
+    def get_ploc(pids, **kws):
+        calls.append(pids)
+        return pd.DataFrame({"p.id": pids, "p.start": 1, "p.end": 100})
+
+    monkeypatch.setattr(domains, "get_ts", lambda **kws: ts)
+    monkeypatch.setattr(domains, "get_ploc", get_ploc)
+    return dict(
+        kws=dict(
+            gene_id=gene.id,
+            ensembl_release=1,
+            species="homo sapiens",
+            suffix="b",
+            cache_dir_path=str(tmp_path),
+        ),
+        calls=calls,
+        domains_path=domains_path,
+    )
+
+
+def test_get_ds_data_cache(kws_ds_data):
+    kws, calls = kws_ds_data["kws"], kws_ds_data["calls"]
+    for layout in [None, "blocks"]:
+        df1 = domains.get_ds_data(layout=layout, **kws)
+        assert os.path.exists(domains.get_ds_data_path(layout=layout, **kws))
+        ## warm
+        df2 = domains.get_ds_data(layout=layout, **kws)
+        pd.testing.assert_frame_equal(df1.reset_index(drop=True), df2)
+    assert len(calls) == 2
+
+    ## invalidated by the change in the domains table
+    df0 = pd.read_parquet(kws_ds_data["domains_path"])
+    df0.assign(**{"d.end": df0["d.end"] + 1}).to_parquet(kws_ds_data["domains_path"])
+    df3 = domains.get_ds_data(layout=None, **kws)
+    assert len(calls) == 3
+    assert df3["d.end"].max() == df0["d.end"].max() + 1
+
+
+def test_get_ds_data_legacy(kws_ds_data):
+    kws = kws_ds_data["kws"]
+    ## the cache of the previous versions, replaced
+    cachep = domains.get_ds_data_path(layout="blocks", **kws)
+    legacyp = os.path.join(os.path.dirname(os.path.dirname(cachep)), "layout=blocks.pqt")
+    os.makedirs(os.path.dirname(legacyp), exist_ok=True)
+    pd.DataFrame({"a": [1]}).to_parquet(legacyp)
+    domains.get_ds_data(layout="blocks", **kws)
+    assert os.path.exists(cachep) and not os.path.exists(legacyp)
+    ## the custom cache directory, also as a positional argument
+    df1 = pd.read_parquet(kws_ds_data["domains_path"])
+    pd.testing.assert_frame_equal(domains.get_domains("homo sapiens", 1, kws["cache_dir_path"]), df1)
+    pd.testing.assert_frame_equal(
+        domains.get_domains(species="homo sapiens", ensembl_release=1, cache_dir_path=kws["cache_dir_path"]), df1
+    )
+
+
+def test_map_ppos_to_gpos(annots):
+    ts = [t for t in annots.transcripts() if t.biotype == "protein_coding"]
+    df_cds = domains.get_cds_ranges(annots, [t.protein_id for t in ts], strict=False)
+    for t in ts:
+        ## reference from the per-base expansion of the CDS
+        pos = sorted(
+            [p for start, end in t.coding_sequence_position_ranges for p in range(start, end + 1)],
+            reverse=t.strand == "-",
+        )
+        codons = [pos[i : i + 3] for i in range(0, len(pos), 3)]
+        aa_pos = list(range(1, len(codons) + 1))
+        for pstart in [True, False]:
+            gpos = domains.map_ppos_to_gpos(
+                df_cds,
+                protein_ids=[t.protein_id] * len(aa_pos),
+                aa_pos=aa_pos,
+                pstart=pstart,
+            )
+            assert gpos.tolist() == [
+                domains.get_p_bounds(p, pstart=pstart, strand=t.strand) for p in codons
+            ]
+    ## outside of the proteins
+    assert domains.map_ppos_to_gpos(df_cds, ["x", ts[0].protein_id], [1, 10**6], True).isnull().all()
+
+
+def test_to_gpos_batch(annots, monkeypatch):
+    monkeypatch.setattr(domains, "get_annots", lambda **kws: annots)
+    ts = [t for t in annots.transcripts() if t.biotype == "protein_coding"]
+    protein_ids = [t.protein_id for t in ts] + ["x"]
+    pd.testing.assert_frame_equal(
+        domains.get_cds_ranges(annots, protein_ids[:-1], strict=False),
+        domains.get_cds_ranges(annots, protein_ids, strict=False, batch=True),
+    )
+    ## without the start and stop codons in the GTF, none are complete; the codons are read once per database
+    domains._read_codon_lengths.cache_clear()
+    for _ in range(2):
+        assert len(domains.get_cds_ranges(annots, protein_ids, strict=True, batch=True)) == 0
+    assert domains._read_codon_lengths.cache_info().misses == 1
+    ## without the biotypes e.g. in the GTFs of the older releases
+    column_exists = annots.db.column_exists
+    monkeypatch.setattr(annots.db, "column_exists", lambda table, col: col != "transcript_biotype" and column_exists(table, col))
+    assert len(domains.get_cds_ranges(annots, protein_ids, strict=False, batch=True)) == 0
+    monkeypatch.undo()
+    monkeypatch.setattr(domains, "get_annots", lambda **kws: annots)
+    ## domains of all the genes
+    df3 = pd.DataFrame(
+        [
+            {"t.id": t.id, "p.id": t.protein_id, "d.id": f"domain{i}", "d.start": 5 + i * 20, "d.end": 30 + i * 40}
+            for t in ts
+            for i in range(3)
+        ]
+    )
+    kws = dict(ensembl_release=1, species="homo sapiens", strict=False)
+    pd.testing.assert_frame_equal(
+        domains.to_gpos(df3, **kws),
+        domains.to_gpos(df3, batch=True, **kws),
+    )
@@ -0,0 +1,34 @@
+import subprocess
+import sys
+import time
+
+## loaded only inside the functions that need them
+heavy = ["pandas", "matplotlib", "seaborn", "scipy", "roux", "pyensembl", "pyranges", "bioservices"]
+
+
+def get_import_times(code):
+    """Cumulative import times (seconds) by module, from `python -X importtime`."""
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_import_time():
+    for module in ["chrov", "chrov.run", "chrov.core", "chrov.cache"]:
+        times = get_import_times(f"import {module}")
+        assert not [k for k in heavy if k in times], (module, [k for k in heavy if k in times])
+        assert times[module] < 0.5, (module, times[module])
+    ## help of the command line
+    start = time.time()
+    subprocess.run([sys.executable, "-m", "chrov.run", "--help"], capture_output=True, check=True)
+    assert time.time() - start < 2
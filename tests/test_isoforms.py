@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from chrov.isoforms import get_blocks, get_blocks_batch
+
+
+def get_exons(gene_id, seed=0, n_ts=5, n_ex=8):
+    ## overlapping exons shared between the isoforms
+    rng = np.random.default_rng(seed)
+    starts = np.sort(rng.choice(np.arange(1000, 1000000, 500), n_ex, replace=False))
+    exons = []
+    for s in starts:
+        e = int(s + rng.integers(50, 400))
+        exons += [(int(s), e), (int(s + rng.integers(0, 40)), int(e + rng.integers(-40, 60)))]
+    return pd.DataFrame(
+        [
+            {
+                "t.id": f"{gene_id}T{t}",
+                "e.id": f"{gene_id}E{i}",
+                "e.start": exons[i][0],
+                "e.end": exons[i][1],
+            }
+            for t in range(n_ts)
+            for i in sorted(rng.choice(len(exons), size=n_ex, replace=False))
+        ]
+    )
+
+
+def test_get_blocks():
+    df1 = get_exons("g1")
+    df2 = get_blocks(df1)
+    assert len(df2) == len(df1)
+    ## blocks are numbered from 1 and the exons are projected inside their blocks
+    assert df2["b.id"].min() == 1
+    assert (df2["eb.start"] >= df2["b.id"]).all()
+    assert (df2["eb.end"] <= df2["b.id"] + 0.9 + 1e-9).all()
+    assert (df2["eb.id"] == df2.apply(lambda x: f"{x['eb.start']}-{x['eb.end']}", axis=1)).all()
+
+
+def test_get_blocks_batch():
+    data = {f"g{i}": get_exons(f"g{i}", seed=i) for i in range(3)}
+    df1 = get_blocks_batch(data, col_group="g.id")
+    for k, df in data.items():
+        pd.testing.assert_frame_equal(
+            df1.query(f"`g.id` == '{k}'").drop(["g.id"], axis=1).reset_index(drop=True),
+            get_blocks(df),
+        )
@@ -0,0 +1,150 @@
+import io
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse import coo_matrix
+
+from chrov.plot.mat import get_band_blocks, plot_tri
+
+
+def render(matrix, **kws):
+    fig, ax = plt.subplots(figsize=[6, 3])
+    plot_tri(matrix, ax=ax, proportional=False, **kws)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=100)
+    plt.close(fig)
+    buf.seek(0)
+    return plt.imread(buf)
+
+
+def test_plot_tri_banded():
+    ## decay with the distance from the diagonal
+    i = np.arange(300)
+    matrix = np.exp(-np.abs(i[None, :] - i[:, None]) / 20) * (1 + np.sin(i / 15))[:, None]
+    for kws in [dict(), dict(max_dist=50, smoothing_sigma=2)]:
+        image = render(pd.DataFrame(matrix), banded=False, **kws)
+        for m in [matrix, coo_matrix(matrix)]:
+            ## same looks, except at the edges
+            assert (np.abs(render(m, banded=True, downsample=1, **kws) - image).max(axis=2) > 0.05).mean() < 0.005
+
+
+def get_banded(n=20000, size=10**6):
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, n, size)
+    cols = np.minimum(rows + np.abs(rng.normal(0, 50, len(rows))).astype(int), n - 1)
+    return coo_matrix((rng.random(len(rows)), (rows, cols)), shape=(n, n))
+
+
+def test_get_band_blocks():
+    n = 20000
+    matrix = get_banded(n)
+    blocks = get_band_blocks(matrix, max_dist=1000, factor=50)
+    ## the band of the bins, only
+    assert sum(values.size for _, _, values in blocks) < 2 * (n // 50) * (1000 // 50 + 1) * 2
+    ## bin means of a dense block
+    row_edges, col_edges, values = blocks[0]
+    dense = matrix.tocsr()[: row_edges[-1], : col_edges[-1]].toarray()
+    assert np.isclose(values[1, 2], dense[50:100, 100:150].mean())
+    assert np.isnan(values[1, 0])
+
+
+@pytest.mark.benchmark
+def test_get_band_blocks_benchmark():
+    matrix = get_banded()
+    start = time.time()
+    get_band_blocks(matrix, max_dist=1000, factor=50)
+    assert time.time() - start < 5
+
+
+def test_read_level(tmp_path):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    from chrov.fig.mat import read_level
+
+    i = np.arange(1500)
+    matrix = np.exp(-np.abs(i[None, :] - i[:, None]) / 20)
+    matrix[matrix < 1e-3] = 0
+    sparse = coo_matrix(matrix)
+    triplets = pd.DataFrame({"row": sparse.row, "col": sparse.col, "value": sparse.data})
+    triplets.to_parquet(tmp_path / "sparse.pqt")
+    feather.write_feather(pa.table(triplets), str(tmp_path / "sparse.arrow"), compression="uncompressed")
+    feather.write_feather(
+        pa.table({str(k): matrix[:, k] for k in range(matrix.shape[1])}),
+        str(tmp_path / "dense.arrow"),
+        compression="uncompressed",
+    )
+    np.save(tmp_path / "dense.npy", matrix)
+    image = render(matrix, max_dist=100)
+    for name in ["sparse.pqt", "sparse.arrow", "dense.arrow", "dense.npy"]:
+        level = read_level(tmp_path / name)
+        assert not isinstance(level, np.ndarray) or isinstance(level, np.memmap)
+        assert np.array_equal(render(level, max_dist=100), image), name
+    ## the trailing empty rows and columns
+    matrix[-10:, :] = 0
+    matrix[:, -10:] = 0
+    sparse = coo_matrix(matrix)
+    table = pa.table({"row": sparse.row, "col": sparse.col, "value": sparse.data})
+    pq.write_table(table.replace_schema_metadata({b"shape": b"[1500, 1500]"}), tmp_path / "sparse.pqt")
+    feather.write_feather(table, str(tmp_path / "sparse.arrow"), compression="uncompressed")
+    image = render(matrix, max_dist=100)
+    for level in [read_level(tmp_path / "sparse.pqt"), read_level(tmp_path / "sparse.arrow", shape=matrix.shape)]:
+        assert level.shape == matrix.shape
+        assert np.array_equal(render(level, max_dist=100), image)
+    ## inferred otherwise
+    level = read_level(tmp_path / "sparse.arrow")
+    assert level.shape == (1490, 1490) and not np.array_equal(render(level, max_dist=100), image)
+
+
+def test_plot_levels_jobs(offline, tmp_path):
+    from chrov.fig.mat import Plot_levels
+
+    plot_levels = Plot_levels(gene_id="ENSG00000187634")
+    i = np.arange(200)
+    levels = {level: np.exp(-np.abs(i[None, :] - i[:, None]) / 20) for level in ["genome", "gene", "domain"]}
+    ax = plot_levels.plot(levels, outd=str(tmp_path / "plot"))
+    assert isinstance(ax, plt.Axes)
+    for jobs, outd in [(1, "serial"), (2, "parallel")]:
+        plotps = plot_levels.to_plots(levels, outd=str(tmp_path / outd), jobs=jobs)
+        assert plotps == [str(tmp_path / f"{outd}/{level}.png") for level in levels]
+    for level in levels:
+        assert np.array_equal(plt.imread(tmp_path / f"serial/{level}.png"), plt.imread(tmp_path / f"parallel/{level}.png"))
+
+
+def test_get_gid_info(annots, monkeypatch, tmp_path):
+    import json
+    import requests
+    import chrov.annots
+    from chrov.core import get_genes_path, ingest_biomart_tsv
+    from chrov.fig.mat import get_gid_info
+
+    def get(*args, **kws):
+        raise AssertionError("no network")
+
+    monkeypatch.setattr(requests, "get", get)
+    monkeypatch.setattr("chrov.core.get_cache_dir_path", lambda **kws: f"{tmp_path}/")
+    ## from the local pyensembl database
+    monkeypatch.setattr(chrov.annots, "get_annots", lambda **kws: annots)
+    g = next(iter(annots.genes()))
+    info = get_gid_info(g.id, ensembl_release=1)
+    assert (info["seq_region_name"], info["start"], info["end"]) == (g.contig, g.start, g.end)
+    ## from the genes table
+    monkeypatch.setattr(chrov.annots, "get_annots", lambda **kws: None)
+    genes_path = get_genes_path(species="homo sapiens", release=1)
+    ## as fetched by `query_genes`, with the header of the BioMart response
+    tsv = "Gene stable ID\tGene name\tChromosome/scaffold name\tGene start (bp)\tGene end (bp)\tStrand\n"
+    tsv += "G0\tGENE0\t1\t1\t5\t1\nG1\tGENE1\tX\t10\t20\t-1\n"
+    ingest_biomart_tsv(io.BytesIO(tsv.encode()), genes_path)
+    info = get_gid_info("G1", ensembl_release=1)
+    assert (info["seq_region_name"], info["start"], info["strand"]) == ("X", 10, -1)
+    ## from the on-disk cache of the REST lookups
+    (tmp_path / "G2.json").write_text(json.dumps({"seq_region_name": "2"}))
+    assert get_gid_info("G2", ensembl_release=1)["seq_region_name"] == "2"
+    with pytest.raises(KeyError):
+        get_gid_info("G3", ensembl_release=1, remote=False)
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+
+def test_plot_batch(offline, tmp_path):
+    from chrov.run import plot_batch
+
+    i = np.arange(100)
+    for gene_id in ["G1", "G2"]:
+        (tmp_path / gene_id / "ints").mkdir(parents=True)
+        for level in ["genome", "chromosome"]:
+            np.save(tmp_path / gene_id / "ints" / f"{level}.npy", np.exp(-np.abs(i[None, :] - i[:, None]) / 10))
+    (tmp_path / "genes.txt").write_text("G1\nG2\n# comment\nG3\n")
+    kws = dict(
+        genes_path=str(tmp_path / "genes.txt"),
+        outd=str(tmp_path / "outputs"),
+        levels_path=str(tmp_path / "{gene_id}/ints.yaml"),
+    )
+    for jobs, statuses in [(2, ["done", "done", "failed"]), (1, ["skipped", "skipped", "failed"])]:
+        plot_batch(**kws, jobs=jobs)
+        df1 = pd.read_table(tmp_path / "outputs/manifest.tsv")
+        assert df1["gene_id"].tolist() == ["G1", "G2", "G3"]
+        assert df1["status"].tolist() == statuses
+    assert (tmp_path / "outputs/G2/chromosome.png").exists()
+    assert "no levels found" in df1["error"].iloc[2]
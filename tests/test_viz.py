@@ -0,0 +1,70 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.filterwarnings("error:Mismatched null-like values:FutureWarning")
+def test_plot_forms_layout_cache(annots, tmp_path, monkeypatch):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import chrov.domains
+    import chrov.isoforms
+    from chrov.annots import build_ts_store, get_ts_data
+    from chrov.viz import plot_forms
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    build_ts_store(ensembl_release=1, species="homo sapiens", annots=annots, cache_dir_path=str(tmp_path))
+    calls = []
+
+    def get_ts_data_(**kws):
+        calls.append(kws["gene_id"])
+        return get_ts_data(**{**kws, "cache_dir_path": str(tmp_path)})
+
+    def to_gpos(data, **kws):
+        df = get_ts_data_(**kws_gene, protein_coding=True, cds_prefix="c").drop_duplicates("e.id").head(3)
+        return pd.DataFrame(
+            {
+                "t.id": df["t.id"],
+                "d.id": [f"D{i}" for i in range(len(df))],
+                "d.start": df["e.start"] + 5,
+                "d.end": df["e.end"] - 5,
+            }
+        )
+
+    monkeypatch.setattr(chrov.isoforms, "get_ts_data", get_ts_data_)
+    monkeypatch.setattr(chrov.domains, "get_ds_data", lambda **kws: pd.DataFrame({"t.id": ["T1"]}))
+    monkeypatch.setattr(chrov.domains, "to_gpos", to_gpos)
+    kws_gene = dict(gene_id=next(iter(annots.genes())).id, ensembl_release=1, species="homo sapiens")
+
+    def render(**kws):
+        fig, ax = plt.subplots(figsize=[4, 2])
+        data = plot_forms(**kws_gene, biotype="t", layout="blocks", protein_coding=True, return_data=True, ax=ax, **kws)
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=80)
+        plt.close(fig)
+        buf.seek(0)
+        return data, plt.imread(buf)
+
+    data1, image1 = render()
+    assert len(calls) == 2
+    ## drawn from the cached layout
+    data2, image2 = render()
+    assert len(calls) == 2
+    pd.testing.assert_frame_equal(data1, data2)
+    assert np.array_equal(image1, image2)
+    ## restyled, without the recompute
+    _, image3 = render(color_exons="pink")
+    assert len(calls) == 2
+    assert not np.array_equal(image2, image3)
+    ## recomputed
+    render(force=True)
+    assert len(calls) == 4
+    ## the data-affecting parameters, cached apart
+    from chrov.viz import get_layout_path
+
+    kws = dict(**kws_gene, biotype="t", layout="blocks")
+    assert get_layout_path(**kws, kws_layout=dict(cds_prefix="x")) != get_layout_path(**kws)
@@ -0,0 +1,74 @@
+import io
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from chrov.viz.annot import pack_labels
+from chrov.viz.figure import plot_with_chroms
+
+
+def test_annot_labels_leaders():
+    cytobands = pd.read_table("modules/inputs/cytobands.tsv", index_col=[0])
+    data = (
+        pd.read_table("modules/inputs/genes.tsv", index_col=[0])
+        .sample(20, random_state=11)
+        .assign(value=lambda df: np.linspace(0.1, 1, len(df)))
+    )
+    for arc, loc in [(False, "out"), (False, "in"), (True, "out")]:
+        images, artists = {}, {}
+        for leaders in ["patches", "collection"]:
+            plot_with_chroms(
+                data=data.copy(),
+                cytobands=cytobands,
+                kind="stem",
+                colx="gene start",
+                coly="value",
+                col_label="gene symbol",
+                xkind="loci",
+                chrom_y=0,
+                arc=arc,
+                va="center" if arc else "bottom",
+                off=0.2,
+                offy=0.1,
+                figsize=[5, 5] if arc else [8, 2],
+                kws_annot_labels=dict(loc=loc, leaders=leaders),
+            )
+            fig = plt.gcf()
+            artists[leaders] = len(fig.artists)
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", dpi=80)
+            plt.close(fig)
+            buf.seek(0)
+            images[leaders] = plt.imread(buf)
+        ## a collection per leg, instead of a patch per line
+        assert artists["collection"] == 5 and artists["patches"] == 5 * len(data)
+        assert (np.abs(images["collection"] - images["patches"]).max(axis=2) > 0.05).mean() < 0.002
+
+
+def test_pack_labels():
+    ## sparse labels stay at their anchors
+    assert np.allclose(pack_labels([3, 1, 5], 1, lim=(0, 10)), [3, 1, 5])
+    assert np.allclose(pack_labels([1, 1, 1, 9.9], 1, lim=(0, 10)), [0.5, 1.5, 2.5, 9.5])
+    ## genome-wide
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 100, 5000)
+    positions = pack_labels(x, 0.015, lim=(0, 100))
+    order = np.argsort(x, kind="stable")
+    assert (np.diff(positions[order]) >= 0.015 - 1e-9).all()
+    assert positions.min() >= 0 and positions.max() <= 100
+    ## labels that do not fit are spread evenly
+    assert np.allclose(np.diff(pack_labels(x[:10], 20, lim=(0, 100))[np.argsort(x[:10])]), 80 / 9)
+
+
+@pytest.mark.benchmark
+def test_pack_labels_benchmark():
+    x = np.random.default_rng(0).uniform(0, 100, 5000)
+    start = time.time()
+    pack_labels(x, 0.015, lim=(0, 100))
+    assert time.time() - start < 1
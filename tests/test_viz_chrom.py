@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from chrov.viz.chrom import (
+    format_chrom_names,
+    sort_chrom_names,
+    get_genome_offsets,
+    to_genome_coords,
+    _concat_chroms,
+)
+
+
+def get_loci(n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "chromosome": rng.choice(np.array(["1", "2", "10", "X", 3.0], dtype=object), n),
+            "start": rng.integers(1, 10**6, n),
+        }
+    ).assign(end=lambda df: df["start"] + 100)
+
+
+def test_sort_chrom_names():
+    names = format_chrom_names(pd.Series(["X", "10", 2, 1.0, "MT", "2"]))
+    assert names.tolist() == ["X", 10, 2, 1, "MT", 2]
+    assert sort_chrom_names(names) == [1, 2, 10, "MT", "X"]
+
+
+def test_to_genome_coords():
+    df1 = _concat_chroms(
+        get_loci(),
+        col_start="start",
+        col_end="end",
+        col_chroms_start="genome start",
+        col_chroms_end="genome end",
+    )
+    assert df1["chromosome"].cat.categories.tolist() == [1, 2, 3, 10, "X"]
+    assert (df1.groupby("chromosome", observed=True)["start"].apply(lambda x: x.is_monotonic_increasing)).all()
+    genome_offsets = get_genome_offsets(df1.groupby("chromosome", observed=True)["end"].max().cumsum())
+    assert np.array_equal(
+        to_genome_coords(df1["chromosome"], df1["start"], genome_offsets),
+        df1["genome start"].to_numpy(),
+    )
+
+
+def test_plot_chroms_collection():
+    import io
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from chrov.viz.chrom import plot_chroms
+
+    cytobands = pd.read_table("modules/inputs/cytobands.tsv", index_col=[0])
+    images, artists = {}, {}
+    for collection in [False, True]:
+        fig, ax = plt.subplots(figsize=[10, 2])
+        plot_chroms(cytobands, arc=False, ax=ax, collection=collection)
+        artists[collection] = len(ax.lines) + len(ax.collections)
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", dpi=100)
+        plt.close(fig)
+        buf.seek(0)
+        images[collection] = plt.imread(buf)
+    assert artists[True] * 10 < artists[False]
+    ## same looks, except at the edges of the cytobands
+    assert (np.abs(images[True] - images[False]).max(axis=2) > 0.05).mean() < 0.002
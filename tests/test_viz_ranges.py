@@ -0,0 +1,79 @@
+import io
+import time
+
+import matplotlib
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+from chrov.viz.ranges import plot_ranges
+
+
+def get_gene(n_ts=100, n_ex=50, seed=0):
+    """A large synthetic gene, with many isoforms."""
+    rng = np.random.default_rng(seed)
+    starts = np.sort(rng.choice(np.arange(1000, 10**6, 100), n_ex * 2, replace=False))
+    return pd.DataFrame(
+        [
+            {
+                "t.id": f"T{t:03d}",
+                "e.start": starts[i],
+                "e.end": starts[i] + int(rng.integers(50, 400)),
+                "type": rng.choice(["a", "b", "c"]),
+            }
+            for t in range(n_ts)
+            for i in sorted(rng.choice(len(starts), n_ex, replace=False))
+        ]
+    )
+
+
+def to_image(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=50)
+    plt.close(fig)
+    buf.seek(0)
+    return plt.imread(buf)
+
+
+def plot_ranges_lines(df1, colors, **kws):
+    ## reference: a line per range
+    fig, ax = plt.subplots(figsize=[8, 20])
+    plot_ranges(df1, hue="type", colors=colors, ax=ax, **kws)
+    ax.collections[0].remove()
+    y = df1.groupby("t.id", sort=False).ngroup()
+    for i, x in df1.iterrows():
+        ax.hlines(y=y[i], xmin=x["e.start"], xmax=x["e.end"], color=colors[x["type"]], lw=10)
+    return to_image(fig)
+
+
+def plot_ranges_collection(df1, colors, **kws):
+    fig, ax = plt.subplots(figsize=[8, 20])
+    plot_ranges(df1, hue="type", colors=colors, ax=ax, **kws)
+    assert len(ax.collections) == 1
+    return to_image(fig)
+
+
+kws_benchmark = dict(col_id="t.id", col_start="e.start", col_end="e.end", kind="joined", show_labels=False)
+colors_benchmark = {"a": "r", "b": "g", "c": "b"}
+
+
+def test_plot_ranges_collection():
+    df1 = get_gene()
+    image = plot_ranges_collection(df1, colors_benchmark, **kws_benchmark)
+    image_ref = plot_ranges_lines(df1, colors_benchmark, **kws_benchmark)
+    assert np.abs(image - image_ref).max() == 0
+
+
+@pytest.mark.benchmark
+def test_plot_ranges_benchmark():
+    df1 = get_gene()
+    timings = {}
+    for name, f in {"collection": plot_ranges_collection, "lines": plot_ranges_lines}.items():
+        start = time.time()
+        f(df1, colors_benchmark, **kws_benchmark)
+        timings[name] = time.time() - start
+    print(timings)
+    assert timings["collection"] < timings["lines"]
\ No newline at end of file